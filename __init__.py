@@ -1,52 +1,149 @@
+'''Menu registration. Kept cheap, since Binary Ninja loads it on every
+start: the task modules, and graphviz with them, are imported by the first
+command that needs them.
+'''
 from binaryninja import *
-from .flowgraph import *
-from .list_comments import *
-from .textify_function import *
+import importlib
+
+from .demangle import cxxfilt_available
+
+
+# Task class -> module it's defined in.
+TASKS = {
+    'BinocularsFlowgraph': '.flowgraph',
+    'BinocularsListComments': '.list_comments',
+    'BinocularsTextifyFunction': '.textify_function',
+    'BinocularsTextifyBinary': '.textify_binary',
+}
+
+
+def _task(name):
+    '''Returns the task class name, importing its module on first use.'''
+    return getattr(importlib.import_module(TASKS[name], __name__), name)
+
+
+def __getattr__(name):
+    # Task classes stay importable from the package, e.g. for scripts.
+    if name in TASKS:
+        return _task(name)
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
 
 
 
 def __flowgraph(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, None)
+    flowgraph = _task('BinocularsFlowgraph')(bv, None)
+    flowgraph.start()
+
+def __flowgraph_svg(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, image_format='svg')
+    flowgraph.start()
+
+def __flowgraph_live(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, live=True)
+    flowgraph.start()
+
+def __flowgraph_live_bn(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, demangle='bn', live=True)
+    flowgraph.start()
+
+def __flowgraph_live_cppfilt(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, demangle='cppfilt', live=True)
     flowgraph.start()
 
 def __flowgraph_to_function(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, function)
+    flowgraph = _task('BinocularsFlowgraph')(bv, function)
     flowgraph.start()
 
 def __flowgraph_cppfilt(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, None, demangle='cppfilt')
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, demangle='cppfilt')
     flowgraph.start()
 
 def __flowgraph_to_function_cppfilt(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, function, demangle='cppfilt')
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, demangle='cppfilt')
     flowgraph.start()
 
 def __flowgraph_bn(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, None, demangle='bn')
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, demangle='bn')
     flowgraph.start()
 
 def __flowgraph_to_function_bn(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, function, demangle='bn')
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, demangle='bn')
+    flowgraph.start()
+
+def __flowgraph_path(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='path')
+    flowgraph.start()
+
+def __flowgraph_path_bn(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='path', demangle='bn')
+    flowgraph.start()
+
+def __flowgraph_diff(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, method='diff')
+    flowgraph.start()
+
+def __flowgraph_diff_bn(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, None, method='diff', demangle='bn')
+    flowgraph.start()
+
+def __flowgraph_explore(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='explore')
+    flowgraph.start()
+
+def __flowgraph_explore_bn(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='explore', demangle='bn')
     flowgraph.start()
 
 def __list_comments(bv):
-    list_comments = BinocularsListComments(bv)
+    list_comments = _task('BinocularsListComments')(bv)
+    list_comments.start()
+
+def __search_comments(bv):
+    list_comments = _task('BinocularsListComments')(bv, search=True)
     list_comments.start()
 
 def __textify_function(bv, function):
-    textify_function = BinocularsTextifyFunction(bv, function)
+    textify_function = _task('BinocularsTextifyFunction')(bv, function)
     textify_function.start()
 
+def __textify_binary(bv):
+    textify_binary = _task('BinocularsTextifyBinary')(bv)
+    textify_binary.start()
+
+def __load_textify_index(bv):
+    filename = get_open_filename_input("Textify listing", "*.txt")
+    if not filename:
+        return
+    if isinstance(filename, bytes):
+        filename = filename.decode('utf-8')
+    textify_index = importlib.import_module('.textify_index', __name__)
+    try:
+        textify_index.get_textify_indexes(bv).add(filename)
+    except ValueError as e:
+        show_message_box('Binoculars Textify', str(e))
+
 def __flowgraph_from_function_bn(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, function, method='from_function', demangle='bn')
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='from_function', demangle='bn')
     flowgraph.start()
 
 def __flowgraph_from_function_raw(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, function, method='from_function', demangle='raw')
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='from_function', demangle='raw')
     flowgraph.start()
 
 def __flowgraph_from_function_cppfilt(bv, function):
-    flowgraph = BinocularsFlowgraph(bv, function, method='from_function', demangle='cppfilt')
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='from_function', demangle='cppfilt')
+    flowgraph.start()
+
+def __flowgraph_from_function_depth_bn(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='from_function', demangle='bn', ask_depth=True)
+    flowgraph.start()
+
+def __flowgraph_from_function_depth_raw(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='from_function', demangle='raw', ask_depth=True)
+    flowgraph.start()
+
+def __flowgraph_from_function_depth_cppfilt(bv, function):
+    flowgraph = _task('BinocularsFlowgraph')(bv, function, method='from_function', demangle='cppfilt', ask_depth=True)
     flowgraph.start()
 
 # UI menu items
@@ -56,12 +153,30 @@ PluginCommand.register(
     __list_comments
 )
 
+PluginCommand.register(
+    "[BINoculars]\\Search Comments",
+    "Keyword, substring or regex search of all comments",
+    __search_comments
+)
+
 PluginCommand.register_for_function(
     "[BINoculars]\\Textify Function",
     "",
     __textify_function
 )
 
+PluginCommand.register(
+    "[BINoculars]\\Textify Binary",
+    "Every function to one file, with an offset index",
+    __textify_binary
+)
+
+PluginCommand.register(
+    "[BINoculars]\\Load Textify Index",
+    "Serve Textify Function from an existing listing and its index",
+    __load_textify_index
+)
+
 PluginCommand.register_for_function(
     "[BINoculars]\\Flowgraph\\Binary\\Raw",
     "Best integrity",
@@ -80,6 +195,24 @@ PluginCommand.register_for_function(
     __flowgraph_bn
 )
 
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Binary\\Raw (SVG)",
+    "Scalable image, large graphs are paginated",
+    __flowgraph_svg
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Binary\\Live\\Raw",
+    "Kept in sync with analysis between runs",
+    __flowgraph_live
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Binary\\Live\\Bn",
+    "Kept in sync with analysis between runs",
+    __flowgraph_live_bn
+)
+
 PluginCommand.register_for_function(
     "[BINoculars]\\Flowgraph\\Function to\\Bn",
     "",
@@ -98,16 +231,68 @@ PluginCommand.register_for_function(
     __flowgraph_from_function_bn
 )
 
-# Only display menu option if module installed
-try:
-    import cxxfilt
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Function from\\Raw (N levels)",
+    "Callees reachable within N calls",
+    __flowgraph_from_function_depth_raw
+)
 
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Function from\\Bn (N levels)",
+    "Callees reachable within N calls",
+    __flowgraph_from_function_depth_bn
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Path between\\Raw",
+    "Shortest call paths from this function to another",
+    __flowgraph_path
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Path between\\Bn",
+    "Shortest call paths from this function to another",
+    __flowgraph_path_bn
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Diff against\\Raw",
+    "Calls added and removed since a previous version",
+    __flowgraph_diff
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Diff against\\Bn",
+    "Calls added and removed since a previous version",
+    __flowgraph_diff_bn
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Explore\\Raw",
+    "Callers and callees two calls away, expanded on request",
+    __flowgraph_explore
+)
+
+PluginCommand.register_for_function(
+    "[BINoculars]\\Flowgraph\\Explore\\Bn",
+    "Callers and callees two calls away, expanded on request",
+    __flowgraph_explore_bn
+)
+
+# Only display menu option if module installed
+if cxxfilt_available():
     PluginCommand.register_for_function(
         "[BINoculars]\\Flowgraph\\Binary\\C++filt",
         "",
         __flowgraph_cppfilt
     )
 
+    PluginCommand.register_for_function(
+        "[BINoculars]\\Flowgraph\\Binary\\Live\\C++filt",
+        "Kept in sync with analysis between runs",
+        __flowgraph_live_cppfilt
+    )
+
     PluginCommand.register_for_function(
         "[BINoculars]\\Flowgraph\\Function to\\C++filt",
         "",
@@ -120,5 +305,11 @@ try:
         __flowgraph_from_function_cppfilt
     )
 
-except ImportError:
+    PluginCommand.register_for_function(
+        "[BINoculars]\\Flowgraph\\Function from\\C++filt (N levels)",
+        "Callees reachable within N calls",
+        __flowgraph_from_function_depth_cppfilt
+    )
+
+else:
     print('cxxfilt not installed')
@@ -0,0 +1,213 @@
+'''Headless batch runs of BINoculars analyses over a directory of binaries.
+
+Usage, from the directory holding the plugin:
+    python -m <plugin>.batch INPUT_DIR OUTPUT_DIR [--workers N] [--timeout S]
+        [--analyses flowgraph,textify,comments]
+
+Every binary is opened in its own process, up to --workers at a time, and
+killed if it takes longer than --timeout seconds. For a binary named NAME
+the output directory receives:
+    NAME.flowgraph.jsonl    Whole binary call graph, see export.py.
+    NAME.textify.txt        Disassembly listing of every function.
+    NAME.textify.txt.idx    Offset of each function in it, see textify_index.py.
+    NAME.comments.txt       Function comments.
+    NAME.status.json        Outcome, seconds and statistics per analysis.
+and summary.json holds the outcome of every binary.
+'''
+from binaryninja import *
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import time
+import traceback
+from collections import deque
+
+from .export import export_graph
+from .flowgraph import BinocularsFlowgraph
+from .list_comments import BinocularsListComments
+from .textify_binary import BinocularsTextifyBinary
+
+
+ANALYSES = ('flowgraph', 'textify', 'comments')
+BATCH_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+# Seconds allowed per binary, analysis included.
+BATCH_TIMEOUT = 1800
+
+
+def find_binaries(directory):
+    '''Returns the path of every regular file below directory, sorted.'''
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            path = os.path.join(root, name)
+            if not name.startswith('.') and os.path.isfile(path):
+                paths.append(path)
+    return sorted(paths)
+
+
+def output_name(directory, path):
+    '''Output file prefix of path, unique within directory.'''
+    return os.path.relpath(path, directory).replace(os.sep, '_')
+
+
+# The tasks below run on the calling thread and are never started, so each
+# one is finished by hand, or Binary Ninja keeps listing it as running.
+
+def run_flowgraph(bv, prefix):
+    flowgraph = BinocularsFlowgraph(bv, None)
+    try:
+        graph = flowgraph.build_flowgraph_to_bin()
+        with flowgraph.stats.phase('export'):
+            export_graph(graph, prefix + '.flowgraph.jsonl', 'jsonl')
+        return flowgraph.stats.summary()
+    finally:
+        flowgraph.finish()
+
+
+def run_textify(bv, prefix):
+    textify = BinocularsTextifyBinary(bv)
+    try:
+        textify.textify_binary(prefix + '.textify.txt')
+        return textify.stats.summary()
+    finally:
+        textify.finish()
+
+
+def run_comments(bv, prefix):
+    comments = BinocularsListComments(bv)
+    try:
+        with open(prefix + '.comments.txt', 'w', encoding='utf-8') as f:
+            f.write(comments.multi_line_text())
+        return comments.stats.summary()
+    finally:
+        comments.finish()
+
+
+RUNNERS = {
+    'flowgraph': run_flowgraph,
+    'textify': run_textify,
+    'comments': run_comments,
+}
+
+
+def analyse_binary(path, prefix, analyses):
+    '''Worker process: runs analyses on path, writes prefix.* files.'''
+    status = {'path': path, 'status': 'ok', 'seconds': {}}
+    started = time.time()
+
+    bv = BinaryViewType.get_view_of_file(path)
+    if bv is None:
+        status['status'] = 'unsupported'
+    else:
+        try:
+            status['seconds']['analysis'] = time.time() - started
+            for analysis in analyses:
+                phase = time.time()
+                try:
+                    status.setdefault('stats', {})[analysis] = RUNNERS[analysis](bv, prefix)
+                except Exception:
+                    status['status'] = 'failed'
+                    status.setdefault('errors', {})[analysis] = traceback.format_exc()
+                status['seconds'][analysis] = time.time() - phase
+        finally:
+            bv.file.close()
+
+    status['seconds']['total'] = time.time() - started
+    with open(prefix + '.status.json', 'w') as f:
+        json.dump(status, f, indent=2, sort_keys=True)
+
+
+def _finished(path, prefix, proc):
+    try:
+        with open(prefix + '.status.json') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {'path': path, 'status': 'crashed', 'exitcode': proc.exitcode}
+
+
+def run_batch(paths, input_dir, output_dir, analyses=ANALYSES,
+    workers=BATCH_WORKERS, timeout=BATCH_TIMEOUT):
+    '''Runs analyses on every binary in paths, workers processes at a time.
+
+    Returns:
+        Dict of path to status dict. summary.json receives the list of
+        status dicts, in the order of paths.
+    '''
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    # binaryninja's core can't be forked safely.
+    context = multiprocessing.get_context('spawn')
+    pending = deque(paths)
+    running = {}
+    results = {}
+
+    while pending or running:
+        while pending and len(running) < workers:
+            path = pending.popleft()
+            prefix = os.path.join(output_dir, output_name(input_dir, path))
+            if os.path.exists(prefix + '.status.json'):
+                # Left by an earlier run.
+                os.remove(prefix + '.status.json')
+            proc = context.Process(target=analyse_binary, args=(path, prefix, analyses))
+            proc.start()
+            running[proc] = (path, prefix, time.time() + timeout)
+
+        now = time.time()
+        deadline = min(entry[2] for entry in running.values())
+        multiprocessing.connection.wait([proc.sentinel for proc in running],
+            timeout=max(0, deadline - now))
+
+        now = time.time()
+        for proc in list(running):
+            path, prefix, deadline = running[proc]
+            if not proc.is_alive():
+                proc.join()
+                results[path] = _finished(path, prefix, proc)
+            elif now >= deadline:
+                proc.terminate()
+                proc.join(5)
+                if proc.is_alive():
+                    proc.kill()
+                    proc.join()
+                results[path] = {'path': path, 'status': 'timeout', 'timeout': timeout}
+            else:
+                continue
+
+            del running[proc]
+            print('{}: {}'.format(path, results[path]['status']))
+
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as f:
+        json.dump([results[path] for path in paths], f, indent=2, sort_keys=True)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run BINoculars analyses over a directory of binaries.')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS)
+    parser.add_argument('--timeout', type=float, default=BATCH_TIMEOUT,
+        help='seconds allowed per binary')
+    parser.add_argument('--analyses', default=','.join(ANALYSES),
+        help='comma separated, from {}'.format(', '.join(ANALYSES)))
+    args = parser.parse_args(argv)
+
+    analyses = [analysis for analysis in args.analyses.split(',') if analysis]
+    for analysis in analyses:
+        if analysis not in RUNNERS:
+            parser.error('unknown analysis {}'.format(analysis))
+
+    results = run_batch(find_binaries(args.input_dir), args.input_dir,
+        args.output_dir, analyses, max(1, args.workers), args.timeout)
+
+    failed = [path for path, result in results.items() if result['status'] != 'ok']
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,235 @@
+'''Benchmarks of the plugin on synthetic binaries, see synthetic.py.
+
+Usage:
+    python benchmarks/bench.py [--functions N] [--distribution powerlaw]
+        [--repeat R] [--output results.json] [--compare baseline.json]
+
+Each case runs --repeat times on a freshly generated view. Results are
+printed and, with --output, written as JSON holding the plugin version, the
+generator parameters and every run's seconds. --compare prints the ratio of
+each case's best time to the one in an earlier results file.
+
+Neither Binary Ninja nor graphviz needs to be installed.
+'''
+import argparse
+import atexit
+import contextlib
+import importlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import synthetic
+
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_plugin():
+    '''Imports the plugin package on top of the synthetic binaryninja.'''
+    synthetic.install()
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    name = os.path.basename(PLUGIN_DIR)
+
+    plugin = importlib.import_module(name)
+    modules = dict((module, importlib.import_module('{}.{}'.format(name, module)))
+        for module in ('callgraph', 'demangle', 'flowgraph', 'graph_cache',
+            'textify_function'))
+    return plugin, modules
+
+
+def plugin_version():
+    try:
+        with open(os.path.join(PLUGIN_DIR, 'plugin.json')) as f:
+            return json.load(f)['plugin']['version']
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def hub(bv):
+    '''The function with the most callers.'''
+    return max(bv.functions, key=lambda function: (len(bv._refs_to.get(function.start, [])),
+        -function.start))
+
+
+def cases(modules, params):
+    '''Yields (name, setup) pairs. setup(bv) returns the callable timed.'''
+    flowgraph = modules['flowgraph']
+    callgraph = modules['callgraph']
+    demangle = modules['demangle']
+    graph_cache = modules['graph_cache']
+    textify = modules['textify_function']
+
+    cache_directory = tempfile.mkdtemp(prefix='binoculars-bench-')
+    atexit.register(shutil.rmtree, cache_directory, True)
+
+    def flowgraph_object(bv, **kwargs):
+        # No disk cache, so every run collects from scratch.
+        return flowgraph.BinocularsFlowgraph(bv, None, cache=False, **kwargs)
+
+    def to_bin(bv):
+        return flowgraph_object(bv).build_flowgraph_to_bin
+
+    def to_bin_serial(bv):
+        return flowgraph_object(bv, workers=1).build_flowgraph_to_bin
+
+    def cached_object(bv):
+        bv.session_data['binoculars.graph_cache'] = graph_cache.GraphCache(bv,
+            cache_directory)
+        return flowgraph.BinocularsFlowgraph(bv, None)
+
+    def to_bin_cache_hit(bv):
+        # Compare with build_flowgraph_to_bin, which doesn't use the cache.
+        fg = cached_object(bv)
+        fg.build_flowgraph_to_bin()
+        return fg.build_flowgraph_to_bin
+
+    def to_bin_cache_load(bv):
+        # The cache file written by an earlier session.
+        cached_object(bv).build_flowgraph_to_bin()
+        return cached_object(bv).build_flowgraph_to_bin
+
+    def to_function(bv):
+        fg = flowgraph_object(bv)
+        function = hub(bv)
+        return lambda: fg.build_flowgraph_to_function(function, callgraph.CallGraph())
+
+    def from_function(bv):
+        fg = flowgraph_object(bv)
+        function = bv.functions[0]
+        return lambda: fg.build_flowgraph_from_function(function, callgraph.CallGraph(),
+            max_depth=params['depth'])
+
+    def demangle_cold(mode):
+        def setup(bv):
+            names = [function.name for function in bv.functions]
+            return lambda: demangle.Demangler(bv).demangle_all(mode, names)
+        return setup
+
+    def demangle_each(bv):
+        names = [function.name for function in bv.functions]
+        def run():
+            demangler = demangle.Demangler(bv)
+            for name in names:
+                demangler.demangle('bn', name)
+        return run
+
+    def textify_plain(bv):
+        function = max(bv.functions, key=lambda function: len(function.basic_blocks))
+        task = textify.BinocularsTextifyFunction(bv, function)
+        def run():
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                task.textify_function_plain()
+        return run
+
+    yield 'build_flowgraph_to_bin', to_bin
+    yield 'build_flowgraph_to_bin_serial', to_bin_serial
+    yield 'build_flowgraph_to_bin_cache_hit', to_bin_cache_hit
+    yield 'build_flowgraph_to_bin_cache_load', to_bin_cache_load
+    yield 'build_flowgraph_to_function', to_function
+    yield 'build_flowgraph_from_function', from_function
+    yield 'demangle_all_bn', demangle_cold('bn')
+    yield 'demangle_all_cppfilt', demangle_cold('cppfilt')
+    yield 'demangle_bn', demangle_each
+    yield 'textify_function_plain', textify_plain
+
+
+def run_benchmarks(params, repeat, selected=None):
+    plugin, modules = load_plugin()
+    results = []
+
+    for name, setup in cases(modules, params):
+        if selected and name not in selected:
+            continue
+
+        seconds = []
+        for _ in range(repeat):
+            bv = synthetic.generate(**params['generate'])
+            run = setup(bv)
+            started = time.perf_counter()
+            run()
+            seconds.append(time.perf_counter() - started)
+
+        results.append({
+            'name': name,
+            'seconds': seconds,
+            'min': min(seconds),
+            'median': statistics.median(seconds),
+        })
+        print('{:<36} min {:9.4f}s  median {:9.4f}s'.format(name, min(seconds),
+            statistics.median(seconds)))
+
+    return {
+        'version': plugin_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': params,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    '''Prints each case's best time relative to baseline.'''
+    before = dict((result['name'], result['min']) for result in baseline['results'])
+    print('compared to version {} ({})'.format(baseline.get('version'), baseline.get('time')))
+    for result in report['results']:
+        if result['name'] in before and before[result['name']] > 0:
+            print('{:<36} {:6.2f}x'.format(result['name'], result['min'] / before[result['name']]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark BINoculars on synthetic binaries.')
+    parser.add_argument('--functions', type=int, default=5000)
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--distribution', choices=['uniform', 'powerlaw'], default='uniform')
+    parser.add_argument('--mangled', type=float, default=0.5)
+    parser.add_argument('--macho', action='store_true', help='Mach-O style mangled names')
+    parser.add_argument('--chain', type=int, default=100)
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--blocks', type=int, default=4)
+    parser.add_argument('--instructions', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--depth', type=int, default=3,
+        help='call levels for build_flowgraph_from_function')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--case', action='append', help='run only this case, repeatable')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='earlier results JSON file')
+    args = parser.parse_args(argv)
+
+    params = {
+        'generate': {
+            'functions': args.functions,
+            'fanout': args.fanout,
+            'distribution': args.distribution,
+            'mangled': args.mangled,
+            'macho': args.macho,
+            'chain': args.chain,
+            'cycles': args.cycles,
+            'blocks': args.blocks,
+            'instructions': args.instructions,
+            'seed': args.seed,
+        },
+        'depth': args.depth,
+    }
+
+    report = run_benchmarks(params, args.repeat, args.case)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+'''Plugin load time, the cost paid at every Binary Ninja start.
+
+Usage:
+    python benchmarks/startup.py [--repeat R] [--output results.json]
+        [--compare baseline.json]
+
+Each run imports the plugin in a fresh interpreter on top of the synthetic
+binaryninja (see synthetic.py), then runs the first command's import, and
+reports both times and which of the modules that should load lazily were
+already imported by the plugin load.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench import PLUGIN_DIR, plugin_version
+
+
+# Modules the plugin load shouldn't import.
+LAZY_MODULES = ('graphviz', 'subprocess', 'base64', 'tempfile', 'webbrowser', 'cxxfilt')
+
+CHILD = '''
+import json, os, sys, time
+sys.path.insert(0, {benchmarks!r})
+import synthetic
+synthetic.install()
+sys.path.insert(0, {parent!r})
+before = set(sys.modules)
+
+started = time.perf_counter()
+plugin = __import__({name!r})
+loaded = time.perf_counter() - started
+imported = set(sys.modules) - before
+
+started = time.perf_counter()
+plugin.BinocularsFlowgraph
+first_use = time.perf_counter() - started
+
+print(json.dumps({{
+    'load': loaded,
+    'first_use': first_use,
+    'modules': len(imported),
+    'lazy_loaded': sorted(m for m in {lazy!r} if m in imported),
+}}))
+'''
+
+
+def measure():
+    '''Runs one fresh interpreter and returns its measurements.'''
+    source = CHILD.format(
+        benchmarks=os.path.dirname(os.path.abspath(__file__)),
+        parent=os.path.dirname(PLUGIN_DIR),
+        name=os.path.basename(PLUGIN_DIR),
+        lazy=LAZY_MODULES,
+    )
+    output = subprocess.check_output([sys.executable, '-c', source])
+    # The plugin may print, e.g. that cxxfilt isn't installed.
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time loading the BINoculars plugin.')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='earlier results JSON file')
+    args = parser.parse_args(argv)
+
+    runs = [measure() for _ in range(args.repeat)]
+    results = []
+    for name in ('load', 'first_use'):
+        seconds = [run[name] for run in runs]
+        results.append({
+            'name': name,
+            'seconds': seconds,
+            'min': min(seconds),
+            'median': statistics.median(seconds),
+        })
+        print('{:<36} min {:9.4f}s  median {:9.4f}s'.format(name, min(seconds),
+            statistics.median(seconds)))
+
+    lazy_loaded = runs[0]['lazy_loaded']
+    print('modules imported by load: {}'.format(runs[0]['modules']))
+    print('lazy modules imported by load: {}'.format(', '.join(lazy_loaded) or 'none'))
+
+    report = {
+        'version': plugin_version(),
+        'repeat': args.repeat,
+        'lazy_loaded': lazy_loaded,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        from bench import compare
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+'''Synthetic stand-in for the parts of the Binary Ninja API BINoculars uses.
+
+install() registers a fake binaryninja module, so the plugin can be imported
+and timed without a license. generate() builds a BinaryView with a random
+call graph whose shape is controlled by its arguments.
+
+Every function is laid out at a fixed stride, each basic block is a run of
+4 byte instructions, and calls sit on instruction addresses. Nothing here
+disassembles anything: queries are answered from tables built up front, so
+the timings measure the plugin rather than the stand-in.
+'''
+from bisect import bisect_right
+import random
+import sys
+import types
+
+
+INSTRUCTION_SIZE = 4
+BASE_ADDRESS = 0x10000
+
+
+class SymbolType(object):
+    FunctionSymbol = 0
+    ImportAddressSymbol = 1
+    ImportedFunctionSymbol = 2
+    DataSymbol = 3
+    ImportedDataSymbol = 4
+    ExternalSymbol = 5
+    LibraryFunctionSymbol = 6
+
+
+class BackgroundTaskThread(object):
+
+    def __init__(self, initial_progress_text='', can_cancel=False):
+        self.progress = initial_progress_text
+        self.can_cancel = can_cancel
+        self.cancelled = False
+        self.finished = False
+
+    def start(self):
+        self.run()
+        self.finish()
+
+    def run(self):
+        pass
+
+    def finish(self):
+        self.finished = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class BinaryDataNotification(object):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+
+class PluginCommand(object):
+
+    @staticmethod
+    def register(*args, **kwargs):
+        pass
+
+    @staticmethod
+    def register_for_function(*args, **kwargs):
+        pass
+
+    @staticmethod
+    def register_for_address(*args, **kwargs):
+        pass
+
+
+class Symbol(object):
+
+    def __init__(self, type, address, name):
+        self.type = type
+        self.address = address
+        self.name = name
+
+
+class InstructionTextToken(object):
+
+    def __init__(self, text):
+        self.text = text
+
+    def __str__(self):
+        return self.text
+
+
+class DisassemblyTextLine(object):
+
+    def __init__(self, address, tokens):
+        self.address = address
+        self.tokens = tokens
+
+    def __str__(self):
+        return ''.join(str(token) for token in self.tokens)
+
+
+class ReferenceSource(object):
+
+    def __init__(self, function, arch, address):
+        self.function = function
+        self.arch = arch
+        self.address = address
+
+
+class InstructionInfo(object):
+
+    def __init__(self, length):
+        self.length = length
+
+
+class Architecture(object):
+    name = 'synthetic'
+    max_instr_length = INSTRUCTION_SIZE
+
+    def get_instruction_info(self, data, address):
+        return InstructionInfo(INSTRUCTION_SIZE)
+
+
+class BasicBlock(object):
+
+    def __init__(self, function, start, instructions):
+        self.function = function
+        self.arch = function.arch
+        self.start = start
+        self.length = instructions * INSTRUCTION_SIZE
+        self.end = start + self.length
+
+    def __len__(self):
+        return self.length // INSTRUCTION_SIZE
+
+    def get_disassembly_text(self):
+        view = self.function.view
+        lines = []
+
+        if self.start == self.function.start:
+            lines.append(DisassemblyTextLine(self.start,
+                [InstructionTextToken(self.function.name), InstructionTextToken(':')]))
+
+        for address in range(self.start, self.end, INSTRUCTION_SIZE):
+            targets = view._refs_from.get(address)
+            if targets:
+                callee = view.get_function_at(targets[0])
+                tokens = ['call', '    ', callee.name if callee else hex(targets[0])]
+            else:
+                tokens = ['mov', '    ', 'eax, ', hex(address & 0xff)]
+            lines.append(DisassemblyTextLine(address,
+                [InstructionTextToken(token) for token in tokens]))
+
+        return lines
+
+
+class Function(object):
+
+    def __init__(self, view, start, name, blocks, instructions):
+        self.view = view
+        self.arch = view.arch
+        self.start = start
+        self.name = name
+        self.symbol = Symbol(SymbolType.FunctionSymbol, start, name)
+        self.comments = {}
+        self.basic_blocks = [BasicBlock(self, start + index * instructions * INSTRUCTION_SIZE,
+            instructions) for index in range(blocks)]
+        self.lowest_address = start
+        self.highest_address = self.basic_blocks[-1].end - 1
+        self._call_sites = []
+
+    @property
+    def call_sites(self):
+        return [ReferenceSource(self, self.arch, address) for address in self._call_sites]
+
+    @property
+    def callee_addresses(self):
+        return [target for address in self._call_sites
+            for target in self.view._refs_from.get(address, [])]
+
+
+class RawData(object):
+
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+
+class FileMetadata(object):
+
+    def __init__(self, filename, raw):
+        self.filename = filename
+        self.raw = raw
+
+    def close(self):
+        pass
+
+
+class BinaryView(object):
+
+    def __init__(self, filename='synthetic.bin', seed=0):
+        self.arch = Architecture()
+        rng = random.Random(seed)
+        raw = RawData(bytes(rng.getrandbits(8) for _ in range(4096)))
+        self.file = FileMetadata(filename, raw)
+        self.session_data = {}
+        self.functions = []
+        self._starts = []
+        self._by_start = {}
+        self._refs_to = {}
+        self._refs_from = {}
+        self._notifications = []
+
+    def add_function(self, start, name, blocks, instructions):
+        function = Function(self, start, name, blocks, instructions)
+        self.functions.append(function)
+        self._starts.append(start)
+        self._by_start[start] = function
+        return function
+
+    def add_call(self, caller, address, callee):
+        if address not in self._refs_from:
+            caller._call_sites.append(address)
+        self._refs_from.setdefault(address, []).append(callee.start)
+        self._refs_to.setdefault(callee.start, []).append(
+            ReferenceSource(caller, self.arch, address))
+
+    def get_function_at(self, address):
+        return self._by_start.get(address)
+
+    def get_functions_containing(self, address):
+        # Functions are laid out in address order and don't overlap.
+        index = bisect_right(self._starts, address) - 1
+        if index < 0:
+            return []
+        function = self.functions[index]
+        if address > function.highest_address:
+            return []
+        return [function]
+
+    def get_code_refs(self, address, length=None):
+        return list(self._refs_to.get(address, []))
+
+    def get_code_refs_from(self, address, func=None, arch=None, length=None):
+        if length is None:
+            return list(self._refs_from.get(address, []))
+
+        refs = []
+        for source in range(address, address + length, INSTRUCTION_SIZE):
+            refs.extend(self._refs_from.get(source, []))
+        return refs
+
+    def read(self, address, length):
+        return bytes(length)
+
+    def register_notification(self, notification):
+        self._notifications.append(notification)
+
+    def unregister_notification(self, notification):
+        self._notifications.remove(notification)
+
+    def show_plain_text_report(self, title, contents):
+        pass
+
+    def show_html_report(self, title, contents, plaintext=''):
+        pass
+
+
+def mangle(parts):
+    '''Itanium mangled name of the nested function parts[0]::...::parts[-1]().'''
+    return '_ZN' + ''.join('{}{}'.format(len(part), part) for part in parts) + 'Ev'
+
+
+def demangle_gnu3(arch, name):
+    '''Demangles names made by mangle(), with or without the Mach-O
+    underscore.
+    '''
+    name = name[1:] if name.startswith('__Z') else name
+    if not name.startswith('_ZN') or not name.endswith('Ev'):
+        return None, None
+
+    parts = []
+    body = name[3:-2]
+    while body:
+        digits = 0
+        while digits < len(body) and body[digits].isdigit():
+            digits += 1
+        if not digits:
+            return None, None
+        length = int(body[:digits])
+        parts.append(body[digits:digits + length])
+        body = body[digits + length:]
+
+    return None, parts
+
+
+def demangle_ms(arch, name):
+    return None, None
+
+
+def get_qualified_name(names):
+    return '::'.join(names)
+
+
+def _ignore(*args, **kwargs):
+    return None
+
+
+API = {
+    'BackgroundTaskThread': BackgroundTaskThread,
+    'BinaryDataNotification': BinaryDataNotification,
+    'BinaryView': BinaryView,
+    'PluginCommand': PluginCommand,
+    'SymbolType': SymbolType,
+    'demangle_gnu3': demangle_gnu3,
+    'demangle_ms': demangle_ms,
+    'get_qualified_name': get_qualified_name,
+    'get_choice_input': _ignore,
+    'get_int_input': _ignore,
+    'get_save_filename_input': _ignore,
+    'get_text_line_input': _ignore,
+    'show_message_box': _ignore,
+    'show_plain_text_report': _ignore,
+    'show_html_report': _ignore,
+    'log_info': _ignore,
+    'log_warn': _ignore,
+    'log_error': _ignore,
+}
+
+
+def install():
+    '''Registers the stand-in as the binaryninja module. Must run before the
+    plugin is imported.
+    '''
+    module = types.ModuleType('binaryninja')
+    module.__dict__.update(API)
+    module.__all__ = sorted(API)
+    sys.modules['binaryninja'] = module
+    return module
+
+
+def generate(functions=1000, fanout=4, distribution='uniform', mangled=0.5,
+    macho=False, chain=0, cycles=0, blocks=4, instructions=16, seed=0):
+    '''Builds a BinaryView with a random call graph.
+
+    Arguments:
+        functions:      Number of functions.
+        fanout:         Mean number of calls made by a function.
+        distribution:   'uniform' picks callees evenly. 'powerlaw' draws
+                        call counts from a Pareto distribution and favours
+                        low numbered functions as callees, giving a few hubs
+                        with very many callers, like libc wrappers.
+        mangled:        Fraction of functions with Itanium mangled names.
+        macho:          Prefix mangled names with an underscore (__Z...),
+                        the form the 'bn' demangle mode recognises.
+        chain:          Length of a call chain func0 -> func1 -> ... for
+                        deep transitive queries.
+        cycles:         Number of recursion cycles of 2 to 8 functions.
+        blocks:         Basic blocks per function.
+        instructions:   Instructions per basic block.
+        seed:           Random seed, the same arguments give the same view.
+    '''
+    rng = random.Random(seed)
+    bv = BinaryView('synthetic-{}-{}.bin'.format(functions, seed), seed)
+    stride = blocks * instructions * INSTRUCTION_SIZE
+
+    for index in range(functions):
+        if rng.random() < mangled:
+            name = mangle(['ns{}'.format(index % 97), 'Class{}'.format(index % 13),
+                'method{}'.format(index)])
+            if macho:
+                name = '_' + name
+        else:
+            name = 'func{}'.format(index)
+        bv.add_function(BASE_ADDRESS + index * stride, name, blocks, instructions)
+
+    def call_site(function):
+        block = rng.choice(function.basic_blocks)
+        return rng.randrange(block.start, block.end, INSTRUCTION_SIZE)
+
+    for function in bv.functions:
+        if distribution == 'powerlaw':
+            count = min(int(fanout * 0.5 * rng.paretovariate(1.5)), functions)
+        else:
+            count = rng.randint(0, 2 * fanout)
+
+        for _ in range(count):
+            if distribution == 'powerlaw':
+                callee = bv.functions[int(functions * rng.random() ** 3)]
+            else:
+                callee = rng.choice(bv.functions)
+            bv.add_call(function, call_site(function), callee)
+
+    for index in range(min(chain, functions) - 1):
+        bv.add_call(bv.functions[index], call_site(bv.functions[index]), bv.functions[index + 1])
+
+    for _ in range(cycles):
+        members = rng.sample(bv.functions, min(rng.randint(2, 8), functions))
+        for caller, callee in zip(members, members[1:] + members[:1]):
+            bv.add_call(caller, call_site(caller), callee)
+
+    return bv
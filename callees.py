@@ -0,0 +1,91 @@
+'''Callee extraction from structured analysis data.
+
+Finds the same (instruction address, referenced address) pairs as scanning
+every line of basic_block.get_disassembly_text() and calling
+bv.get_code_refs_from() per instruction, without rendering any text.
+
+Each basic block is asked for all of its outgoing code references in one
+call. Blocks without references are skipped. For the rest, the function's
+call sites are queried; if they account for every reference of the block
+their results are used as is, otherwise the block's instructions are walked
+by decoded length. Only that last, rare case costs one query per instruction.
+'''
+from bisect import bisect_left
+
+
+def code_refs_from_function(bv, function):
+    '''Returns the code references made by function.
+
+    Returns:
+        List of (source address, target address) tuples, ordered by basic
+        block start then source address.
+    '''
+    refs = []
+    call_sites = sorted(set(ref.address for ref in function.call_sites))
+
+    for basic_block in sorted(function.basic_blocks, key=lambda bb: bb.start):
+        refs.extend(code_refs_from_block(bv, function, basic_block, call_sites))
+
+    return refs
+
+
+def code_refs_from_block(bv, function, basic_block, call_sites):
+    '''Returns the (source, target) code references made by one block.
+
+    Arguments:
+        call_sites: Sorted call site addresses of function.
+    '''
+    arch = basic_block.arch
+
+    try:
+        # Every reference made by the block, in one query.
+        block_refs = bv.get_code_refs_from(basic_block.start, function, arch,
+            basic_block.length)
+    except TypeError:
+        # API without the length argument.
+        block_refs = None
+
+    if block_refs is not None and not block_refs:
+        return []
+
+    refs = []
+    lo = bisect_left(call_sites, basic_block.start)
+    hi = bisect_left(call_sites, basic_block.end)
+
+    for site in call_sites[lo:hi]:
+        for target in bv.get_code_refs_from(site, function, arch):
+            refs.append((site, target))
+
+    if block_refs is not None and len(refs) == len(block_refs):
+        return refs
+
+    # Some references don't come from call sites, e.g. a function address
+    # loaded into a register. Query every instruction of the block.
+    refs = []
+    for address in instruction_addresses(bv, basic_block):
+        for target in bv.get_code_refs_from(address, function, arch):
+            refs.append((address, target))
+
+    return refs
+
+
+def instruction_addresses(bv, basic_block):
+    '''Yields the address of every instruction in basic_block, decoding
+    instruction lengths rather than rendering disassembly.
+    '''
+    arch = basic_block.arch
+    start = basic_block.start
+    end = basic_block.end
+    data = bv.read(start, end - start)
+    max_length = arch.max_instr_length
+
+    address = start
+    while address < end:
+        offset = address - start
+        info = arch.get_instruction_info(data[offset:offset + max_length], address)
+
+        if info is None or not info.length:
+            break
+
+        yield address
+        address += info.length
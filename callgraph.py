@@ -0,0 +1,297 @@
+'''Compact call graph store shared by the flowgraph builders.
+
+Functions get dense integer ids in the order they are first seen. Edges are
+kept in CSR form: the outgoing calls of node n live in
+targets[offsets[n]:offsets[n + 1]], with the xref address of every call in the
+parallel addresses array. Symbol names and demangled labels are stored once
+per node in side tables, so memory grows with the number of edges rather than
+with the length of the names involved.
+
+Edges always point from caller to callee.
+'''
+from array import array
+
+
+# Node flags
+EXPANDED = 0x1      # Xrefs of the node have been collected.
+TRUNCATED = 0x2     # Traversal budget ran out before the node was expanded.
+REMOVED = 0x4       # Function no longer exists. Ids are never reused.
+SUMMARY = 0x8       # Stands for several functions, see reduction.py.
+LIBRARY = 0x10      # Imported, library or thunk function.
+EXTERNAL = 0x20     # Copy of a node drawn on another page.
+
+
+class CallGraph(object):
+
+    def __init__(self):
+        self.starts = array('Q')    # Function start address per node
+        self.names = []             # Raw symbol name per node
+        self.labels = []            # Demangled label per node
+        self.flags = bytearray()
+        self._ids = {}              # Function start -> node id
+        self._interned = {}         # Label -> shared label string
+
+        # Edges added since the last freeze(), in insertion order.
+        self._pending_src = array('I')
+        self._pending_dst = array('I')
+        self._pending_addr = array('Q')
+        # Callers whose frozen calls are replaced, node -> set of calls.
+        self._replaced = {}
+
+        # Frozen edges, grouped by caller and sorted by (callee, address).
+        self.offsets = array('Q', [0])
+        self.targets = array('I')
+        self.addresses = array('Q')
+        # Bumped whenever the frozen edges or the REMOVED nodes change.
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __contains__(self, start):
+        return start in self._ids
+
+    @property
+    def edge_count(self):
+        self.freeze()
+        return len(self.targets)
+
+    def node_id(self, start):
+        '''Returns the node id of the function at start, or None.'''
+        return self._ids.get(start)
+
+    def add_node(self, start, name, label=None):
+        '''Adds a function to the graph if it isn't already stored.
+
+        Arguments:
+            start:  Function start address. None adds a node that doesn't
+                    stand for one function, e.g. a summary node.
+            name:   Raw symbol name.
+            label:  Display name. Defaults to name.
+
+        Returns:
+            Node id.
+        '''
+        if start is not None:
+            node = self._ids.get(start)
+            if node is not None:
+                return node
+
+        if label is None:
+            label = name
+        label = self._interned.setdefault(label, label)
+
+        node = len(self.starts)
+        if start is not None:
+            self._ids[start] = node
+        self.starts.append(start or 0)
+        self.names.append(name)
+        self.labels.append(label)
+        self.flags.append(0)
+        return node
+
+    def set_flag(self, node, flag):
+        if flag & REMOVED:
+            self.generation += 1
+        self.flags[node] |= flag
+
+    def clear_flag(self, node, flag):
+        if flag & REMOVED:
+            self.generation += 1
+        self.flags[node] &= ~flag & 0xff
+
+    def has_flag(self, node, flag):
+        return bool(self.flags[node] & flag)
+
+    def add_edge(self, caller, callee, address):
+        '''Records a call from node caller to node callee at xref address.
+        Duplicate edges are dropped on freeze().
+        '''
+        self._pending_src.append(caller)
+        self._pending_dst.append(callee)
+        self._pending_addr.append(address)
+
+    def relabel(self, node, name, label=None):
+        '''Updates the symbol name and label of node, e.g. after a rename.'''
+        if label is None:
+            label = name
+        self.names[node] = name
+        self.labels[node] = self._interned.setdefault(label, label)
+
+    def replace_calls(self, node, calls):
+        '''Replaces every call made by node with calls, an iterable of
+        (callee, address). Applied on the next freeze().
+        '''
+        self._replaced[node] = set(calls)
+
+    def remove_node(self, node):
+        '''Flags node REMOVED and drops the calls it makes. Calls to it are
+        skipped by successors() and edges().
+        '''
+        self.set_flag(node, REMOVED)
+        self.replace_calls(node, [])
+
+    def freeze(self):
+        '''Folds pending edges into the CSR arrays. Runs in time linear in
+        the number of edges: pending edges are bucketed per caller with a
+        counting sort, then each caller's calls are deduplicated and sorted.
+
+        Returns:
+            self
+        '''
+        count = len(self.starts)
+        pending = len(self._pending_src)
+        frozen = len(self.offsets) - 1
+
+        if not pending and not self._replaced and frozen == count:
+            return self
+
+        # Counting sort of the pending edges by caller.
+        first = array('Q', [0]) * (count + 1)
+        for src in self._pending_src:
+            first[src + 1] += 1
+        for node in range(count):
+            first[node + 1] += first[node]
+
+        fill = array('Q', first)
+        order = array('Q', [0]) * pending
+        for index, src in enumerate(self._pending_src):
+            order[fill[src]] = index
+            fill[src] += 1
+
+        offsets = array('Q', [0])
+        targets = array('I')
+        addresses = array('Q')
+
+        for node in range(count):
+            lo = hi = 0
+            if node < frozen:
+                lo, hi = self.offsets[node], self.offsets[node + 1]
+
+            replaced = self._replaced.get(node)
+
+            if replaced is None and first[node] == first[node + 1]:
+                # Nothing new for this caller, reuse the frozen calls as is.
+                targets.extend(self.targets[lo:hi])
+                addresses.extend(self.addresses[lo:hi])
+            else:
+                if replaced is None:
+                    calls = set(zip(self.targets[lo:hi], self.addresses[lo:hi]))
+                else:
+                    calls = set(replaced)
+                for k in range(first[node], first[node + 1]):
+                    index = order[k]
+                    calls.add((self._pending_dst[index], self._pending_addr[index]))
+
+                for dst, address in sorted(calls):
+                    targets.append(dst)
+                    addresses.append(address)
+
+            offsets.append(len(targets))
+
+        self.offsets = offsets
+        self.targets = targets
+        self.addresses = addresses
+
+        self._pending_src = array('I')
+        self._pending_dst = array('I')
+        self._pending_addr = array('Q')
+        self._replaced = {}
+        self.generation += 1
+
+        return self
+
+    def successors(self, node):
+        '''Yields (callee, address) for every call made by node.'''
+        self.freeze()
+        flags = self.flags
+        lo, hi = self.offsets[node], self.offsets[node + 1]
+        for index in range(lo, hi):
+            if not flags[self.targets[index]] & REMOVED:
+                yield self.targets[index], self.addresses[index]
+
+    def edges(self):
+        '''Yields (caller, callee, addresses) once per connected pair of
+        nodes, where addresses is the sorted array of xref addresses.
+        '''
+        self.freeze()
+        flags = self.flags
+        targets = self.targets
+        for node in range(len(self.starts)):
+            lo, hi = self.offsets[node], self.offsets[node + 1]
+            while lo < hi:
+                dst = targets[lo]
+                end = lo + 1
+                while end < hi and targets[end] == dst:
+                    end += 1
+                if not flags[dst] & REMOVED:
+                    yield node, dst, self.addresses[lo:end]
+                lo = end
+
+
+def strongly_connected_components(graph):
+    '''Iterative Tarjan over the calls of graph, REMOVED nodes excluded.
+
+    Returns:
+        Component id per node (-1 for removed nodes) and the number of
+        components. Components are numbered in reverse topological order:
+        callees before their callers.
+    '''
+    graph.freeze()
+    count = len(graph)
+    offsets, targets, flags = graph.offsets, graph.targets, graph.flags
+
+    index = [-1] * count
+    low = [0] * count
+    component = [-1] * count
+    on_stack = bytearray(count)
+    stack = []
+    counter = 0
+    components = 0
+
+    for root in range(count):
+        if index[root] != -1 or flags[root] & REMOVED:
+            continue
+
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [[root, offsets[root]]]
+
+        while work:
+            frame = work[-1]
+            node, edge = frame
+
+            if edge < offsets[node + 1]:
+                frame[1] += 1
+                callee = targets[edge]
+
+                if flags[callee] & REMOVED:
+                    continue
+
+                if index[callee] == -1:
+                    index[callee] = low[callee] = counter
+                    counter += 1
+                    stack.append(callee)
+                    on_stack[callee] = 1
+                    work.append([callee, offsets[callee]])
+                elif on_stack[callee]:
+                    low[node] = min(low[node], index[callee])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+
+            if low[node] == index[node]:
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component[member] = components
+                    if member == node:
+                        break
+                components += 1
+
+    return component, components
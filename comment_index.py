@@ -0,0 +1,231 @@
+'''Searchable index of the comments of a BinaryView.
+
+Holds function comments (function.comments) and address comments outside
+functions (bv.address_comments), sorted by address, with an inverted index
+from lower case word tokens to the comments containing them.
+
+The index is built once per view and kept up to date incrementally: a
+BinaryDataNotification records functions added, updated or removed, and the
+next query re-reads only their comments. Address comments don't raise
+notifications, so they are compared with the last seen set on each query
+and only the ones that differ are re-indexed.
+
+Search modes:
+    keyword:    Comments containing every word of the query, from the
+                inverted index.
+    substring:  Case insensitive substring. Candidates come from the tokens
+                containing the query's longest word, then are checked.
+    regex:      Python regular expression, checked against every comment.
+'''
+from binaryninja import *
+from bisect import bisect_left, insort
+import re
+import threading
+
+from .session import get_session_object
+
+
+SEARCH_MODES = ('keyword', 'substring', 'regex')
+# Owner of address comments that don't belong to a function.
+NO_FUNCTION = -1
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def get_comment_index(bv):
+    '''Returns the CommentIndex shared by every run on bv.'''
+    return get_session_object(bv, 'binoculars.comment_index', CommentIndex)
+
+
+def tokens(text):
+    return set(token.lower() for token in TOKEN_RE.findall(text))
+
+
+def address_comments(bv):
+    '''Returns a dictionary of address -> comment of the view's address
+    comments, empty on APIs without them.
+    '''
+    comments = getattr(bv, 'address_comments', None)
+    return dict(comments) if comments else {}
+
+
+class CommentIndexNotification(BinaryDataNotification):
+    '''Marks functions whose comments may have changed.'''
+
+    def __init__(self, index):
+        BinaryDataNotification.__init__(self)
+        self.index = index
+
+    def function_added(self, view, func):
+        self.index.invalidate(func.start)
+
+    def function_removed(self, view, func):
+        self.index.invalidate(func.start)
+
+    def function_updated(self, view, func):
+        self.index.invalidate(func.start)
+
+
+class CommentIndex(object):
+    '''Comments keyed by (address, owner), where owner is the start of the
+    function the comment belongs to or NO_FUNCTION.
+    '''
+
+    def __init__(self, bv):
+        self.bv = bv
+        self.comments = {}
+        self.keys = []
+        self._postings = {}
+        self._by_function = {}
+        self._address_comments = {}
+        self._dirty = set()
+        self._built = False
+        self._lock = threading.RLock()
+        self.notification = None
+
+    def __len__(self):
+        self.refresh()
+        return len(self.keys)
+
+    def invalidate(self, start):
+        with self._lock:
+            self._dirty.add(start)
+
+    def refresh(self, cancelled=None):
+        '''Brings the index up to date with the view.
+
+        Arguments:
+            cancelled:  Optional function returning True to stop building.
+                        An interrupted build starts over on the next call.
+        '''
+        with self._lock:
+            if not self._built:
+                self.__build(cancelled)
+                return
+
+            dirty, self._dirty = self._dirty, set()
+            for start in dirty:
+                self.__remove_function(start)
+                function = self.bv.get_function_at(start)
+                if function is not None:
+                    self.__add_function(function)
+
+            current = address_comments(self.bv)
+            for address, text in self._address_comments.items():
+                if current.get(address) != text:
+                    self.__remove((address, NO_FUNCTION))
+            for address, text in current.items():
+                if self._address_comments.get(address) != text:
+                    self.__add((address, NO_FUNCTION), text)
+            self._address_comments = current
+
+    def __build(self, cancelled):
+        if self.notification is None:
+            # Listen first so nothing changed during the build is missed.
+            self.notification = CommentIndexNotification(self)
+            self.bv.register_notification(self.notification)
+
+        self.comments = {}
+        self._postings = {}
+        self._by_function = {}
+        self._dirty = set()
+
+        for function in self.bv.functions:
+            if cancelled is not None and cancelled():
+                return
+            self.__add_function(function, sort=False)
+
+        self._address_comments = address_comments(self.bv)
+        for address, text in self._address_comments.items():
+            self.__add((address, NO_FUNCTION), text, sort=False)
+
+        self.keys = sorted(self.comments)
+        self._built = True
+
+    def __add_function(self, function, sort=True):
+        comments = function.comments
+        if not isinstance(comments, dict):
+            return
+        for address, text in comments.items():
+            key = (int(address), function.start)
+            self.__add(key, text, sort)
+            self._by_function.setdefault(function.start, set()).add(key)
+
+    def __remove_function(self, start):
+        for key in self._by_function.pop(start, ()):
+            self.__remove(key)
+
+    def __add(self, key, text, sort=True):
+        if key in self.comments:
+            self.__remove(key)
+        self.comments[key] = text
+        for token in tokens(text):
+            self._postings.setdefault(token, set()).add(key)
+        if sort:
+            insort(self.keys, key)
+
+    def __remove(self, key):
+        text = self.comments.pop(key, None)
+        if text is None:
+            return
+        for token in tokens(text):
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self._postings[token]
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            del self.keys[index]
+
+    def close(self):
+        if self.notification is not None:
+            self.bv.unregister_notification(self.notification)
+            self.notification = None
+
+    def search(self, query=None, mode='keyword'):
+        '''Returns the keys of the comments matching query, sorted by
+        address. An empty query matches every comment.
+
+        Raises:
+            ValueError for an unknown mode or a bad regular expression.
+        '''
+        self.refresh()
+
+        with self._lock:
+            if not query:
+                return list(self.keys)
+
+            if mode == 'keyword':
+                words = tokens(query)
+                if not words:
+                    return []
+                postings = sorted((self._postings.get(word, set()) for word in words), key=len)
+                matches = set(postings[0]).intersection(*postings[1:])
+
+            elif mode == 'substring':
+                needle = query.lower()
+                words = TOKEN_RE.findall(needle)
+                if words:
+                    longest = max(words, key=len)
+                    candidates = set()
+                    for token, posting in self._postings.items():
+                        if longest in token:
+                            candidates.update(posting)
+                else:
+                    candidates = self.comments
+                matches = set(key for key in candidates
+                    if needle in self.comments[key].lower())
+
+            elif mode == 'regex':
+                try:
+                    pattern = re.compile(query)
+                except re.error as e:
+                    raise ValueError('Bad regular expression: {}'.format(e))
+                matches = set(key for key, text in self.comments.items()
+                    if pattern.search(text))
+
+            else:
+                raise ValueError('Unknown search mode {}'.format(mode))
+
+            return sorted(matches)
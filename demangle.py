@@ -0,0 +1,223 @@
+'''Demangling service shared by all flowgraph runs on a BinaryView.
+
+https://en.wikipedia.org/wiki/Name_mangling
+graphviz doesn't like colons in node names, so every label returned here has
+them replaced with dots.
+'''
+from binaryninja import *
+from collections import OrderedDict
+import functools
+import importlib
+import importlib.util
+import threading
+
+from .session import get_session_object
+
+from shutil import which
+
+
+# Upper bound on cached names per BinaryView.
+DEMANGLE_CACHE_SIZE = 1 << 18
+# Seconds allowed for a bulk c++filt run.
+CPPFILT_TIMEOUT = 120
+
+
+def get_demangler(bv):
+    '''Returns the Demangler shared by every run on bv.'''
+    return get_session_object(bv, 'binoculars.demangler', Demangler)
+
+
+@functools.lru_cache(maxsize=None)
+def cxxfilt_available():
+    '''True if the cxxfilt module is installed. Probed once, without
+    importing it.
+    '''
+    return importlib.util.find_spec('cxxfilt') is not None
+
+
+@functools.lru_cache(maxsize=None)
+def load_cxxfilt():
+    '''Returns the cxxfilt module, imported on first use, or None.'''
+    if not cxxfilt_available():
+        return None
+    try:
+        return importlib.import_module('cxxfilt')
+    except ImportError:
+        return None
+
+
+def demangle_bn(bv, name):
+    '''Demangle with Binary Ninja's own gnu3 and msvc demanglers.'''
+    demangle_name = None
+
+    if name and name.find('__Z', 0, 3) > -1:
+        # Test for gnu3 style names __Z
+        type, demangle_name = demangle_gnu3(bv.arch, name)
+
+    elif name and name.find('?', 0, 1) > -1:
+        # Test for msvc++ names ?funcname
+        # TODO: improve match with regex
+        type, demangle_name = demangle_ms(bv.arch, name)
+
+    if demangle_name:
+        return get_qualified_name(demangle_name)
+
+    return name
+
+
+def demangle_filt(name):
+    '''Demangle with the cxxfilt module.'''
+    try:
+        return load_cxxfilt().demangle(name, external_only=False)
+    except:
+        return name
+
+
+class Demangler(object):
+    '''Bounded LRU cache of demangled labels keyed by (mode, raw name).
+
+    mode is one of 'cppfilt', 'bn'. Any other mode returns the raw name.
+    hits and misses count cache lookups so its effect can be checked.
+    '''
+
+    def __init__(self, bv, size=DEMANGLE_CACHE_SIZE):
+        self.bv = bv
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+    def demangle(self, mode, name):
+        '''Returns the graphviz safe label of name.'''
+        if mode not in ('cppfilt', 'bn'):
+            return name.replace(':', '.')
+
+        key = (mode, name)
+
+        with self._lock:
+            label = self._cache.get(key)
+            if label is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return label
+            self.misses += 1
+
+        if mode == 'cppfilt':
+            label = demangle_filt(name)
+        else:
+            label = demangle_bn(self.bv, name)
+
+        label = label.replace(':', '.')
+        self._store(key, label)
+        return label
+
+    def demangle_all(self, mode, names):
+        '''Bulk mode. Demangles every name not yet cached in one pass, so
+        later demangle() calls for these names are cache hits.
+
+        For cppfilt the names are piped through a single c++filt process when
+        both the binary and the cxxfilt module are available. Names c++filt
+        leaves alone go through demangle_filt, so every label is the one
+        demangle() returns.
+
+        Returns:
+            Dictionary of raw name to label.
+        '''
+        if mode not in ('cppfilt', 'bn'):
+            return dict((name, name.replace(':', '.')) for name in names)
+
+        labels = {}
+        missing = []
+        hits = 0
+
+        with self._lock:
+            for name in names:
+                if name in labels:
+                    continue
+                label = self._cache.get((mode, name))
+                if label is None:
+                    # Placeholder keeps duplicates out of missing
+                    labels[name] = None
+                    missing.append(name)
+                else:
+                    labels[name] = label
+                    hits += 1
+                    self._cache.move_to_end((mode, name))
+
+        demangled = None
+        if mode == 'cppfilt' and missing and cxxfilt_available():
+            demangled = self.__run_cppfilt(missing)
+
+        for index, name in enumerate(missing):
+            if demangled is not None and demangled[index] != name:
+                label = demangled[index]
+            elif mode == 'cppfilt':
+                # Left alone by c++filt, e.g. Mach-O __Z names, or internal
+                # names only cxxfilt demangles.
+                label = demangle_filt(name)
+            else:
+                label = demangle_bn(self.bv, name)
+
+            labels[name] = label.replace(':', '.')
+            self._store((mode, name), labels[name])
+
+        with self._lock:
+            self.hits += hits
+            self.misses += len(missing)
+
+        return labels
+
+    def _store(self, key, label):
+        with self._lock:
+            self._cache[key] = label
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+
+    def __run_cppfilt(self, names):
+        '''Demangles names through one c++filt process fed over a pipe.
+
+        Returns:
+            List of demangled names, in the order given, or None if c++filt
+            isn't available, its output can't be matched to its input, or it
+            doesn't demangle like the cxxfilt module.
+        '''
+        path = which('c++filt')
+        if not path or any('\n' in name for name in names):
+            return None
+
+        import subprocess
+
+        try:
+            proc = subprocess.Popen([path],
+                                    stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL,
+                                    )
+        except OSError:
+            return None
+
+        try:
+            out, _ = proc.communicate('\n'.join(names).encode('utf-8') + b'\n',
+                                      timeout=CPPFILT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            return None
+
+        lines = out.decode('utf-8', 'replace').split('\n')[:-1]
+        if proc.returncode != 0 or len(lines) != len(names):
+            return None
+
+        # Spot check the first demangled name against the module.
+        for name, line in zip(names, lines):
+            if line != name:
+                if line != demangle_filt(name):
+                    return None
+                break
+
+        return lines
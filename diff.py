@@ -0,0 +1,247 @@
+'''Call graph diff between two versions of a binary.
+
+Functions of the old and new whole binary graphs are matched in rounds,
+each linear in the size of the graphs:
+
+    1.  Same demangled label, when the label is unique in both versions.
+        Labels generated from an address (sub_401000) aren't used.
+    2.  Same label and block count, for labels left over from 1.
+    3.  Same structural signature, repeated while new matches are found.
+        The signature is the block count and the set of callees, where a
+        callee is known by its match or only as unmatched. Functions left
+        over, e.g. leaves, are then tried with their set of callers.
+
+Matched functions share a key, the new node id. Every call becomes a pair of
+keys and the added and removed calls are two set differences.
+'''
+from array import array
+import re
+
+from .callgraph import CallGraph, LIBRARY, REMOVED
+
+
+# Signature rounds after name matching.
+MATCH_ROUNDS = 4
+# Names Binary Ninja makes up from the address, meaningless across versions.
+AUTO_NAME_RE = re.compile(r'^(?:j_)?sub_[0-9a-fA-F]+$')
+
+ADDED = 'added'
+DELETED = 'removed'
+
+
+def block_counts(bv, graph):
+    '''Returns an array of the basic block count of each node's function,
+    0 for nodes that aren't a function of bv.
+    '''
+    counts = array('I', [0]) * len(graph)
+    for node in range(len(graph)):
+        if graph.has_flag(node, REMOVED) or not graph.starts[node]:
+            continue
+        function = bv.get_function_at(graph.starts[node])
+        if function is not None:
+            counts[node] = len(function.basic_blocks)
+    return counts
+
+
+def _unique(keys):
+    '''Returns a dictionary of key -> node for keys held by exactly one node,
+    from (key, node) pairs.
+    '''
+    unique = {}
+    seen = set()
+    for key, node in keys:
+        if key in seen:
+            unique.pop(key, None)
+        else:
+            seen.add(key)
+            unique[key] = node
+    return unique
+
+
+class GraphDiff(object):
+    '''Matches the functions of old and new (CallGraphs) and computes the
+    calls added and removed.
+
+    Attributes:
+        matches:    Array, old node -> matched new node or -1.
+        added:      Dictionary of (caller, callee) new nodes -> addresses.
+        removed:    Dictionary of (caller, callee) keys -> addresses, where
+                    a key is the matched new node, or ~node for old nodes
+                    without a match.
+    '''
+
+    def __init__(self, old, new, old_blocks, new_blocks, rounds=MATCH_ROUNDS):
+        self.old = old.freeze()
+        self.new = new.freeze()
+        self.old_blocks = old_blocks
+        self.new_blocks = new_blocks
+
+        self._old_callers = self.__callers(self.old)
+        self._new_callers = self.__callers(self.new)
+
+        self.matches = array('q', [-1]) * len(old)
+        self._matched = bytearray(len(new))
+        self.rounds = 0
+
+        self.__match_names()
+        for _ in range(rounds):
+            self.rounds += 1
+            if not self.__match_signatures():
+                break
+
+        self.__diff_calls()
+
+    def __callers(self, graph):
+        callers = [[] for _ in range(len(graph))]
+        for caller, callee, _ in graph.edges():
+            callers[callee].append(caller)
+        return callers
+
+    def __live(self, graph):
+        return [node for node in range(len(graph)) if not graph.has_flag(node, REMOVED)]
+
+    def __match(self, pairs):
+        matched = 0
+        for old_node, new_node in pairs:
+            self.matches[old_node] = new_node
+            self._matched[new_node] = 1
+            matched += 1
+        return matched
+
+    def __pairs(self, old_keys, new_keys):
+        old_unique = _unique(old_keys)
+        new_unique = _unique(new_keys)
+        return [(node, new_unique[key]) for key, node in old_unique.items()
+            if key in new_unique]
+
+    def __match_names(self):
+        old, new = self.old, self.new
+
+        def named(graph, nodes):
+            return [node for node in nodes if not AUTO_NAME_RE.match(graph.names[node])]
+
+        old_nodes = named(old, self.__live(old))
+        new_nodes = named(new, self.__live(new))
+        self.__match(self.__pairs(
+            ((old.labels[node], node) for node in old_nodes),
+            ((new.labels[node], node) for node in new_nodes)))
+
+        # Overloads and duplicated names, told apart by their size.
+        old_nodes = [node for node in old_nodes if self.matches[node] < 0]
+        new_nodes = [node for node in new_nodes if not self._matched[node]]
+        self.__match(self.__pairs(
+            (((old.labels[node], self.old_blocks[node]), node) for node in old_nodes),
+            (((new.labels[node], self.new_blocks[node]), node) for node in new_nodes)))
+
+    def __match_signatures(self):
+        '''One round of structural matching. Returns the number of matches.'''
+        old, new = self.old, self.new
+        matches, matched = self.matches, self._matched
+
+        # Unmatched neighbours all look alike.
+        old_key = lambda node: matches[node] if matches[node] >= 0 else -1
+        new_key = lambda node: node if matched[node] else -1
+
+        def callees(graph, node, key):
+            return tuple(sorted(set(key(callee) for callee, _ in graph.successors(node))))
+
+        def callers(graph_callers, node, key):
+            return tuple(sorted(set(key(caller) for caller in graph_callers[node])))
+
+        found = 0
+        for signature in ('callees', 'callers'):
+            old_nodes = [node for node in self.__live(old) if matches[node] < 0]
+            new_nodes = [node for node in self.__live(new) if not matched[node]]
+            if not old_nodes or not new_nodes:
+                break
+
+            if signature == 'callees':
+                old_keys = (((self.old_blocks[node], callees(old, node, old_key)), node)
+                    for node in old_nodes)
+                new_keys = (((self.new_blocks[node], callees(new, node, new_key)), node)
+                    for node in new_nodes)
+            else:
+                old_keys = (((self.old_blocks[node], callers(self._old_callers, node, old_key)), node)
+                    for node in old_nodes)
+                new_keys = (((self.new_blocks[node], callers(self._new_callers, node, new_key)), node)
+                    for node in new_nodes)
+
+            found += self.__match(self.__pairs(old_keys, new_keys))
+
+        return found
+
+    def key(self, node):
+        '''Key of old node.'''
+        match = self.matches[node]
+        return match if match >= 0 else ~node
+
+    def __diff_calls(self):
+        old_calls = {}
+        for caller, callee, addresses in self.old.edges():
+            old_calls[(self.key(caller), self.key(callee))] = addresses
+
+        self.added = {}
+        self.kept = set()
+        for caller, callee, addresses in self.new.edges():
+            if (caller, callee) in old_calls:
+                self.kept.add((caller, callee))
+            else:
+                self.added[(caller, callee)] = addresses
+
+        self.removed = dict((call, addresses) for call, addresses in old_calls.items()
+            if call not in self.kept)
+
+    def matched(self):
+        return sum(1 for match in self.matches if match >= 0)
+
+    def changed_graph(self):
+        '''Returns the changed neighbourhood: a CallGraph of the added and
+        removed calls, the unchanged calls between their functions, and the
+        states, {'nodes': {label: state}, 'edges': {(label, label): state}}
+        with ADDED or DELETED for the calls and the unmatched functions.
+
+        Functions only in the old version are labelled '<label> (old)'.
+        '''
+        graph = CallGraph()
+        states = {'nodes': {}, 'edges': {}}
+        nodes = {}
+
+        def add(key):
+            node = nodes.get(key)
+            if node is not None:
+                return node
+            if key >= 0:
+                source, origin = self.new, key
+                node = graph.add_node(source.starts[origin], source.names[origin],
+                    source.labels[origin])
+                if not self._matched[origin]:
+                    states['nodes'][graph.labels[node]] = ADDED
+            else:
+                # Its start may belong to another function in the new version.
+                source, origin = self.old, ~key
+                node = graph.add_node(None, source.names[origin],
+                    source.labels[origin] + ' (old)')
+                states['nodes'][graph.labels[node]] = DELETED
+            graph.flags[node] = source.flags[origin] & LIBRARY
+            nodes[key] = node
+            return node
+
+        for calls, state in ((self.added, ADDED), (self.removed, DELETED)):
+            for (caller, callee), addresses in sorted(calls.items()):
+                src, dst = add(caller), add(callee)
+                for address in addresses:
+                    graph.add_edge(src, dst, address)
+                states['edges'][(graph.labels[src], graph.labels[dst])] = state
+
+        # Unchanged calls between changed functions, for context.
+        for caller in sorted(key for key in nodes if key >= 0):
+            for callee, address in self.new.successors(caller):
+                if callee in nodes and (caller, callee) in self.kept:
+                    graph.add_edge(nodes[caller], nodes[callee], address)
+
+        return graph.freeze(), states
+
+
+def diff_graphs(old, new, old_blocks, new_blocks):
+    '''Returns the GraphDiff of two whole binary graphs, see block_counts.'''
+    return GraphDiff(old, new, old_blocks, new_blocks)
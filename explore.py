@@ -0,0 +1,211 @@
+'''Lazy exploration of the call graph around a function.
+
+Only the functions within EXPLORE_HOPS calls of the selected function, in
+either direction, are collected and drawn. Any one of them can then be
+expanded with its own callers and callees.
+
+Collected xrefs go into one CallGraph shared by every exploration of the
+view, so a function is only scanned once while analysis doesn't change. A
+BinaryDataNotification drops everything collected when a function is
+defined, undefined, updated or renamed, as any of those can change the
+calls and labels of its neighbours.
+
+Each exploration is an Exploration of its own, holding the functions drawn,
+by start address so they survive the shared graph being dropped, and the
+node positions of its last layout. An expansion pins the functions already
+drawn where they were and lays out only the new ones, see
+render.render_pinned.
+'''
+from binaryninja import *
+import threading
+
+from .callgraph import CallGraph, LIBRARY, TRUNCATED
+from .session import get_session_object
+
+
+# Calls followed from the selected function for the first picture.
+EXPLORE_HOPS = 2
+# Most functions added by the first picture or by one expansion.
+EXPLORE_NODES = 100
+
+
+def get_explorer(bv, demangle):
+    '''Returns the Explorer of bv for the demangle mode.'''
+    return get_session_object(bv, 'binoculars.explorer.{}'.format(demangle), Explorer)
+
+
+class ExplorerNotification(BinaryDataNotification):
+    '''Drops the collected xrefs of an Explorer on any function change.'''
+
+    def __init__(self, explorer):
+        BinaryDataNotification.__init__(self)
+        self.explorer = explorer
+
+    def function_added(self, view, func):
+        self.explorer.invalidate()
+
+    def function_removed(self, view, func):
+        self.explorer.invalidate()
+
+    def function_updated(self, view, func):
+        self.explorer.invalidate()
+
+    def symbol_added(self, view, sym):
+        self.explorer.invalidate()
+
+    def symbol_updated(self, view, sym):
+        self.explorer.invalidate()
+
+    def symbol_removed(self, view, sym):
+        self.explorer.invalidate()
+
+
+class Explorer(object):
+    '''Callers and callees collected so far, shared by the explorations of
+    a view. Functions are known by their start address.
+    '''
+
+    def __init__(self, bv):
+        self.bv = bv
+        self.graph = CallGraph()
+        self._callers = {}
+        self._callees = {}
+        self._stale = False
+        self._lock = threading.RLock()
+        self.notification = ExplorerNotification(self)
+        self.bv.register_notification(self.notification)
+
+    def invalidate(self):
+        with self._lock:
+            self._stale = True
+
+    def close(self):
+        if self.notification is not None:
+            self.bv.unregister_notification(self.notification)
+            self.notification = None
+
+    def __reset(self):
+        if self._stale:
+            self._stale = False
+            self.graph = CallGraph()
+            self._callers = {}
+            self._callees = {}
+
+    def __collect(self, flowgraph, function):
+        '''Returns the node of function, collecting its callers and callees
+        through flowgraph (a BinocularsFlowgraph) the first time.
+        '''
+        node = self.graph.node_id(function.start)
+        if node is not None and node in self._callees:
+            return node
+
+        # Callers first, get_xrefs_from_function marks the node EXPANDED.
+        xrefs = flowgraph.get_xrefs_to_function(function, self.graph) or []
+        _, callees = flowgraph.get_xrefs_from_function(function, self.graph)
+        self.graph.freeze()
+
+        node = self.graph.node_id(function.start)
+        self._callers[node] = set(self.graph.node_id(xref.function.start) for xref in xrefs)
+        self._callees[node] = set(self.graph.node_id(callee.start) for callee in callees)
+        return node
+
+    def neighbours(self, flowgraph, start):
+        '''Returns the starts of the callers and callees of the function at
+        start, collected if needed, or None if it isn't a function anymore.
+        '''
+        with self._lock:
+            self.__reset()
+            function = self.bv.get_function_at(start)
+            if function is None:
+                return None
+            node = self.__collect(flowgraph, function)
+            starts = self.graph.starts
+            return set(starts[neighbour] for neighbour in
+                self._callers[node] | self._callees[node])
+
+    def subgraph(self, flowgraph, visible):
+        '''Returns a CallGraph of the functions at the visible starts and the
+        calls between them. Functions with callers or callees not drawn, or
+        not collected yet, are flagged TRUNCATED. Starts that aren't functions
+        anymore are left out.
+        '''
+        with self._lock:
+            self.__reset()
+            nodes = []
+            for start in sorted(visible):
+                node = self.graph.node_id(start)
+                if node is None:
+                    # Dropped with the rest since it was drawn.
+                    function = self.bv.get_function_at(start)
+                    if function is None:
+                        continue
+                    node = self.__collect(flowgraph, function)
+                nodes.append(node)
+
+            graph = self.graph.freeze()
+            subgraph = CallGraph()
+            mapping = {}
+
+            for node in sorted(nodes):
+                mapping[node] = subgraph.add_node(graph.starts[node], graph.names[node],
+                    graph.labels[node])
+                subgraph.flags[mapping[node]] = graph.flags[node] & LIBRARY
+                if node not in self._callees or not all(graph.starts[neighbour] in visible
+                        for neighbour in self._callers[node] | self._callees[node]):
+                    subgraph.set_flag(mapping[node], TRUNCATED)
+
+            for node in sorted(nodes):
+                for callee, address in graph.successors(node):
+                    if callee in mapping:
+                        subgraph.add_edge(mapping[node], mapping[callee], address)
+
+            return subgraph.freeze()
+
+
+class Exploration(object):
+    '''One exploration, owned by the task drawing it.'''
+
+    def __init__(self, explorer):
+        self.explorer = explorer
+        '''Label -> (x, y) in points, from the last layout.'''
+        self.positions = {}
+        '''Starts of the functions drawn.'''
+        self.visible = set()
+
+    def explore(self, flowgraph, function, hops=EXPLORE_HOPS, max_nodes=EXPLORE_NODES):
+        '''Starts over from function: the functions within hops calls of it,
+        breadth first, up to max_nodes.
+        '''
+        visible = set([function.start])
+        frontier = [function.start]
+
+        for _ in range(hops):
+            following = []
+            for start in frontier:
+                if flowgraph.cancelled or len(visible) >= max_nodes:
+                    break
+                for neighbour in sorted(self.explorer.neighbours(flowgraph, start) or ()):
+                    if neighbour not in visible and len(visible) < max_nodes:
+                        visible.add(neighbour)
+                        following.append(neighbour)
+            frontier = following
+
+        self.visible = visible
+
+    def expand(self, flowgraph, function, max_nodes=EXPLORE_NODES):
+        '''Adds function with its callers and callees to the exploration.
+
+        Returns:
+            Number of functions added.
+        '''
+        added = 0
+        for neighbour in sorted(self.explorer.neighbours(flowgraph, function.start) or ()):
+            if neighbour not in self.visible and added < max_nodes:
+                self.visible.add(neighbour)
+                added += 1
+        self.visible.add(function.start)
+        return added
+
+    def subgraph(self, flowgraph):
+        '''Returns a CallGraph of the functions drawn, see Explorer.subgraph.'''
+        return self.explorer.subgraph(flowgraph, self.visible)
@@ -0,0 +1,122 @@
+'''Streaming export of call graphs for other tools.
+
+Nodes and edges are written to the file as they are visited, nothing is
+built up in memory, so graphs with millions of edges export in constant
+memory. Unlike the rendered graph, every edge keeps the address of every
+call site.
+
+Formats:
+    jsonl:      One JSON object per line, {"type": "node", ...} records
+                followed by {"type": "edge", ...} records.
+    graphml:    GraphML with start, name, label and flags node data and
+                count and addresses edge data.
+    dot:        Graphviz DOT, call sites in an addresses edge attribute.
+'''
+import json
+from xml.sax.saxutils import escape
+
+from .callgraph import REMOVED
+
+
+EXPORT_FORMATS = ('jsonl', 'graphml', 'dot')
+
+
+def _live(graph):
+    # Removed nodes are left out of the export.
+    return (node for node in range(len(graph)) if not graph.flags[node] & REMOVED)
+
+
+def write_jsonl(graph, f):
+    for node in _live(graph):
+        f.write(json.dumps({
+            'type': 'node',
+            'id': node,
+            'start': graph.starts[node],
+            'name': graph.names[node],
+            'label': graph.labels[node],
+            'flags': graph.flags[node],
+        }))
+        f.write('\n')
+
+    for caller, callee, addresses in graph.edges():
+        f.write(json.dumps({
+            'type': 'edge',
+            'caller': caller,
+            'callee': callee,
+            'addresses': addresses.tolist(),
+        }))
+        f.write('\n')
+
+
+GRAPHML_HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns">
+  <key id="start" for="node" attr.name="start" attr.type="long"/>
+  <key id="name" for="node" attr.name="name" attr.type="string"/>
+  <key id="label" for="node" attr.name="label" attr.type="string"/>
+  <key id="flags" for="node" attr.name="flags" attr.type="int"/>
+  <key id="count" for="edge" attr.name="count" attr.type="int"/>
+  <key id="addresses" for="edge" attr.name="addresses" attr.type="string"/>
+  <graph id="flowgraph" edgedefault="directed">
+'''
+
+GRAPHML_FOOTER = '''  </graph>
+</graphml>
+'''
+
+
+def write_graphml(graph, f):
+    f.write(GRAPHML_HEADER)
+
+    for node in _live(graph):
+        f.write('    <node id="n{}">'.format(node))
+        f.write('<data key="start">{}</data>'.format(graph.starts[node]))
+        f.write('<data key="name">{}</data>'.format(escape(graph.names[node])))
+        f.write('<data key="label">{}</data>'.format(escape(graph.labels[node])))
+        f.write('<data key="flags">{}</data>'.format(graph.flags[node]))
+        f.write('</node>\n')
+
+    for caller, callee, addresses in graph.edges():
+        f.write('    <edge source="n{}" target="n{}">'.format(caller, callee))
+        f.write('<data key="count">{}</data>'.format(len(addresses)))
+        f.write('<data key="addresses">{}</data>'.format(
+            ' '.join(hex(address) for address in addresses)))
+        f.write('</edge>\n')
+
+    f.write(GRAPHML_FOOTER)
+
+
+def _dot_quote(value):
+    return '"{}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def write_dot(graph, f):
+    f.write('digraph flowgraph {\n')
+
+    for node in _live(graph):
+        f.write('    n{} [label={} start="{:#x}" flags={}];\n'.format(
+            node, _dot_quote(graph.labels[node]), graph.starts[node], graph.flags[node]))
+
+    for caller, callee, addresses in graph.edges():
+        f.write('    n{} -> n{} [label={} addresses="{}"];\n'.format(
+            caller, callee, len(addresses),
+            ' '.join(hex(address) for address in addresses)))
+
+    f.write('}\n')
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'graphml': write_graphml,
+    'dot': write_dot,
+}
+
+
+def export_graph(graph, filename, file_format):
+    '''Writes graph (a CallGraph) to filename in file_format, one of
+    EXPORT_FORMATS.
+    '''
+    if file_format not in WRITERS:
+        raise ValueError('Unknown export format {}'.format(file_format))
+
+    with open(filename, 'w', encoding='utf-8') as f:
+        WRITERS[file_format](graph, f)
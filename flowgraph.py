@@ -5,21 +5,38 @@ pip install tco
 reference: http://matthiaseisen.com/articles/graphviz/
 '''
 from binaryninja import *
-import graphviz
-import tempfile
-import base64
-import subprocess
-
-
-try:
-    import cxxfilt
-
-except ImportError:
-    print('cxxfilt not installed')
-
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
-os.environ['PATH'] += os.pathsep + '/usr/local/bin/'
+# graphviz, tempfile and webbrowser are imported where used, so loading the
+# plugin doesn't pay for them.
+
+from .callees import code_refs_from_function
+from .callgraph import (CallGraph, EXPANDED, EXTERNAL, LIBRARY, REMOVED,
+    SUMMARY, TRUNCATED)
+from .demangle import get_demangler
+from .diff import ADDED, DELETED, block_counts, diff_graphs
+from .explore import EXPLORE_HOPS, Exploration, get_explorer
+from .export import EXPORT_FORMATS, export_graph
+from .function_index import get_function_index
+from .graph_cache import (XrefTable, function_fingerprint, function_shape,
+    generation_marker, get_graph_cache)
+from .live_graph import get_live_graph
+from .reachability import DEFAULT_PATHS, get_reachability_index, path_subgraph
+from .reduction import PAGE_NODES, live_nodes, paginate, reduce_graph
+from .render import RenderError, choose_engine, render_pinned, render_source
+from .render_cache import RenderCache, render_key
+from .report import PagedReport, single_page
+from .session import get_session_object
+from .stats import RunStats, profiled
+
 GRAPHVIZ_OUTPUT_PATH = '/tmp/'
+# Worker threads collecting whole binary xrefs, and functions per work item.
+XREF_WORKERS = min(8, os.cpu_count() or 1)
+XREF_CHUNK_SIZE = 256
+# Largest paginated report, in bytes, opened in binja rather than a browser.
+HTML_REPORT_LIMIT = 32 << 20
 debug = False
 
 
@@ -32,8 +49,50 @@ class BinocularsFlowgraph(BackgroundTaskThread):
         self.function = function
         # demangle type can be cppfilt, bn, None
         self.demangle = kwargs.get('demangle')
+        # Demangle cache shared with other runs on this binary view.
+        self.demangler = get_demangler(bv)
+        # Address to function lookups, also shared per binary view.
+        self.function_index = get_function_index(bv)
         '''Caller can specify which method to invoke.'''
         self.method = kwargs.get('method')
+        '''Optional budget for transitive graphs. None means unbounded.'''
+        self.max_depth = kwargs.get('max_depth')
+        self.max_nodes = kwargs.get('max_nodes')
+        '''Prompt for max_depth when the graph is built.'''
+        self.ask_depth = kwargs.get('ask_depth', False)
+        '''Threads used to collect whole binary xrefs. 1 runs serially.'''
+        self.workers = kwargs.get('workers') or XREF_WORKERS
+        '''Reuse and update the on disk xref cache, see graph_cache.py.'''
+        self.use_cache = kwargs.get('cache', True)
+        '''Keep the whole binary graph in sync with analysis, see live_graph.py.'''
+        self.live = kwargs.get('live', False)
+        '''Reduce large graphs before layout, see reduction.py. top_k keeps
+        only that many nodes.'''
+        self.reduce = kwargs.get('reduce', True)
+        self.top_k = kwargs.get('top_k')
+        '''Directory of the rendered image cache, False disables it.'''
+        render_cache = kwargs.get('render_cache')
+        self.render_cache = RenderCache(render_cache) if render_cache is not False else None
+        '''Image format, 'jpeg' or 'svg'. SVG is inlined in the report as is.'''
+        self.image_format = kwargs.get('image_format', 'jpeg')
+        '''Largest graph drawn on one page, larger ones are paginated.'''
+        self.page_nodes = kwargs.get('page_nodes') or PAGE_NODES
+        '''Path method: target function (start address or name, prompted for
+        when not given) and number of shortest call paths drawn.'''
+        self.target = kwargs.get('target')
+        self.paths = kwargs.get('paths') or DEFAULT_PATHS
+        '''Diff method: previous version, a BinaryView or file name, prompted
+        for when not given. See diff.py.'''
+        self.other = kwargs.get('other')
+        self.diff_states = None
+        '''Explore method: calls followed for the first picture, see explore.py.'''
+        self.hops = kwargs.get('hops') or EXPLORE_HOPS
+        '''Phase timings and counters, see stats.py. profile is a file name,
+        or True to print, to run under cProfile.'''
+        self.stats = RunStats(self, 'Binoculars Flowgraph')
+        self.profile = kwargs.get('profile')
+        '''Set when the task was cancelled and the graph built is partial.'''
+        self.partial = False
 
     def get_styles(self, label):
         styles = {
@@ -71,9 +130,16 @@ class BinocularsFlowgraph(BackgroundTaskThread):
         return graph
 
     def view_flowgraph_to_bin(self):
-        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text"])
+        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text", "Export"])
 
-        flowgraph = self.build_flowgraph_to_bin()
+        if self.live:
+            flowgraph = get_live_graph(self.bv, self.demangle).refresh(self)
+        else:
+            flowgraph = self.build_flowgraph_to_bin()
+
+        if self.cancelled:
+            self.__cancelled(flowgraph)
+            return
 
         if display_choice == 0:
             self.draw_graph(flowgraph, display='bn')
@@ -81,13 +147,21 @@ class BinocularsFlowgraph(BackgroundTaskThread):
             self.draw_graph(flowgraph, display='os')
         elif display_choice == 2:
             self.draw_graph(flowgraph, display='text')
+        elif display_choice == 3:
+            self.draw_graph(flowgraph, display='export')
 
 
     def view_flowgraph_to_function(self):
-        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text"])
+        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text", "Export"])
+
+        flowgraph = CallGraph()
+        with self.stats.phase('collect'):
+            self.build_flowgraph_to_function(self.function, flowgraph,
+                max_depth=self.max_depth, max_nodes=self.max_nodes)
 
-        flowgraph = {}
-        self.build_flowgraph_to_function(self.function, flowgraph)
+        if self.cancelled:
+            self.__cancelled(flowgraph)
+            return
 
         if display_choice == 0:
             self.draw_graph(flowgraph, function=self.function, display='bn')
@@ -95,84 +169,419 @@ class BinocularsFlowgraph(BackgroundTaskThread):
             self.draw_graph(flowgraph, function=self.function, display='os')
         elif display_choice == 2:
             self.draw_graph(flowgraph, function=self.function, display='text')
+        elif display_choice == 3:
+            self.draw_graph(flowgraph, function=self.function, display='export')
 
 
     def view_flowgraph_from_function(self):
-        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text"])
+        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text", "Export"])
+
+        max_depth = self.max_depth or 1
+        if self.ask_depth:
+            max_depth = get_int_input("Number of call levels to follow", "Flowgraph depth")
+            if max_depth is None or max_depth < 1:
+                return
+
+        flowgraph = CallGraph()
+        with self.stats.phase('collect'):
+            self.build_flowgraph_from_function(self.function, flowgraph,
+                max_depth=max_depth, max_nodes=self.max_nodes)
 
-        flowgraph = {}
-        self.build_flowgraph_from_function(self.function, flowgraph)
+        if self.cancelled:
+            self.__cancelled(flowgraph)
+            return
 
         if display_choice == 0:
-            self.draw_graph(flowgraph, function=self.function,
-                display='bn', forwards=True)
+            self.draw_graph(flowgraph, function=self.function, display='bn')
+        elif display_choice == 1:
+            self.draw_graph(flowgraph, function=self.function, display='os')
+        elif display_choice == 2:
+            self.draw_graph(flowgraph, function=self.function, display='text')
+        elif display_choice == 3:
+            self.draw_graph(flowgraph, function=self.function, display='export')
 
+
+    def find_target(self, target):
+        '''Returns the function at or containing address target, or the first
+        function whose raw or demangled name is target, or None.
+        '''
+        if isinstance(target, bytes):
+            target = target.decode('utf-8')
+        if isinstance(target, str):
+            target = target.strip()
+            try:
+                target = int(target, 0)
+            except ValueError:
+                for function in self.bv.functions:
+                    name = function.symbol.name
+                    if target == name or target == self.__get_demangled(name):
+                        return function
+                return None
+
+        return self.function_index.function_containing(target)
+
+
+    def view_flowgraph_path(self):
+        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text", "Export"])
+
+        target = self.target
+        if target is None:
+            target = get_text_line_input("Target function, name or address", "Flowgraph path")
+            if not target:
+                return
+        target = self.find_target(target)
+        if target is None:
+            show_message_box('Binoculars Flowgraph', 'No such function')
+            return
+
+        # The live graph and its reachability index are reused by later runs.
+        graph = get_live_graph(self.bv, self.demangle).refresh(self)
+        if self.cancelled:
+            self.__cancelled(graph)
+            return
+
+        with self.stats.phase('reachability'):
+            index = get_reachability_index(self.bv, graph)
+            source, destination = graph.node_id(self.function.start), graph.node_id(target.start)
+            paths = []
+            if source is not None and destination is not None:
+                paths = index.paths(source, destination, self.paths)
+        self.stats.set('paths', len(paths))
+
+        if not paths:
+            show_message_box('Binoculars Flowgraph', 'No call path from {} to {}'.format(
+                self.function.symbol.name, target.symbol.name))
+            return
+
+        flowgraph = path_subgraph(graph, paths)
+
+        if display_choice == 0:
+            self.draw_graph(flowgraph, function=self.function, display='bn')
         elif display_choice == 1:
-            self.draw_graph(flowgraph, function=self.function,
-                display='os', forwards=True)
+            self.draw_graph(flowgraph, function=self.function, display='os')
+        elif display_choice == 2:
+            self.draw_graph(flowgraph, function=self.function, display='text')
+        elif display_choice == 3:
+            self.draw_graph(flowgraph, function=self.function, display='export')
+
+
+    def view_flowgraph_diff(self):
+        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS", "Text", "Export"])
+
+        other = self.other
+        if other is None:
+            other = get_open_filename_input("Previous version to diff against")
+            if not other:
+                return
+        if isinstance(other, bytes):
+            other = other.decode('utf-8')
+
+        opened = None
+        if isinstance(other, str):
+            with self.stats.phase('analysis'):
+                other = opened = BinaryViewType.get_view_of_file(other)
+            if other is None:
+                show_message_box('Binoculars Flowgraph', 'Unable to open previous version')
+                return
+
+        try:
+            if self.live:
+                new = get_live_graph(self.bv, self.demangle).refresh(self)
+            else:
+                new = self.build_flowgraph_to_bin()
+            if self.cancelled:
+                self.__cancelled(new)
+                return
+
+            # Collected under this task, so cancelling it stops both.
+            old = self.build_flowgraph_to_bin(bv=other)
+            if self.cancelled:
+                self.__cancelled(old)
+                return
+
+            with self.stats.phase('diff'):
+                diff = diff_graphs(old, new, block_counts(other, old), block_counts(self.bv, new))
+                flowgraph, self.diff_states = diff.changed_graph()
+        finally:
+            if opened is not None:
+                opened.file.close()
+
+        self.stats.set('matched functions', diff.matched())
+        self.stats.set('calls added', len(diff.added))
+        self.stats.set('calls removed', len(diff.removed))
+
+        if not diff.added and not diff.removed:
+            show_message_box('Binoculars Flowgraph', 'No calls added or removed, {} functions matched'.format(
+                diff.matched()))
+            return
 
+        if display_choice == 0:
+            self.draw_graph(flowgraph, display='bn')
+        elif display_choice == 1:
+            self.draw_graph(flowgraph, display='os')
         elif display_choice == 2:
-            self.draw_graph(flowgraph, function=self.function,
-                display='text', forwards=True)
+            self.draw_graph(flowgraph, display='text')
+        elif display_choice == 3:
+            self.draw_graph(flowgraph, display='export')
+
+
+    def view_flowgraph_explore(self):
+        display_choice = get_choice_input("Select graph view type", "choices", ["Binja", "OS"])
+        if display_choice is None:
+            return
+        display = ['bn', 'os'][display_choice]
+
+        exploration = Exploration(get_explorer(self.bv, self.demangle))
+        with self.stats.phase('collect'):
+            exploration.explore(self, self.function, hops=self.hops)
+
+        while not self.cancelled:
+            try:
+                self.__show_explored(exploration, display)
+            except RenderError as e:
+                show_message_box('Graphflow display', 'Graphviz failed: {}'.format(e))
+                return
+
+            target = get_text_line_input("Function to expand, name or address. Empty to stop",
+                "Flowgraph explore")
+            if not target:
+                return
+            function = self.find_target(target)
+            if function is None:
+                show_message_box('Binoculars Flowgraph', 'No such function')
+                continue
+
+            with self.stats.phase('collect'):
+                added = exploration.expand(self, function)
+            self.stats.count('expansions')
+            self.stats.count('functions shown', added)
+
+
+    def __show_explored(self, exploration, display):
+        '''Draws the explored functions. Those drawn before stay where they
+        were, only the new ones are laid out.
+        '''
+        flowgraph = exploration.subgraph(self)
+        g = self.__draw_graph(flowgraph, function=self.function,
+            notes=['{} functions, ... marks more calls'.format(len(flowgraph))])
 
+        for label in flowgraph.labels:
+            position = exploration.positions.get(label)
+            if position is not None:
+                g.node(label, pos='{:.2f},{:.2f}!'.format(*position))
 
-    def draw_graph(self, flowgraph, function=None, forwards=False, display='bn'):
+        with self.stats.phase('layout'):
+            image, exploration.positions, warnings = render_pinned(g.source, g.format)
+        self.stats.count('bytes rendered', len(image))
+
+        if warnings:
+            log_warn('Binoculars Flowgraph graphviz: {}'.format(warnings))
+
+        if display == 'bn':
+            self.bv.show_html_report("Binoculars Flowgraph", single_page('Flowgraph', image, g.format))
+            return
+
+        import graphviz
+        import tempfile
+        fd, filename = tempfile.mkstemp(dir=GRAPHVIZ_OUTPUT_PATH,
+            prefix=g.filename + '-', suffix='.' + g.format)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image)
+        graphviz.view(filename)
+
+
+    def __cancelled(self, flowgraph):
+        log_info('Binoculars Flowgraph cancelled, partial graph of {} functions not drawn'.format(
+            len(live_nodes(flowgraph))))
+
+
+    def draw_graph(self, flowgraph, function=None, display='bn'):
         '''Takes a flowgraph and displays the graphic.
 
+        Graphs larger than one page (see reduction.paginate) are rendered
+        page by page into an HTML file, so only one page image is in memory
+        at a time.
+
         Arguments
             flowgraph:
-                Dictionary.             e.g. {'main':{'printf':[1001, 1020]} ...}
-            forwards:
-                Direction of arrows.    boolean
+                CallGraph. Edges are drawn from caller to callee.
             display:
                 Where to display graphic. string.
                                         'bn' shows in binja gui.
-                                        None Default os image viewer.
+                                        'os' Default os image viewer.
+                                        'text' DOT source.
+                                        'export' Every node and xref to a file.
             function:
                 Binja function object.
 
         Returns
         None
         '''
-        g, filename = self.__draw_graph(flowgraph, function=function, forwards=forwards)
-        pngdata = base64.b64encode(open(filename,'rb').read())
-
-        output = """
-        <html>
-        <title>Flowgraph</title>
-        <body>
-        <div align='center'>
-            <h1>Flowgraph</h1>
-        </div>
-        <div align='center'>
-            <img src='data:image/png;base64,%s' alt='flowgraph'>
-        </div>
-        </body>
-        </html>
-        """ % (pngdata.decode("ascii"))
-
-        debug and print(output)
-
-        if display == 'bn':
-            show_message_box('Graphflow display', 'File location: {}'.format(filename))
-            self.bv.show_html_report("Binoculars Flowgraph", output)
-        elif display == 'os':
-            show_message_box('Graphflow display', 'File location: {}'.format(filename))
-            g.view()
+        if display == 'export':
+            self.export_graph(flowgraph)
+            return
         elif display == 'text':
+            # No layout needed for the DOT source.
+            g = self.__draw_graph(flowgraph, function=function)
             self.bv.show_plain_text_report("Binoculars Flowgraph", str(g))
-        else:
+            return
+        elif display not in ('bn', 'os'):
             show_message_box('Graphflow display', 'Output type not selected')
+            return
+
+        steps = []
+        with self.stats.phase('reduce'):
+            if self.reduce:
+                flowgraph, steps = reduce_graph(flowgraph, top_k=self.top_k)
+
+            pages = paginate(flowgraph, self.page_nodes)
+
+        try:
+            if len(pages) == 1:
+                self.__show_page(pages[0], function, steps, display)
+            else:
+                self.__show_pages(pages, function, steps, display)
+        except RenderError as e:
+            show_message_box('Graphflow display', 'Graphviz failed: {}'.format(e))
 
 
-    def __draw_graph(self, flowgraph, function=None, filename=None, forwards=False):
+    def export_graph(self, flowgraph, filename=None, file_format=None):
+        '''Streams the complete, unreduced flowgraph to a file, see export.py.
+        Prompts for the format and file name unless given.
         '''
+        if file_format is None:
+            choice = get_choice_input("Select export format", "choices", list(EXPORT_FORMATS))
+            if choice is None:
+                return
+            file_format = EXPORT_FORMATS[choice]
+
+        if filename is None:
+            filename = get_save_filename_input("Export flowgraph", file_format)
+            if not filename:
+                return
+            if isinstance(filename, bytes):
+                filename = filename.decode('utf-8')
+
+        with self.stats.phase('export'):
+            export_graph(flowgraph, filename, file_format)
+        log_info('Binoculars Flowgraph exported {} nodes, {} edges to {}'.format(
+            len(live_nodes(flowgraph)), flowgraph.edge_count, filename))
+
+
+    def __render(self, flowgraph, function=None, notes=None):
+        '''Lays out and renders flowgraph, through the render cache.
+
         Returns:
-            Graphviz graph object.
+            Graphviz graph object, image bytes and the cached file or None.
+        '''
+        engine = choose_engine(len(live_nodes(flowgraph)), flowgraph.edge_count)
+        debug and print('layout engine {}, notes {}'.format(engine, notes))
+
+        g = self.__draw_graph(flowgraph, function=function, notes=notes)
+
+        key = render_key(g.source, self.get_styles(None), g.format, engine)
+        filename = self.render_cache.get(key, g.format) if self.render_cache else None
+
+        if filename:
+            # Same graph rendered before, skip graphviz.
+            try:
+                with open(filename, 'rb') as f:
+                    return g, f.read(), filename
+            except (IOError, OSError):
+                # Evicted meanwhile
+                filename = None
+
+        with self.stats.phase('layout'):
+            image, warnings = render_source(g.source, g.format, engine=engine)
+        self.stats.count('bytes rendered', len(image))
+
+        if warnings:
+            log_warn('Binoculars Flowgraph graphviz: {}'.format(warnings))
+
+        if self.render_cache:
+            try:
+                filename = self.render_cache.put(key, g.format, image)
+            except (IOError, OSError) as e:
+                log_warn('Binoculars Flowgraph unable to write render cache: {}'.format(e))
+
+        return g, image, filename
+
+
+    def __show_page(self, flowgraph, function, notes, display):
+        g, image, filename = self.__render(flowgraph, function=function, notes=notes)
+
+        if display == 'bn':
+            with self.stats.phase('report'):
+                output = single_page('Flowgraph', image, g.format)
+            debug and print(output)
+            self.bv.show_html_report("Binoculars Flowgraph", output)
+            return
+
+        import graphviz
+        if not filename:
+            import tempfile
+            # Cache disabled, unique name so parallel runs don't clash.
+            fd, filename = tempfile.mkstemp(dir=GRAPHVIZ_OUTPUT_PATH,
+                prefix=g.filename + '-', suffix='.' + g.format)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image)
+
+        show_message_box('Graphflow display', 'File location: {}'.format(filename))
+        graphviz.view(filename)
+
+
+    def __show_pages(self, pages, function, notes, display):
+        import tempfile
+        import webbrowser
+        titles = ['Page {} of {}: {} nodes'.format(index + 1, len(pages), len(page))
+            for index, page in enumerate(pages)]
 
-            filename.
+        fd, filename = tempfile.mkstemp(dir=GRAPHVIZ_OUTPUT_PATH,
+            prefix=os.path.basename(self.bv.file.filename) + '-', suffix='.html')
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                report = PagedReport(f, 'Flowgraph', titles)
+                for index, page in enumerate(pages):
+                    if self.cancelled:
+                        break
+                    g, image, _ = self.__render(page, function=function,
+                        notes=notes + [titles[index]])
+                    with self.stats.phase('report'):
+                        report.add_page(index, titles[index], image, g.format)
+                    self.stats.count('pages')
+                    # Only the current page is kept in memory.
+                    del image
+                else:
+                    report.close()
+        except Exception:
+            os.remove(filename)
+            raise
+
+        if self.cancelled:
+            # Half written, nothing opens it.
+            os.remove(filename)
+            return
+
+        if display == 'bn' and os.path.getsize(filename) <= HTML_REPORT_LIMIT:
+            with open(filename) as f:
+                self.bv.show_html_report("Binoculars Flowgraph", f.read())
+            return
+
+        show_message_box('Graphflow display', 'File location: {}'.format(filename))
+        webbrowser.open('file://' + filename)
+
+
+    def __draw_graph(self, flowgraph, function=None, filename=None, notes=None):
+        '''
+        Arguments:
+            notes:  Lines appended to the graph label, e.g. reduction steps.
+
+        Returns:
+            Graphviz graph object, not rendered.
         '''
-        file_type = 'jpeg' # 'png'
+        import graphviz
+        file_type = self.image_format
         '''Iterating over every xref can clutter a graph.
          Better to display one arrow and label with count.
         '''
@@ -195,308 +604,696 @@ class BinocularsFlowgraph(BackgroundTaskThread):
             graph_attr={'nodesep': '2.0'},
             )
 
-        for node in flowgraph.keys():
-            g.node(node, color='blue')
-            dst = node
-            debug and print('node: {}'.format(node))
+        labels = flowgraph.labels
+        # Diff colours, see view_flowgraph_diff.
+        diff_nodes = self.diff_states['nodes'] if self.diff_states else {}
+        diff_edges = self.diff_states['edges'] if self.diff_states else {}
 
-            if not isinstance(flowgraph[node],dict):
+        for node in range(len(flowgraph)):
+            if flowgraph.has_flag(node, REMOVED):
                 continue
+            elif flowgraph.has_flag(node, SUMMARY):
+                # Several functions collapsed by reduction.py
+                g.node(labels[node], color='blue', shape='folder',
+                    fillcolor='#444444')
+            elif flowgraph.has_flag(node, EXTERNAL):
+                # Drawn in full on another page
+                g.node(labels[node], color='blue', style='dashed')
+            elif flowgraph.has_flag(node, TRUNCATED):
+                # Callers beyond this node were cut off by the budget
+                g.node(labels[node], color='blue', style='filled,dashed',
+                    fillcolor='#996600', xlabel='...')
+            elif diff_nodes.get(labels[node]) == ADDED:
+                g.node(labels[node], color='blue', fillcolor='#2e7d32')
+            elif diff_nodes.get(labels[node]) == DELETED:
+                g.node(labels[node], color='blue', style='filled,dashed',
+                    fillcolor='#8e2424')
+            else:
+                g.node(labels[node], color='blue')
+            debug and print('node: {}'.format(labels[node]))
+
+        for caller, callee, xref_addrs in flowgraph.edges():
+            src = labels[caller]
+            dst = labels[callee]
+            debug and print('src: {}'.format(src))
+
+            state = diff_edges.get((src, dst))
+            if state == ADDED:
+                g.edge(src, dst, label=str(len(xref_addrs)), color='#4caf50',
+                    fontcolor='#4caf50', penwidth='2')
+            elif state == DELETED:
+                g.edge(src, dst, label=str(len(xref_addrs)), color='#e53935',
+                    fontcolor='#e53935', style='dashed', penwidth='2')
+            elif xref_style == 'count':
+                # Used to display count of xrefs between nodes
+                g.edge(src, dst, label=str(len(xref_addrs)))
+            else:
+                for xref_addr in xref_addrs:
+                    debug and print('xref_addr: {}'.format(xref_addr))
+                    g.edge(src, dst, label=hex(xref_addr).replace("L", ""))
+
+        debug and print('g: {}'.format(g))
 
-            for src in flowgraph[node].keys():
-                debug and print('src: {}'.format(src))
+        label = 'Flowgraph {}'.format(filename)
+        if notes:
+            label = '\n'.join([label] + notes)
 
-                count_label = len(flowgraph[node][src]) # Used to display count of xrefs between nodes
+        styles = self.get_styles(label)
+        g = self.apply_styles(g, styles)
 
-                if xref_style == 'count':
-                    if forwards:
-                        g.edge(dst, src, label=str(count_label))
-                    else:
-                        g.edge(src, dst, label=str(count_label))
-                else:
-                    for xref_addr in flowgraph[node][src]:
-                        debug and print('xref_addr: {}'.format(xref_addr))
+        return g
 
-                        if forwards:
-                            g.edge(dst, src, label=hex(xref_addr).replace("L", ""))
-                        else:
-                            g.edge(src, dst, label=hex(xref_addr).replace("L", ""))
 
-        debug and print('g: {}'.format(g))
+    def __get_demangled(self, name, demangler=None):
+        return (demangler or self.demangler).demangle(self.demangle, name)
 
-        styles = self.get_styles('Flowgraph {}'.format(filename))
-        g = self.apply_styles(g, styles)
 
-        if g.render():
-            gv_filename_path = os.path.join(GRAPHVIZ_OUTPUT_PATH, filename)
-            # Improve aspect ratio of graph.
-            self.__fix_aspect_ratio(gv_filename_path, file_type)
-            # Graphviz automatically appends file type extension
-            return g, gv_filename_path + '.' + file_type
+    def __add_function(self, flowgraph, function, demangler=None):
+        '''Returns the node id of function, adding it to flowgraph with its
+        demangled label when first seen.
 
+        Arguments:
+            demangler:  Demangler of the view function belongs to, defaults
+                        to the one of self.bv.
+        '''
+        node = flowgraph.node_id(function.start)
+
+        if node is None:
+            name = function.symbol.name
+            node = flowgraph.add_node(function.start, name, self.__get_demangled(name, demangler))
+            self.stats.count('functions')
+
+            if self.__is_library(function):
+                flowgraph.set_flag(node, LIBRARY)
+
+        return node
 
-    def __fix_aspect_ratio(self, filename, file_type):
-        '''Hack to unflatten aspect ratio of graphviz graph images.
+
+    def __is_library(self, function):
+        '''Imported, library and thunk functions can be collapsed when
+        reducing large graphs.
         '''
-        unflatten = subprocess.Popen(['unflatten', '-f', '-l4', '-c6', filename],
-                                stdout=subprocess.PIPE,
-                                )
-
-        dot = subprocess.Popen(['dot'],
-                                stdin=unflatten.stdout,
-                                stdout=subprocess.PIPE,
-                                )
-
-        gvpack = subprocess.Popen(['gvpack', '-array_t6'],
-                                stdin=dot.stdout,
-                                stdout=subprocess.PIPE,
-                                )
-
-        neato = subprocess.Popen(['neato', '-s', '-n2', '-T' + file_type, '-o' + filename + '.' + file_type],
-                                stdin=gvpack.stdout,
-                                stdout=subprocess.PIPE,
-                                )
-
-        end_of_pipe = neato.stdout
-
-        for line in end_of_pipe:
-            print('\t', line.strip())
-
-
-    '''https://en.wikipedia.org/wiki/Name_mangling
-    graphviz doesn't like colons in node names. This function tries to address
-    this.
-    '''
-    def __get_demangled_bn(self, name):
-        return_pretty_name = None
-        demangle_name = None
-
-        if name and name.find('__Z', 0, 3) > -1:
-            # Test for gnu3 style names __Z
-            type, demangle_name = demangle_gnu3(self.bv.arch, name)
-
-        elif name and name.find('?', 0, 1) > -1:
-            # Test for msvc++ names ?funcname
-            # TODO: improve match with regex
-            type, demangle_name = demangle_ms(self.bv.arch, name)
-
-        if demangle_name:
-            return_pretty_name = get_qualified_name(demangle_name)
-        else:
-            return_pretty_name = name
+        library_types = [SymbolType.ImportedFunctionSymbol,
+            getattr(SymbolType, 'LibraryFunctionSymbol', None)]
+
+        return function.symbol.type in library_types or \
+            bool(getattr(function, 'is_thunk', False))
+
+
+    def build_flowgraph_to_bin(self, bv=None):
+        '''Builds the whole binary graph of bv, by default self.bv. Another
+        view, e.g. the previous version diffed against, is collected under
+        this task: its cancel flag, progress and stats.
+        '''
+        if bv is None:
+            bv = self.bv
+        functions = list(bv.functions)
+        with self.stats.phase('collect'):
+            table, names = self.collect_xref_table(functions, bv)
+        self.stats.count('xrefs', len(table.callees))
+
+        with self.stats.phase('build'):
+            return self.build_flowgraph_from_table(functions, table, names, bv)
+
 
-        return return_pretty_name
+    def build_flowgraph_from_table(self, functions, table, names=None, bv=None):
+        '''Builds the labelled whole binary graph from an XrefTable.
+
+        Arguments:
+            names:  Optional dictionary of function start -> symbol name for
+                    callers that aren't in functions.
+            bv:     View functions belong to, by default self.bv.
+        '''
+        if bv is None:
+            bv = self.bv
+        demangler = get_demangler(bv)
+        flowgraph = CallGraph()
+        names = dict(names or {})
+
+        # Demangle every symbol in one pass, nodes are labelled from cache.
+        for function in functions:
+            names[function.start] = function.symbol.name
+        for caller in set(table.callers).difference(names):
+            caller_function = bv.get_function_at(caller)
+            if caller_function is not None:
+                names[caller] = caller_function.symbol.name
+        with self.stats.phase('demangle'):
+            demangler.demangle_all(self.demangle, list(names.values()))
+
+        for function in functions:
+            self.__add_function(flowgraph, function, demangler)
+
+        callees, callers, addresses = table.callees, table.callers, table.addresses
+
+        for index in range(len(callees)):
+            caller = flowgraph.node_id(callers[index])
+            if caller is None:
+                name = names.get(callers[index])
+                if name is None:
+                    # Caller no longer exists
+                    continue
+                caller = flowgraph.add_node(callers[index], name, self.__get_demangled(name, demangler))
+
+            # Function can have multiple xrefs to it from the same xref
+            # function block. Duplicates are dropped by the graph.
+            flowgraph.add_edge(caller, flowgraph.node_id(callees[index]), addresses[index])
+
+        debug and print('demangler {}'.format(demangler.stats()))
+
+        return flowgraph.freeze()
+
+
+    def collect_xref_table(self, functions, bv=None):
+        '''Returns the XrefTable of functions, using the on disk cache when
+        enabled. A cache that doesn't match the current analysis is patched:
+        only functions added, removed or changed since it was written are
+        collected again. See graph_cache.py for how changes are found.
 
+        Arguments:
+            bv:     View functions belong to, by default self.bv.
 
-    '''https://en.wikipedia.org/wiki/Name_mangling
-    graphviz doesn't like colons in node names. This function tries to address
-    this.
-    '''
-    def __get_demangled_filt(self, name):
-        return_pretty_name = None
+        Returns:
+            XrefTable and dictionary of caller start -> symbol name for
+            callers found while collecting.
+        '''
+        if bv is None:
+            bv = self.bv
+        starts = array('Q', (function.start for function in functions))
+        changes = get_function_index(bv).changes
+        cache = get_graph_cache(bv) if self.use_cache else None
+        names = {}
+
+        if cache is not None:
+            table = self.__update_xref_table(cache, functions, bv)
+            if table is not None:
+                return table, names
+
+        # Chunks finished by a cancelled run on the same analysis state.
+        resume = get_session_object(bv, 'binoculars.xref_chunks', lambda bv: {})
+        generation = (generation_marker(starts), changes)
+        for stale in [key for key in resume if key != generation]:
+            del resume[stale]
+
+        table = XrefTable(starts=starts)
+        table.callees, table.callers, table.addresses, names = \
+            self.collect_xrefs_to_bin(functions, resume.setdefault(generation, {}), bv)
+
+        if self.partial:
+            return table, names
+        resume.pop(generation, None)
+
+        if cache is not None:
+            table.shapes = self.__digest_functions(functions, function_shape,
+                'functions fingerprinted')
+            table.fingerprints = self.__digest_functions(functions, function_fingerprint,
+                'functions fingerprinted')
+            # Cancelled, the graph is complete but isn't cached.
+            if table.shapes is not None and table.fingerprints is not None:
+                self.__save_xref_table(cache, table, changes)
+
+        return table, names
+
+
+    def __digest_functions(self, functions, digest, step):
+        '''Returns an array of digest(function) for functions, computed in
+        chunks of XREF_CHUNK_SIZE on self.workers threads. Progress is
+        reported as step.
 
+        Returns:
+            array, or None if the task was cancelled.
+        '''
+        chunks = [functions[i:i + XREF_CHUNK_SIZE]
+            for i in range(0, len(functions), XREF_CHUNK_SIZE)]
+        values = array('Q')
+
+        def run(chunk):
+            if self.cancelled:
+                return None
+            return array('Q', (digest(function) for function in chunk))
+
+        def collect(results):
+            for result in results:
+                if result is None or self.cancelled:
+                    return None
+                values.extend(result)
+                self.stats.step(step, len(values), len(functions))
+            return values
+
+        if self.workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # Chunks still queued return None once cancelled.
+                return collect(pool.map(run, chunks))
+        return collect(map(run, chunks))
+
+
+    def __save_xref_table(self, cache, table, changes):
+        cache.remember(table, changes)
         try:
-            return_pretty_name = cxxfilt.demangle(name, external_only=False)
-        except:
-            return_pretty_name = name
+            cache.save(table)
+        except (IOError, OSError) as e:
+            log_warn('Binoculars Flowgraph unable to write xref cache: {}'.format(e))
 
-        return return_pretty_name
 
+    def __update_xref_table(self, cache, functions, bv):
+        '''Returns the cached XrefTable patched to match functions,
+        collecting xrefs again only for the functions whose fingerprint
+        differs, or None if there is no usable cache.
+        '''
+        cached, synced = cache.remembered()
+        if cached is None:
+            cached = cache.load()
+            if cached is None:
+                return None
+            debug and print('xref cache loaded {}'.format(cache.path()))
+
+        changed, changes = get_function_index(bv).changed_since(synced or 0)
+        by_start = dict((function.start, function) for function in functions)
+        old = dict((start, index) for index, start in enumerate(cached.starts))
+
+        added = set(start for start in by_start if start not in old)
+        removed = set(start for start in old if start not in by_start)
+        candidates = added | (changed & set(by_start))
+
+        if synced is None:
+            # Written by another session, any function may differ.
+            checked = functions
+        else:
+            checked = [by_start[start] for start in sorted(candidates)]
+        values = self.__digest_functions(checked, function_shape, 'functions checked')
+        if values is None:
+            self.partial = True
+            return XrefTable(starts=array('Q', (function.start for function in functions)))
+        shapes = dict(zip((function.start for function in checked), values))
+
+        for start, shape in shapes.items():
+            if start in old and cached.shapes[old[start]] != shape:
+                candidates.add(start)
+
+        checked = [by_start[start] for start in sorted(candidates)]
+        values = self.__digest_functions(checked, function_fingerprint,
+            'functions fingerprinted')
+        if values is None:
+            self.partial = True
+            return XrefTable(starts=array('Q', (function.start for function in functions)))
+        fingerprints = dict(zip((function.start for function in checked), values))
+
+        rescan = set(start for start in candidates
+            if start in added or cached.fingerprints[old[start]] != fingerprints[start])
+
+        debug and print('xref cache: {} added, {} changed, {} removed'.format(
+            len(added), len(rescan - added), len(removed)))
+
+        if not rescan and not removed:
+            debug and print('xref cache hit {}'.format(cache.path()))
+            cache.remember(cached, changes)
+            return cached
+
+        table = XrefTable(starts=array('Q', (function.start for function in functions)))
+        for function in functions:
+            start = function.start
+            if start in candidates:
+                table.shapes.append(shapes[start])
+                table.fingerprints.append(fingerprints[start])
+            else:
+                table.shapes.append(cached.shapes[old[start]])
+                table.fingerprints.append(cached.fingerprints[old[start]])
 
-    def __get_demangled(self, name):
-        if self.demangle == 'cppfilt':
-            return_pretty_name = self.__get_demangled_filt(name)
+        # Keep xrefs of unchanged callers to functions that still exist.
+        for index in range(len(cached.callees)):
+            caller = cached.callers[index]
+            if caller in rescan or caller in removed or cached.callees[index] in removed:
+                continue
+            table.callees.append(cached.callees[index])
+            table.callers.append(caller)
+            table.addresses.append(cached.addresses[index])
+
+        # Xrefs made by new and changed functions.
+        for done, start in enumerate(sorted(rescan)):
+            if self.cancelled:
+                self.partial = True
+                return table
+            self.stats.step('changed functions', done, len(rescan))
+            for address, target in code_refs_from_function(bv, by_start[start]):
+                if target in by_start:
+                    table.callees.append(target)
+                    table.callers.append(start)
+                    table.addresses.append(address)
+
+        # Xrefs from unchanged code to functions defined since.
+        for start in sorted(added):
+            for xref in bv.get_code_refs(by_start[start].symbol.address):
+                if xref.function is None or xref.function.start in rescan:
+                    continue
+                table.callees.append(start)
+                table.callers.append(xref.function.start)
+                table.addresses.append(xref.address)
+
+        self.__save_xref_table(cache, table, changes)
+        return table
+
+
+    def collect_xrefs_to_bin(self, functions, resume=None, bv=None):
+        '''Collects every xref to every function in functions. The list is
+        split in chunks of XREF_CHUNK_SIZE, collected on self.workers threads
+        and merged in chunk order, so the result doesn't depend on the
+        number of threads.
+
+        Collection stops when the task is cancelled. Only the finished chunks
+        are returned and self.partial is set.
 
-        elif self.demangle == 'bn':
-            return_pretty_name = self.__get_demangled_bn(name)
+        Arguments:
+            resume: Optional dictionary of chunk index -> result. Chunks in it
+                    aren't collected again, and every chunk finished is added
+                    to it, so a cancelled collection can be resumed.
+            bv:     View functions belong to, by default self.bv.
 
+        Returns:
+            callees, callers, addresses. Parallel arrays, one entry per xref
+                holding the called function start, the calling function
+                start and the xref address.
+            names. Dictionary of calling function start -> symbol name.
+        '''
+        if bv is None:
+            bv = self.bv
+        chunks = [functions[i:i + XREF_CHUNK_SIZE]
+            for i in range(0, len(functions), XREF_CHUNK_SIZE)]
+        results = resume if resume is not None else {}
+        todo = [index for index in range(len(chunks)) if index not in results]
+
+        def finished(index, result):
+            if result is not None:
+                results[index] = result
+            self.stats.step('functions collected', min(len(results) * XREF_CHUNK_SIZE,
+                len(functions)), len(functions))
+
+        if self.workers > 1 and len(todo) > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [(index, pool.submit(self.__collect_xrefs_chunk, chunks[index], bv))
+                    for index in todo]
+                for index, future in futures:
+                    if self.cancelled:
+                        # Chunks already running return None or finish.
+                        future.cancel()
+                    if not future.cancelled():
+                        finished(index, future.result())
         else:
-            return_pretty_name = name
+            for index in todo:
+                if self.cancelled:
+                    break
+                finished(index, self.__collect_xrefs_chunk(chunks[index], bv))
 
-        # Graphviz doesn't like colons in names
-        return_pretty_name = return_pretty_name.replace(':','.')
+        if len(results) < len(chunks):
+            self.partial = True
 
-        return return_pretty_name
+        callees = array('Q')
+        callers = array('Q')
+        addresses = array('Q')
+        names = {}
 
+        for index in sorted(results):
+            chunk_callees, chunk_callers, chunk_addresses, chunk_names = results[index]
+            callees.extend(chunk_callees)
+            callers.extend(chunk_callers)
+            addresses.extend(chunk_addresses)
+            names.update(chunk_names)
 
-    def build_flowgraph_to_bin(self):
-        flowgraph = {}
+        return callees, callers, addresses, names
 
-        for function in self.bv.functions:
-            pretty_name_function = self.__get_demangled(function.symbol.name)
 
-            if pretty_name_function not in flowgraph.keys():
-                flowgraph[pretty_name_function] = {}
+    def __collect_xrefs_chunk(self, functions, bv):
+        '''Worker for collect_xrefs_to_bin. Only reads from the binary view.
+        Returns None if the task is cancelled before the chunk is finished.
+        '''
+        callees = array('Q')
+        callers = array('Q')
+        addresses = array('Q')
+        names = {}
 
-            for xref in self.bv.get_code_refs(function.symbol.address):
-                pretty_name_xref = self.__get_demangled(xref.function.symbol.name)
+        for function in functions:
+            if self.cancelled:
+                return None
 
-                # Find all xrefs to function.
-                if pretty_name_xref not in flowgraph[pretty_name_function].keys():
-                    # Add xref function name to base function
-                    flowgraph[pretty_name_function][pretty_name_xref] = []
+            for xref in bv.get_code_refs(function.symbol.address):
+                if xref.function is None:
+                    continue
 
-                if xref.address not in flowgraph[pretty_name_function][pretty_name_xref]:
-                    # Add newly discovered xref address to xref function.
-                    # Function can have multiple xrefs to it from the same xref function block.
-                    flowgraph[pretty_name_function][pretty_name_xref].append(xref.address)
+                caller = xref.function.start
+                if caller not in names:
+                    names[caller] = xref.function.symbol.name
+
+                callees.append(function.start)
+                callers.append(caller)
+                addresses.append(xref.address)
 
-        return flowgraph
+        return callees, callers, addresses, names
 
 
     def get_xrefs_to_function(self, function, flowgraph):
         '''Discover all xrefs to specified function. Not recursive.
         Returns:
             List of xref objects
-            Updates flowgraph dictionay with new xrefs
-                e.g. {'_lua_typename': {'_luaB_type': [4295090502],
-                      '_typeerror': [4295080892],
-                      '_tconcat': [4295128755, 4295128872],}}
+            Updates flowgraph CallGraph with new xrefs, from each xref
+                function to the specified function.
         '''
         xref_list = []
 
-        pretty_name_function = self.__get_demangled(function.symbol.name)
+        callee = self.__add_function(flowgraph, function)
 
-        if pretty_name_function not in flowgraph.keys():
-            # Add function name to graph if not already stored
-            flowgraph[pretty_name_function] = {}
+        if not flowgraph.has_flag(callee, EXPANDED):
+            # Only collect xrefs once per function
+            flowgraph.set_flag(callee, EXPANDED)
+            seen = set()
 
             for xref in self.bv.get_code_refs(function.symbol.address):
+                if xref.function is None:
+                    continue
 
-                pretty_name_xref = self.__get_demangled(xref.function.symbol.name)
+                caller = self.__add_function(flowgraph, xref.function)
 
-                # Find all xrefs to function.
-                if pretty_name_xref not in flowgraph[pretty_name_function].keys():
-                    # Add xref function name to base function
-                    flowgraph[pretty_name_function][pretty_name_xref] = []
-
-                if xref.address not in flowgraph[pretty_name_function][pretty_name_xref]:
+                if (caller, xref.address) not in seen:
                     # Add newly discovered xref address to xref function.
                     # Function can have multiple xrefs to it from the same xref function block.
-                    flowgraph[pretty_name_function][pretty_name_xref].append(xref.address)
+                    seen.add((caller, xref.address))
+                    flowgraph.add_edge(caller, callee, xref.address)
                     xref_list.append(xref)
 
+            self.stats.count('xrefs', len(xref_list))
+
             return xref_list if xref_list else None
 
 
 
-    def build_flowgraph_to_function(self, function, flowgraph, debug=False):
-        '''Builds a dictionary of xrefs to specified
-        function, and repeats process of xrefs to discovered xrefs.
+    def build_flowgraph_to_function(self, function, flowgraph, max_depth=None,
+        max_nodes=None, debug=False):
+        '''Builds a graph of xrefs to specified function, and repeats process
+        of xrefs to discovered xrefs. Breadth first, every function is
+        expanded at most once.
+
+        Arguments:
+            max_depth:  Stop expanding callers this many calls away from
+                        function. None for no limit.
+            max_nodes:  Stop queueing new functions once this many have been
+                        visited. None for no limit.
 
         Returns:
-            None. Updates parameter dictionary flowgraph.
-                Dictionary of all xrefs to function.
-                Dictionary can be used for drawing graphviz.
+            None. Updates parameter CallGraph flowgraph.
+                Graph of all xrefs to function.
+                Nodes left unexpanded because of the budget, or because
+                the task was cancelled (self.partial is set), are flagged
+                TRUNCATED.
         '''
-        # Use this as a counter to prevent infinite loop.
-        # TODO: Work towards removing hard_break.
-        hard_break = 1000
+        visited = set([function.start])
+        worklist = deque([(function, 0)])
+
+        while worklist:
+            current, depth = worklist.popleft()
+
+            if self.cancelled:
+                # Keep what was found, everything still queued is unexpanded.
+                self.partial = True
+                for current, _ in [(current, depth)] + list(worklist):
+                    node = self.__add_function(flowgraph, current)
+                    flowgraph.set_flag(node, TRUNCATED)
+                break
 
-        xrefs = self.get_xrefs_to_function(function,flowgraph)
+            self.stats.set('queued', len(worklist))
 
-        while xrefs:
-            # Loops until xrefs list becomes empty or hard_break runs down.
-            if hard_break < 1:
-                break
-            hard_break = hard_break - 1
+            if max_depth is not None and depth >= max_depth:
+                node = self.__add_function(flowgraph, current)
+                flowgraph.set_flag(node, TRUNCATED)
+                continue
 
-            debug and print('xrefs len {}'.format(len(xrefs)))
-            new_xrefs = self.get_xrefs_to_function(xrefs.pop().function,flowgraph)
+            xrefs = self.get_xrefs_to_function(current, flowgraph)
+            debug and print('xrefs len {}'.format(len(xrefs or [])))
 
-            if new_xrefs:
-                xrefs = new_xrefs + xrefs
+            for xref in xrefs or []:
+                caller = xref.function
 
+                if caller.start in visited:
+                    continue
 
-    def build_flowgraph_from_function(self, function, flowgraph, debug=False):
-        '''Iterate over every instuction address and check if address xrefs to
-        other function.
+                if max_nodes is not None and len(visited) >= max_nodes:
+                    node = self.__add_function(flowgraph, caller)
+                    flowgraph.set_flag(node, TRUNCATED)
+                    continue
+
+                visited.add(caller.start)
+                worklist.append((caller, depth + 1))
+
+        flowgraph.freeze()
+
+
+    def get_xrefs_from_function(self, function, flowgraph, resolved=None,
+        debug=False):
+        '''Find every xref from function to other functions. Not recursive.
 
             e.g. 0x1000000 call hi_func -> xref from current function to hi_func
 
+        Xrefs are read per basic block from analysis data (see callees.py),
+        then every distinct target is resolved to its function once.
+
         Arguments:
+            resolved:   Optional dictionary caching xref address -> containing
+                        function (or None). Share it between calls so a
+                        target is only resolved once.
 
         Returns:
-            xref_list. List of xrefs from function to code block.
-            flowgraph. Updates by reference. Dictionary.
-                e.g. {'main':'printf':[10001,10004]}
+            List of xref addresses and list of called functions, in order of
+            discovery.
+            Updates flowgraph CallGraph with an edge from function to every
+            function it references.
         '''
         xref_list = []
+        callees = []
+        called = set()
+        seen = set()
 
-        pretty_name_function = self.__get_demangled(name=function.symbol.name)
-        debug and print(pretty_name_function)
+        if resolved is None:
+            resolved = {}
 
-        if pretty_name_function not in flowgraph.keys():
-            # Add function name to graph if not already stored
-            flowgraph[pretty_name_function] = {}
+        caller = self.__add_function(flowgraph, function)
+        debug and print(flowgraph.labels[caller])
+        flowgraph.set_flag(caller, EXPANDED)
 
-        # Extract all code blocks from function block.
-        basic_blocks = sorted(function.basic_blocks, key=lambda bb: bb.start)
+        refs = code_refs_from_function(self.bv, function)
+        debug and print('xrefs {}'.format(len(refs)))
+        self.stats.count('xrefs', len(refs))
 
+        # Attempt to convert addresses to symbols, once per target
+        for xref in set(target for _, target in refs):
+            if xref not in resolved:
+                resolved[xref] = self.function_index.function_containing(xref)
 
-        for basic_block in basic_blocks:
-            for inst in basic_block.get_disassembly_text():
-                if str(inst.tokens[0]) == function.name: continue
+        for address, xref in refs:
+            debug and print('xref\tfrom:{}\tto:{}'.format(hex(address), hex(xref)))
 
-                xrefs = self.bv.get_code_refs_from(inst.address)
-                debug and print('xref {}'.format(xrefs))
-
-                #if xref:
-                for xref in xrefs:
-                    debug and print('xref\tfrom:{}\tto:{}'.format(hex(inst.address), hex(xref)))
-                    xref_address = xref
+            xref_function = resolved[xref]
+            if xref_function is None:
+                continue
 
-                    # Attempt to convert address to symbol
-                    xref_symbols = self.bv.get_functions_containing(xref)
-                    debug and print('xref symbols {}'.format(xref_symbols))
-                    if not xref_symbols:
-                        continue
+            callee = self.__add_function(flowgraph, xref_function)
 
-                    xref_symb = xref_symbols[0].symbol
+            if (callee, address) not in seen:
+                # Add newly discovered xref address to xref function.
+                # Function can have multiple xrefs to it from the same xref function block.
+                if callee not in called:
+                    called.add(callee)
+                    callees.append(xref_function)
+                seen.add((callee, address))
+                flowgraph.add_edge(caller, callee, address)
+                xref_list.append(xref)
 
-                    pretty_name_xref = self.__get_demangled(name=xref_symb.name)
-                    debug and print('xref symbol {}'.format(xref_symb))
-                    debug and print('xref symbol {}'.format(pretty_name_xref))
+        return xref_list, callees
 
 
-                    if pretty_name_xref not in flowgraph[pretty_name_function].keys():
-                        # Add xref function name to base function
-                        flowgraph[pretty_name_function][pretty_name_xref] = []
+    def build_flowgraph_from_function(self, function, flowgraph, max_depth=1,
+        max_nodes=None, debug=False):
+        '''Builds a graph of the functions called by function, and repeats
+        the process for the discovered callees up to max_depth calls away.
+        Breadth first, every function body is scanned at most once.
 
-                    if inst.address not in flowgraph[pretty_name_function][pretty_name_xref]:
-                        # Add newly discovered xref address to xref function.
-                        # Function can have multiple xrefs to it from the same xref function block.
-                        flowgraph[pretty_name_function][pretty_name_xref].append(inst.address)
-                        xref_list.append(xref)
+        Arguments:
+            max_depth:  Number of call levels to follow. 1 only collects
+                        direct callees. None for no limit.
+            max_nodes:  Stop queueing new functions once this many have been
+                        visited. None for no limit.
 
+        Returns:
+            xref_list. List of xrefs from functions to code blocks.
+            flowgraph. Updates by reference. CallGraph with an edge from
+                every scanned function to every function it references.
+                Nodes left unexpanded because of the budget, or because
+                the task was cancelled (self.partial is set), are flagged
+                TRUNCATED.
+        '''
+        xref_list = []
+        # Shared by every level so each target is resolved once.
+        resolved = {}
+        visited = set([function.start])
+        worklist = deque([(function, 0)])
+
+        while worklist:
+            current, depth = worklist.popleft()
+
+            if self.cancelled:
+                # Keep what was found, everything still queued is unexpanded.
+                self.partial = True
+                for current, _ in [(current, depth)] + list(worklist):
+                    node = self.__add_function(flowgraph, current)
+                    flowgraph.set_flag(node, TRUNCATED)
+                break
 
-        return xref_list if xref_list else None
+            self.stats.set('queued', len(worklist))
 
+            if max_depth is not None and depth >= max_depth:
+                if max_depth > 1:
+                    # A single level graph never expands callees, only
+                    # flag the frontier of transitive graphs.
+                    node = self.__add_function(flowgraph, current)
+                    flowgraph.set_flag(node, TRUNCATED)
+                continue
 
-    def build_flowgraph_to_function_recursive(self, function, flowgraph):
-        # This function isn't reliable because of python's lmiitation with
-        # recursion. System resources will be exhausted.
-        pretty_name = self.__get_demangled(function.symbol.name)
+            xrefs, callees = self.get_xrefs_from_function(current, flowgraph,
+                resolved=resolved, debug=debug)
+            xref_list.extend(xrefs)
 
-        if pretty_name not in flowgraph.keys():
-            flowgraph[pretty_name] = {}
+            for callee in callees:
+                if callee.start in visited:
+                    continue
 
-        for xref in self.bv.get_code_refs(function.symbol.address):
-            pretty_name_xref = self.__get_demangled(xref.function.symbol.name)
+                if max_nodes is not None and len(visited) >= max_nodes:
+                    node = self.__add_function(flowgraph, callee)
+                    flowgraph.set_flag(node, TRUNCATED)
+                    continue
 
-            if pretty_name_xref not in flowgraph[pretty_name].keys():
-                flowgraph[pretty_name][pretty_name_xref] = []
+                visited.add(callee.start)
+                worklist.append((callee, depth + 1))
 
-            if xref.address not in flowgraph[pretty_name][pretty_name_xref]:
-                flowgraph[pretty_name][pretty_name_xref].append(xref.address)
+        flowgraph.freeze()
 
-            self.build_flowgraph_to_function_recursive(xref.function, flowgraph)
+        return xref_list if xref_list else None
 
 
     def run(self):
-        if self.function and self.method == 'from_function':
-            self.view_flowgraph_from_function()
-        elif self.function == None:
-            self.view_flowgraph_to_bin()
-        else:
-            self.view_flowgraph_to_function()
+        demangled = self.demangler.stats()
+
+        try:
+            with profiled(self.profile):
+                if self.method == 'diff':
+                    self.view_flowgraph_diff()
+                elif self.function and self.method == 'from_function':
+                    self.view_flowgraph_from_function()
+                elif self.function and self.method == 'explore':
+                    self.view_flowgraph_explore()
+                elif self.function and self.method == 'path':
+                    self.view_flowgraph_path()
+                elif self.function == None:
+                    self.view_flowgraph_to_bin()
+                else:
+                    self.view_flowgraph_to_function()
+        finally:
+            after = self.demangler.stats()
+            self.stats.set('demangle calls', after['hits'] + after['misses']
+                - demangled['hits'] - demangled['misses'])
+            self.stats.set('demangle cache misses', after['misses'] - demangled['misses'])
+            self.stats.report()
@@ -0,0 +1,227 @@
+'''Address to function index for a BinaryView.
+
+Function address ranges are kept in sorted start/end arrays and queried with
+bisect. Resolved addresses are cached, as call targets repeat a lot. The
+index is built once per view and patched when analysis adds, removes or
+updates functions. Changes are also counted, so other caches can ask which
+functions changed since they were last checked, see changed_since.
+'''
+from binaryninja import *
+from array import array
+from bisect import bisect_left, bisect_right
+import threading
+
+from .session import get_session_object
+
+
+# Refresh by rebuilding when more functions than this changed.
+REBUILD_THRESHOLD = 1024
+# Upper bound on cached lookups.
+HOT_CACHE_SIZE = 1 << 16
+# Ranges checked per lookup before deferring to analysis.
+MAX_WALK = 8
+
+
+def get_function_index(bv):
+    '''Returns the FunctionIndex shared by every run on bv.'''
+    return get_session_object(bv, 'binoculars.function_index', FunctionIndex)
+
+
+def function_ranges(function):
+    '''Returns the (start, end) address ranges covered by function.'''
+    ranges = getattr(function, 'address_ranges', None)
+    if ranges is not None:
+        return [(r.start, r.end) for r in ranges]
+
+    return [(bb.start, bb.end) for bb in function.basic_blocks]
+
+
+class FunctionIndexNotification(BinaryDataNotification):
+    '''Marks functions changed by analysis as stale in the index.'''
+
+    def __init__(self, index):
+        BinaryDataNotification.__init__(self)
+        self.index = index
+
+    def function_added(self, view, func):
+        self.index.invalidate(func.start)
+
+    def function_removed(self, view, func):
+        self.index.invalidate(func.start)
+
+    def function_updated(self, view, func):
+        self.index.invalidate(func.start)
+
+
+class FunctionIndex(object):
+
+    def __init__(self, bv):
+        self.bv = bv
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._built = False
+        self._dirty = set()
+        self._hot = {}
+        self.changes = 0
+        self._changed = {}          # Function start -> changes when last changed
+
+        self._functions = {}        # Function start -> Function
+        self._ranges = {}           # Function start -> [(start, end), ...]
+        self._starts = array('Q')   # Range starts, sorted
+        self._ends = array('Q')     # Range ends
+        self._owners = array('Q')   # Function start owning each range
+        self._reach = array('Q')    # Largest range end up to each index
+
+        self.notification = FunctionIndexNotification(self)
+        bv.register_notification(self.notification)
+
+    def invalidate(self, start):
+        '''Marks the function at start as changed. The index is patched on
+        the next lookup.
+        '''
+        with self._lock:
+            self._dirty.add(start)
+            self.changes += 1
+            self._changed[start] = self.changes
+
+    def changed_since(self, changes):
+        '''Returns the starts of the functions changed after change count
+        changes, and the current change count.
+        '''
+        with self._lock:
+            return (set(start for start, count in self._changed.items() if count > changes),
+                self.changes)
+
+    def function_containing(self, address):
+        '''Equivalent of bv.get_functions_containing(address)[0].
+
+        Returns:
+            Function or None.
+        '''
+        with self._lock:
+            self.__refresh()
+
+            if address in self._hot:
+                self.hits += 1
+                return self._hot[address]
+            self.misses += 1
+
+            owners = self.__owners(address)
+
+            if owners is None or len(owners) > 1:
+                # Overlapping functions, let analysis decide.
+                functions = self.bv.get_functions_containing(address)
+                function = functions[0] if functions else None
+            elif owners:
+                function = self._functions.get(owners[0])
+            else:
+                function = None
+
+            if len(self._hot) >= HOT_CACHE_SIZE:
+                self._hot.clear()
+            self._hot[address] = function
+
+            return function
+
+    def __owners(self, address):
+        '''Starts of the functions with a range containing address, or None
+        if that couldn't be settled within MAX_WALK ranges.
+        '''
+        owners = []
+        index = bisect_right(self._starts, address) - 1
+        stop = index - MAX_WALK
+
+        # Ranges are sorted by start; walk back while an earlier range can
+        # still reach address.
+        while index >= 0 and self._reach[index] > address:
+            if index == stop:
+                return None
+            if self._ends[index] > address and self._owners[index] not in owners:
+                owners.append(self._owners[index])
+            index -= 1
+
+        return owners
+
+    def __refresh(self):
+        if not self._built or len(self._dirty) > REBUILD_THRESHOLD:
+            self.__build()
+            return
+
+        if not self._dirty:
+            return
+
+        lowest = len(self._starts)
+        for start in self._dirty:
+            lowest = min(lowest, self.__remove(start))
+
+            function = self.bv.get_function_at(start)
+            if function is not None:
+                lowest = min(lowest, self.__insert(function))
+
+        self._dirty.clear()
+        self._hot.clear()
+        self.__update_reach(lowest)
+
+    def __build(self):
+        ranges = []
+        self._functions = {}
+        self._ranges = {}
+
+        for function in self.bv.functions:
+            self._functions[function.start] = function
+            self._ranges[function.start] = function_ranges(function)
+            for start, end in self._ranges[function.start]:
+                ranges.append((start, end, function.start))
+
+        ranges.sort()
+        self._starts = array('Q', (r[0] for r in ranges))
+        self._ends = array('Q', (r[1] for r in ranges))
+        self._owners = array('Q', (r[2] for r in ranges))
+        self._reach = array('Q', [0]) * len(ranges)
+
+        self._dirty.clear()
+        self._hot.clear()
+        self._built = True
+        self.__update_reach(0)
+
+    def __remove(self, function_start):
+        '''Drops the ranges of a function. Returns the lowest index touched.'''
+        lowest = len(self._starts)
+        self._functions.pop(function_start, None)
+
+        for start, end in self._ranges.pop(function_start, []):
+            index = bisect_left(self._starts, start)
+            while index < len(self._starts) and self._starts[index] == start:
+                if self._owners[index] == function_start and self._ends[index] == end:
+                    del self._starts[index]
+                    del self._ends[index]
+                    del self._owners[index]
+                    del self._reach[index]
+                    lowest = min(lowest, index)
+                    break
+                index += 1
+
+        return lowest
+
+    def __insert(self, function):
+        '''Adds the ranges of a function. Returns the lowest index touched.'''
+        lowest = len(self._starts)
+        self._functions[function.start] = function
+        self._ranges[function.start] = function_ranges(function)
+
+        for start, end in self._ranges[function.start]:
+            index = bisect_right(self._starts, start)
+            self._starts.insert(index, start)
+            self._ends.insert(index, end)
+            self._owners.insert(index, function.start)
+            self._reach.insert(index, 0)
+            lowest = min(lowest, index)
+
+        return lowest
+
+    def __update_reach(self, index):
+        reach = self._reach[index - 1] if index > 0 else 0
+        for i in range(index, len(self._starts)):
+            reach = max(reach, self._ends[i])
+            self._reach[i] = reach
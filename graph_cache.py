@@ -0,0 +1,245 @@
+'''On disk cache of the whole binary xref table.
+
+A cache file is keyed by the SHA-256 of the raw file and the architecture,
+hashed once per session. It stores the start, shape and fingerprint of every
+function, plus the (callee, caller, address) xref triples collected by
+BinocularsFlowgraph.collect_xrefs_to_bin. The generation marker in the
+header is a digest of all of them, checked when the file is read.
+
+The shape, a digest of the address ranges, is cheap to compute. The
+fingerprint also covers the calls and costs a query per call site, so it is
+only computed for functions that may have changed:
+    -   When the file is loaded, functions whose shape differs.
+    -   Afterwards, functions changed since the table was last checked,
+        as recorded by the FunctionIndex notification.
+A table that is up to date with analysis stays in memory, so a cache hit in
+the same session doesn't read the file.
+
+Layout, all integers little endian:
+    8 bytes     MAGIC
+    4 bytes     header length
+    n bytes     JSON header, padded with spaces to a multiple of 8
+    u64 arrays  starts, shapes, fingerprints, callees, callers, addresses
+Each array is 8 byte aligned, so the file can also be memory-mapped.
+'''
+from array import array
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+from .function_index import function_ranges
+from .session import get_session_object
+
+
+CALLGRAPH_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.binoculars', 'callgraph')
+CACHE_VERSION = 2
+MAGIC = b'BINOCG01'
+
+
+def get_graph_cache(bv):
+    '''Returns the GraphCache shared by every run on bv.'''
+    return get_session_object(bv, 'binoculars.graph_cache', GraphCache)
+
+
+def function_shape(function):
+    '''64 bit digest of the address ranges of function.'''
+    digest = hashlib.blake2b(digest_size=8)
+    for start, end in function_ranges(function):
+        digest.update(struct.pack('<QQ', start, end))
+    return struct.unpack('<Q', digest.digest())[0]
+
+
+def function_fingerprint(function):
+    '''64 bit digest of the address ranges, call sites and called addresses
+    of function. Changes whenever analysis grows, shrinks or moves the
+    function, and when a call target changes in place, e.g. a patched call
+    operand or a user set indirect call target.
+    '''
+    digest = hashlib.blake2b(digest_size=8)
+    ranges = function_ranges(function)
+    sites = sorted(set(ref.address for ref in function.call_sites))
+
+    callees = getattr(function, 'callee_addresses', None)
+    if callees is None:
+        view = getattr(function, 'view', None)
+        callees = [target for site in sites for target in view.get_code_refs_from(site)] \
+            if view is not None else []
+    callees = sorted(set(callees))
+
+    for values in (ranges, sites, callees):
+        digest.update(struct.pack('<Q', len(values)))
+    for start, end in ranges:
+        digest.update(struct.pack('<QQ', start, end))
+    for address in sites + callees:
+        digest.update(struct.pack('<Q', address))
+    return struct.unpack('<Q', digest.digest())[0]
+
+
+def generation_marker(*arrays):
+    digest = hashlib.sha256()
+    for values in arrays:
+        digest.update(_to_bytes(values))
+    return digest.hexdigest()
+
+
+def _to_bytes(values):
+    if sys.byteorder != 'little':
+        values = array('Q', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(data):
+    values = array('Q')
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values
+
+
+class XrefTable(object):
+    '''Collected xrefs of a whole binary together with the function
+    shapes and fingerprints they were collected from.
+    '''
+
+    def __init__(self, starts=None, shapes=None, fingerprints=None, callees=None,
+        callers=None, addresses=None):
+        self.starts = starts if starts is not None else array('Q')
+        self.shapes = shapes if shapes is not None else array('Q')
+        self.fingerprints = fingerprints if fingerprints is not None else array('Q')
+        self.callees = callees if callees is not None else array('Q')
+        self.callers = callers if callers is not None else array('Q')
+        self.addresses = addresses if addresses is not None else array('Q')
+
+    def generation(self):
+        return generation_marker(self.starts, self.shapes, self.fingerprints)
+
+
+class GraphCache(object):
+
+    def __init__(self, bv, directory=None):
+        self.bv = bv
+        self.directory = directory or CALLGRAPH_CACHE_PATH
+        self._lock = threading.Lock()
+        self._key = None
+        '''XrefTable up to date with analysis as of FunctionIndex change
+        count synced, or None.'''
+        self.table = None
+        self.synced = None
+
+    def remember(self, table, synced):
+        '''Keeps table as the one up to date with analysis as of the
+        FunctionIndex change count synced.
+        '''
+        with self._lock:
+            self.table = table
+            self.synced = synced
+
+    def remembered(self):
+        '''Returns the table and change count given to remember().'''
+        with self._lock:
+            return self.table, self.synced
+
+    def key(self):
+        '''Returns (sha256 of the raw file, architecture name), computed
+        once per session. Patches made since show up as changed functions.
+        '''
+        with self._lock:
+            if self._key is None:
+                raw = self.bv.file.raw
+                digest = hashlib.sha256()
+                offset = 0
+                length = len(raw)
+
+                while offset < length:
+                    data = raw.read(offset, min(1 << 20, length - offset))
+                    if not data:
+                        break
+                    digest.update(data)
+                    offset += len(data)
+
+                arch = self.bv.arch.name if self.bv.arch else 'none'
+                self._key = (digest.hexdigest(), arch)
+
+            return self._key
+
+    def path(self):
+        sha256, arch = self.key()
+        return os.path.join(self.directory, '{}-{}.bcg'.format(sha256[:32], arch))
+
+    def load(self):
+        '''Returns the cached XrefTable, or None if there is no usable
+        cache file.
+        '''
+        sha256, arch = self.key()
+
+        try:
+            with open(self.path(), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        try:
+            if data[:8] != MAGIC:
+                return None
+
+            header_length = struct.unpack('<I', data[8:12])[0]
+            header = json.loads(data[12:12 + header_length].decode('utf-8'))
+
+            if header['version'] != CACHE_VERSION or header['sha256'] != sha256 \
+                    or header['arch'] != arch:
+                return None
+
+            offset = 12 + header_length
+            sections = []
+            for count in (header['functions'], header['functions'], header['functions'],
+                header['xrefs'], header['xrefs'], header['xrefs']):
+                sections.append(_from_bytes(data[offset:offset + 8 * count]))
+                offset += 8 * count
+
+            table = XrefTable(*sections)
+            if table.generation() != header['generation']:
+                return None
+
+            return table
+
+        except (ValueError, KeyError, struct.error):
+            return None
+
+    def save(self, table):
+        '''Writes table atomically, so readers never see a partial file.'''
+        sha256, arch = self.key()
+        header = json.dumps({
+            'version': CACHE_VERSION,
+            'sha256': sha256,
+            'arch': arch,
+            'generation': table.generation(),
+            'functions': len(table.starts),
+            'xrefs': len(table.callees),
+        }).encode('utf-8')
+
+        # Pad so the arrays start on an 8 byte boundary.
+        header += b' ' * (-(12 + len(header)) % 8)
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack('<I', len(header)))
+                f.write(header)
+                for values in (table.starts, table.shapes, table.fingerprints,
+                    table.callees, table.callers, table.addresses):
+                    f.write(_to_bytes(values))
+
+            os.replace(tmp_path, self.path())
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
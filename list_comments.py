@@ -1,4 +1,12 @@
 from binaryninja import *
+import io
+
+from .comment_index import SEARCH_MODES, get_comment_index
+from .stats import RunStats, profiled
+
+
+# Comments shown per report page.
+COMMENTS_PAGE_SIZE = 1000
 
 
 class BinocularsListComments(BackgroundTaskThread):
@@ -7,20 +15,88 @@ class BinocularsListComments(BackgroundTaskThread):
         BackgroundTaskThread.__init__(self, '', True)
         self.progress = "Binoculars Collecting User Comments..."
         self.bv = bv
+        '''Phase timings and counters, see stats.py.'''
+        self.stats = RunStats(self, 'Binoculars List Comments')
+        self.profile = kwargs.get('profile')
+        '''Prompt for a search query, see comment_index.py for the modes.'''
+        self.search = kwargs.get('search', False)
+        self.query = kwargs.get('query')
+        self.mode = kwargs.get('mode', 'keyword')
+        self.page_size = kwargs.get('page_size') or COMMENTS_PAGE_SIZE
 
     def do_formatting(self, comment):
         return comment.replace("\n", "\\n")
 
+    def find_comments(self, query=None, mode='keyword'):
+        '''Returns the (address, owner) keys of the comments matching query,
+        sorted by address, see CommentIndex.search.
+        '''
+        index = get_comment_index(self.bv)
+        with self.stats.phase('index'):
+            index.refresh(cancelled=lambda: self.cancelled)
+        if self.cancelled:
+            return []
+
+        with self.stats.phase('search'):
+            keys = index.search(query, mode)
+        self.stats.set('comments', len(index.keys))
+        self.stats.set('matches', len(keys))
+        return keys
+
+    def write_comments(self, f, keys):
+        comments = get_comment_index(self.bv).comments
+        for key in keys:
+            f.write(("  0x%x  " %(key[0])).center(80, '=') + "\n")
+            f.write(comments[key] + "\n\n")
+
+    def multi_line_text(self, query=None, mode='keyword'):
+        content = io.StringIO()
+        self.write_comments(content, self.find_comments(query, mode))
+        return content.getvalue()
+
     def multi_line(self):
-        content = ""
-        for function in self.bv.functions:
-            if isinstance(function.comments, dict):
-                for address, comment in function.comments.items():
-                    content += ("  0x%x  " %(int(address))).center(80, '=') + "\n"
-                    content += comment + "\n\n"
+        query, mode = self.query, self.mode
+
+        if self.search:
+            query = get_text_line_input("Search comments, empty for all", "Binoculars Comments")
+            if query is None:
+                return
+            if isinstance(query, bytes):
+                query = query.decode('utf-8')
+            choice = get_choice_input("Search mode", "choices", list(SEARCH_MODES))
+            if choice is None:
+                return
+            mode = SEARCH_MODES[choice]
+
+        try:
+            keys = self.find_comments(query, mode)
+        except ValueError as e:
+            show_message_box('Binoculars Comments', str(e))
+            return
+        if self.cancelled:
+            return
+
+        pages = max(1, (len(keys) + self.page_size - 1) // self.page_size)
+        page = 1
+        if pages > 1:
+            page = get_int_input("Page, 1 to {} ({} comments)".format(pages, len(keys)),
+                "Binoculars Comments")
+            if page is None:
+                return
+            page = min(max(page, 1), pages)
 
-        show_plain_text_report("Binoculars List Comments", content)
+        with self.stats.phase('report'):
+            content = io.StringIO()
+            if pages > 1:
+                content.write("Page {} of {}, {} comments\n\n".format(page, pages, len(keys)))
+            self.write_comments(content,
+                keys[(page - 1) * self.page_size:page * self.page_size])
+            show_plain_text_report("Binoculars List Comments", content.getvalue())
 
 
     def run(self):
-        self.multi_line()
+        try:
+            with profiled(self.profile):
+                self.multi_line()
+        finally:
+            self.stats.report()
@@ -0,0 +1,161 @@
+'''Whole binary call graph kept up to date with analysis.
+
+The graph is built once by BinocularsFlowgraph.build_flowgraph_to_bin. From
+then on a BinaryDataNotification records which functions were defined,
+undefined, updated or renamed, and the next refresh() patches only their
+nodes and edges. Notifications just record addresses, all work happens in
+refresh(). Runs refreshing the graph concurrently take turns, one builds or
+patches it while the others wait.
+'''
+from binaryninja import *
+import threading
+
+from .callees import code_refs_from_function
+from .callgraph import REMOVED
+from .session import get_session_object
+
+
+def get_live_graph(bv, demangle):
+    '''Returns the LiveCallGraph of bv for the demangle mode.'''
+    return get_session_object(bv, 'binoculars.live_graph.{}'.format(demangle),
+        lambda bv: LiveCallGraph(bv, demangle))
+
+
+class LiveGraphNotification(BinaryDataNotification):
+    '''Records the start of every function touched by analysis or the user.'''
+
+    def __init__(self, live):
+        BinaryDataNotification.__init__(self)
+        self.live = live
+
+    def function_added(self, view, func):
+        self.live.invalidate(func.start)
+
+    def function_removed(self, view, func):
+        self.live.invalidate(func.start)
+
+    def function_updated(self, view, func):
+        self.live.invalidate(func.start)
+
+    def symbol_added(self, view, sym):
+        self.live.invalidate_symbol(sym.address)
+
+    def symbol_updated(self, view, sym):
+        self.live.invalidate_symbol(sym.address)
+
+    def symbol_removed(self, view, sym):
+        self.live.invalidate_symbol(sym.address)
+
+
+class LiveCallGraph(object):
+
+    def __init__(self, bv, demangle):
+        self.bv = bv
+        self.demangle = demangle
+        self.graph = None
+        self._lock = threading.Lock()
+        # Held for a whole refresh, apart from _lock so notifications
+        # don't wait for a build.
+        self._refresh_lock = threading.Lock()
+        self._dirty = set()
+        self._renamed = set()
+        self.notification = None
+
+    def invalidate(self, start):
+        with self._lock:
+            self._dirty.add(start)
+
+    def invalidate_symbol(self, address):
+        with self._lock:
+            self._renamed.add(address)
+
+    def refresh(self, flowgraph):
+        '''Returns the up to date CallGraph, building it with flowgraph (a
+        BinocularsFlowgraph) on first use.
+        '''
+        with self._refresh_lock:
+            return self.__refresh(flowgraph)
+
+    def __refresh(self, flowgraph):
+        if self.graph is None:
+            # Listen first so nothing changed during the build is missed.
+            self.notification = LiveGraphNotification(self)
+            self.bv.register_notification(self.notification)
+            graph = flowgraph.build_flowgraph_to_bin()
+            if flowgraph.partial:
+                # Cancelled, build again next time.
+                self.close()
+                return graph
+            self.graph = graph
+            return self.graph
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            renamed, self._renamed = self._renamed, set()
+
+        if dirty or renamed:
+            self.__patch(flowgraph, dirty, renamed - dirty)
+
+        return self.graph
+
+    def close(self):
+        if self.notification is not None:
+            self.bv.unregister_notification(self.notification)
+            self.notification = None
+
+    def __label(self, flowgraph, name):
+        return flowgraph.demangler.demangle(self.demangle, name)
+
+    def __patch(self, flowgraph, dirty, renamed):
+        graph = self.graph
+        functions = {}
+        added = []
+
+        # Nodes: define, undefine and rename.
+        for start in sorted(dirty | renamed):
+            function = self.bv.get_function_at(start)
+            node = graph.node_id(start)
+
+            if function is None:
+                if node is not None and not graph.has_flag(node, REMOVED):
+                    graph.remove_node(node)
+                continue
+
+            name = function.symbol.name
+            defined = False
+
+            if node is None:
+                node = graph.add_node(start, name, self.__label(flowgraph, name))
+                defined = True
+            elif graph.has_flag(node, REMOVED):
+                graph.clear_flag(node, REMOVED)
+                graph.relabel(node, name, self.__label(flowgraph, name))
+                defined = True
+            elif graph.names[node] != name:
+                graph.relabel(node, name, self.__label(flowgraph, name))
+
+            if defined:
+                added.append(function)
+            if defined or start in dirty:
+                functions[start] = function
+
+        # Edges made by new and updated functions.
+        for start in sorted(functions):
+            calls = []
+            for address, target in code_refs_from_function(self.bv, functions[start]):
+                callee = graph.node_id(target)
+                if callee is not None and not graph.has_flag(callee, REMOVED):
+                    calls.append((callee, address))
+            graph.replace_calls(graph.node_id(start), calls)
+
+        # Edges from unchanged code to new functions.
+        for function in added:
+            callee = graph.node_id(function.start)
+            for xref in self.bv.get_code_refs(function.symbol.address):
+                if xref.function is None or xref.function.start in functions:
+                    continue
+                caller = graph.node_id(xref.function.start)
+                if caller is not None and not graph.has_flag(caller, REMOVED):
+                    graph.add_edge(caller, callee, xref.address)
+
+        graph.freeze()
@@ -0,0 +1,243 @@
+'''Reachability and shortest call path queries over a whole binary graph.
+
+The call graph is condensed into its strongly connected components, which
+form a DAG numbered callees first, so a caller can only reach components
+with a smaller number. Every component gets GRAIL_LABELS interval labels
+from randomised depth first traversals of the DAG: if the interval of b
+isn't nested in the interval of a, for any of the labels, a can't reach b.
+Most negative queries are answered by these checks alone. The rest run a
+depth first search pruned by the same checks.
+
+paths() enumerates the k shortest loopless call paths with Yen's algorithm,
+using breadth first search restricted to functions that can still reach
+the target.
+'''
+from array import array
+from collections import deque
+import heapq
+import random
+
+from .callgraph import CallGraph, LIBRARY, strongly_connected_components
+from .session import get_session_object
+
+
+# Interval labels per component. More labels prune more searches.
+GRAIL_LABELS = 3
+# Paths returned by default.
+DEFAULT_PATHS = 5
+
+
+def get_reachability_index(bv, graph):
+    '''Returns the ReachabilityIndex of graph, reused while graph (e.g. the
+    live graph of bv) doesn't change.
+    '''
+    indexes = get_session_object(bv, 'binoculars.reachability', lambda bv: {})
+    index = indexes.get(id(graph))
+    if index is None or index.graph is not graph or index.generation != graph.freeze().generation:
+        index = ReachabilityIndex(graph)
+        indexes[id(graph)] = index
+    return index
+
+
+class ReachabilityIndex(object):
+
+    def __init__(self, graph, labels=GRAIL_LABELS, seed=0):
+        graph.freeze()
+        self.graph = graph
+        self.generation = graph.generation
+        self.component, self.count = strongly_connected_components(graph)
+        self._callees = {}
+
+        # Condensed DAG in CSR form.
+        successors = [set() for _ in range(self.count)]
+        for caller, callee, _ in graph.edges():
+            a, b = self.component[caller], self.component[callee]
+            if a != b:
+                successors[a].add(b)
+
+        self.offsets = array('Q', [0])
+        self.targets = array('I')
+        for callees in successors:
+            self.targets.extend(sorted(callees))
+            self.offsets.append(len(self.targets))
+
+        rng = random.Random(seed)
+        self.labels = [self.__label(rng) for _ in range(labels)]
+
+    def __label(self, rng):
+        '''One randomised post order labelling: (low, post) per component.'''
+        count = self.count
+        offsets, targets = self.offsets, self.targets
+        post = array('I', [0]) * count
+        low = array('I', [0]) * count
+        visited = bytearray(count)
+        rank = 0
+
+        roots = list(range(count))
+        rng.shuffle(roots)
+
+        for root in roots:
+            if visited[root]:
+                continue
+            visited[root] = 1
+            work = [(root, self.__children(root, rng))]
+
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if not visited[child]:
+                        visited[child] = 1
+                        work.append((child, self.__children(child, rng)))
+                        break
+                else:
+                    work.pop()
+                    rank += 1
+                    post[node] = rank
+                    lowest = rank
+                    for index in range(offsets[node], offsets[node + 1]):
+                        lowest = min(lowest, low[targets[index]])
+                    low[node] = lowest
+
+        return low, post
+
+    def __children(self, node, rng):
+        lo, hi = self.offsets[node], self.offsets[node + 1]
+        if hi - lo < 2:
+            return iter(self.targets[lo:hi])
+        # Rotating the children is enough to vary the traversals.
+        start = rng.randrange(lo, hi)
+        return iter(self.targets[start:hi] + self.targets[lo:start])
+
+    def __may_reach(self, a, b):
+        for low, post in self.labels:
+            if low[b] < low[a] or post[b] > post[a]:
+                return False
+        return True
+
+    def __component_reaches(self, a, b):
+        if a == b:
+            return True
+        if a < b or not self.__may_reach(a, b):
+            return False
+
+        offsets, targets = self.offsets, self.targets
+        seen = set([a])
+        stack = [a]
+        while stack:
+            node = stack.pop()
+            for index in range(offsets[node], offsets[node + 1]):
+                child = targets[index]
+                if child == b:
+                    return True
+                if child in seen or child < b or not self.__may_reach(child, b):
+                    continue
+                seen.add(child)
+                stack.append(child)
+        return False
+
+    def reaches(self, source, target):
+        '''True if node source calls node target, directly or not. A node
+        reaches itself.
+        '''
+        a, b = self.component[source], self.component[target]
+        if a < 0 or b < 0:
+            return False
+        return self.__component_reaches(a, b)
+
+    def callees(self, node):
+        '''Sorted distinct callees of node.'''
+        callees = self._callees.get(node)
+        if callees is None:
+            callees = sorted(set(callee for callee, _ in self.graph.successors(node)))
+            self._callees[node] = callees
+        return callees
+
+    def __shortest(self, source, target, useful, banned_nodes, banned_edges):
+        '''Breadth first shortest path avoiding banned nodes and edges.'''
+        parent = {source: None}
+        worklist = deque([source])
+
+        while worklist:
+            node = worklist.popleft()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parent[node]
+                return path[::-1]
+
+            for callee in self.callees(node):
+                if callee in parent or callee in banned_nodes \
+                        or (node, callee) in banned_edges or not useful(callee):
+                    continue
+                parent[callee] = node
+                worklist.append(callee)
+
+        return None
+
+    def paths(self, source, target, k=DEFAULT_PATHS):
+        '''Returns up to k shortest loopless call paths from node source to
+        node target, as lists of nodes, shortest first.
+        '''
+        if not self.reaches(source, target):
+            return []
+
+        memo = {}
+        def useful(node):
+            # Only functions that can still reach the target.
+            if node not in memo:
+                memo[node] = self.reaches(node, target)
+            return memo[node]
+
+        found = [self.__shortest(source, target, useful, set(), set())]
+        candidates = []
+        queued = set()
+
+        while len(found) < k:
+            previous = found[-1]
+            for index in range(len(previous) - 1):
+                spur = previous[index]
+                root = previous[:index + 1]
+
+                banned_edges = set((path[index], path[index + 1]) for path in found
+                    if len(path) > index + 1 and path[:index + 1] == root)
+                banned_nodes = set(root[:-1])
+
+                spur_path = self.__shortest(spur, target, useful, banned_nodes, banned_edges)
+                if spur_path is None:
+                    continue
+
+                path = tuple(root[:-1] + spur_path)
+                if path not in queued:
+                    queued.add(path)
+                    heapq.heappush(candidates, (len(path), path))
+
+            if not candidates:
+                break
+            found.append(list(heapq.heappop(candidates)[1]))
+
+        return found
+
+
+def path_subgraph(graph, paths):
+    '''Returns a CallGraph of the nodes and calls on paths, with every xref
+    address of those calls.
+    '''
+    subgraph = CallGraph()
+    mapping = {}
+    calls = set()
+
+    for path in paths:
+        for node in path:
+            if node not in mapping:
+                mapping[node] = subgraph.add_node(graph.starts[node], graph.names[node],
+                    graph.labels[node])
+                subgraph.flags[mapping[node]] = graph.flags[node] & LIBRARY
+        calls.update(zip(path, path[1:]))
+
+    for caller, callee in sorted(calls):
+        for target, address in graph.successors(caller):
+            if target == callee:
+                subgraph.add_edge(mapping[caller], mapping[callee], address)
+
+    return subgraph.freeze()
@@ -0,0 +1,294 @@
+'''Graph reduction applied before rendering large call graphs.
+
+Every step returns a new CallGraph and leaves its input untouched:
+    condense_cycles:    Each strongly connected component (recursion cycle)
+                        becomes one SUMMARY node.
+    collapse_leaves:    The callees of a caller that call nothing themselves,
+                        or are library or thunk functions, become one SUMMARY
+                        node per caller. Functions nobody calls and that call
+                        nothing are merged into one node.
+    keep_top_k:         Keeps the k nodes with the most callers plus callees.
+
+paginate splits a graph into pages that are laid out separately.
+'''
+from collections import deque
+
+from .callgraph import (CallGraph, EXTERNAL, LIBRARY, REMOVED, SUMMARY,
+    strongly_connected_components)
+
+
+# Graphs with more nodes than this are reduced before layout.
+REDUCE_MIN_NODES = 200
+# Largest graph handed to graphviz, after reduction.
+MAX_RENDER_NODES = 3000
+# A caller needs this many collapsible callees for them to be summarised.
+LEAF_GROUP_MIN = 2
+# Nodes per page of a paginated report.
+PAGE_NODES = 400
+
+
+def live_nodes(graph):
+    return [node for node in range(len(graph)) if not graph.flags[node] & REMOVED]
+
+
+def _copy_node(graph, node, reduced):
+    node_id = reduced.add_node(graph.starts[node] if not graph.flags[node] & SUMMARY else None,
+        graph.names[node], graph.labels[node])
+    reduced.flags[node_id] = graph.flags[node]
+    return node_id
+
+
+def condense_cycles(graph):
+    '''Collapses every recursion cycle into one SUMMARY node.'''
+    component, count = strongly_connected_components(graph)
+
+    members = [[] for _ in range(count)]
+    for node in live_nodes(graph):
+        members[component[node]].append(node)
+
+    reduced = CallGraph()
+    mapping = {}
+
+    for nodes in members:
+        if len(nodes) == 1:
+            mapping[nodes[0]] = _copy_node(graph, nodes[0], reduced)
+            continue
+
+        label = '{} +{} in cycle'.format(graph.labels[nodes[0]], len(nodes) - 1)
+        summary = reduced.add_node(None, label)
+        reduced.set_flag(summary, SUMMARY)
+        for node in nodes:
+            mapping[node] = summary
+
+    for caller, callee, addresses in graph.edges():
+        src, dst = mapping[caller], mapping[callee]
+        if src == dst and caller != callee:
+            # Call inside a cycle.
+            continue
+        for address in addresses:
+            reduced.add_edge(src, dst, address)
+
+    return reduced.freeze()
+
+
+def collapse_leaves(graph, minimum=LEAF_GROUP_MIN):
+    '''Summarises leaf and library callees per caller, and merges isolated
+    functions into one node.
+    '''
+    nodes = live_nodes(graph)
+    out_degree = [0] * len(graph)
+    in_degree = [0] * len(graph)
+
+    for caller, callee, _ in graph.edges():
+        if caller != callee:
+            out_degree[caller] += 1
+            in_degree[callee] += 1
+
+    def collapsible(node):
+        if graph.flags[node] & SUMMARY:
+            return False
+        return out_degree[node] == 0 or bool(graph.flags[node] & LIBRARY)
+
+    # Callers with enough collapsible callees get a summary node.
+    groups = {}
+    for caller, callee, _ in graph.edges():
+        if caller != callee and collapsible(callee):
+            groups.setdefault(caller, set()).add(callee)
+    groups = dict((caller, callees) for caller, callees in groups.items()
+        if len(callees) >= minimum)
+
+    # Nodes counted in a summary are dropped unless still reached through an
+    # edge that isn't summarised, from a node that is kept. Every other node
+    # is kept, e.g. a library function with callees but no callers.
+    covered = set()
+    for callees in groups.values():
+        covered.update(callees)
+    kept = set(node for node in nodes if node not in covered or node in groups)
+    worklist = list(kept)
+    while worklist:
+        caller = worklist.pop()
+        for callee, _ in graph.successors(caller):
+            if callee not in kept and callee not in groups.get(caller, ()):
+                kept.add(callee)
+                worklist.append(callee)
+
+    reduced = CallGraph()
+    mapping = {}
+    isolated = 0
+
+    for node in nodes:
+        if out_degree[node] == 0 and in_degree[node] == 0 \
+                and not graph.flags[node] & SUMMARY:
+            isolated += 1
+        elif node in kept:
+            mapping[node] = _copy_node(graph, node, reduced)
+
+    if isolated:
+        summary = reduced.add_node(None, '{} unreferenced functions'.format(isolated))
+        reduced.set_flag(summary, SUMMARY)
+
+    summaries = {}
+    for caller in sorted(groups):
+        label = '{} leaf callees of {}'.format(len(groups[caller]), graph.labels[caller])
+        summaries[caller] = reduced.add_node(None, label)
+        reduced.set_flag(summaries[caller], SUMMARY)
+
+    for caller, callee, addresses in graph.edges():
+        if caller in groups and callee in groups[caller]:
+            dst = summaries[caller]
+        elif callee in mapping:
+            dst = mapping[callee]
+        else:
+            continue
+        if caller not in mapping:
+            continue
+        for address in addresses:
+            reduced.add_edge(mapping[caller], dst, address)
+
+    return reduced.freeze()
+
+
+def keep_top_k(graph, k):
+    '''Keeps the k nodes with the largest fan-in plus fan-out and the edges
+    between them.
+    '''
+    degree = [0] * len(graph)
+    for caller, callee, _ in graph.edges():
+        degree[caller] += 1
+        degree[callee] += 1
+
+    nodes = sorted(live_nodes(graph), key=lambda node: (-degree[node], node))[:k]
+
+    reduced = CallGraph()
+    mapping = {}
+    for node in sorted(nodes):
+        mapping[node] = _copy_node(graph, node, reduced)
+
+    for caller, callee, addresses in graph.edges():
+        if caller in mapping and callee in mapping:
+            for address in addresses:
+                reduced.add_edge(mapping[caller], mapping[callee], address)
+
+    return reduced.freeze()
+
+
+def reduce_graph(graph, top_k=None, min_nodes=REDUCE_MIN_NODES,
+    max_nodes=MAX_RENDER_NODES):
+    '''Reduces graph until it is small enough to lay out.
+
+    Graphs of up to min_nodes nodes are returned unchanged. Larger ones get
+    cycles condensed and leaves collapsed, then are cut down to the top_k
+    (or max_nodes, if still larger) nodes by degree.
+
+    Returns:
+        CallGraph and a list of the steps applied, for display.
+    '''
+    steps = []
+    count = len(live_nodes(graph))
+
+    if count > min_nodes:
+        graph = condense_cycles(graph)
+        graph = collapse_leaves(graph)
+        steps.append('{} functions reduced to {} nodes'.format(count, len(graph)))
+
+    if top_k is None and len(graph) > max_nodes:
+        top_k = max_nodes
+
+    if top_k is not None and len(graph) > top_k:
+        steps.append('top {} of {} nodes by degree'.format(top_k, len(graph)))
+        graph = keep_top_k(graph, top_k)
+
+    return graph, steps
+
+
+def paginate(graph, max_nodes=PAGE_NODES):
+    '''Splits graph into pages owning at most max_nodes nodes each.
+    Connected parts of the graph are packed onto pages whole when they fit,
+    larger ones are cut in breadth first order. A callee owned by another
+    page is copied onto the caller's page and flagged EXTERNAL, while the
+    page draws fewer than max_nodes nodes. Further ones are counted in one
+    SUMMARY node.
+
+    Returns:
+        List of CallGraph, one per page.
+    '''
+    nodes = live_nodes(graph)
+    if len(nodes) <= max_nodes:
+        return [graph]
+
+    neighbours = dict((node, []) for node in nodes)
+    for caller, callee, _ in graph.edges():
+        neighbours[caller].append(callee)
+        neighbours[callee].append(caller)
+
+    # Weakly connected components, each in breadth first order.
+    seen = set()
+    components = []
+    for root in nodes:
+        if root in seen:
+            continue
+        seen.add(root)
+        order = []
+        worklist = deque([root])
+        while worklist:
+            node = worklist.popleft()
+            order.append(node)
+            for neighbour in neighbours[node]:
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    worklist.append(neighbour)
+        components.append(order)
+
+    pages = [[]]
+    for order in components:
+        if len(order) > max_nodes:
+            for index in range(0, len(order), max_nodes):
+                pages.append(order[index:index + max_nodes])
+            pages.append([])
+        elif len(pages[-1]) + len(order) > max_nodes:
+            pages.append(list(order))
+        else:
+            pages[-1].extend(order)
+    pages = [page for page in pages if page]
+
+    page_of = {}
+    for index, page in enumerate(pages):
+        for node in page:
+            page_of[node] = index
+
+    # Callees owned by other pages, in order of their first call. They are
+    # copied while the page has room, the rest share one summary node.
+    externals = [[] for _ in pages]
+    copied = set()
+    for caller, callee, _ in graph.edges():
+        index = page_of[caller]
+        if page_of[callee] != index and (index, callee) not in copied:
+            copied.add((index, callee))
+            externals[index].append(callee)
+
+    graphs = []
+    for index, page in enumerate(pages):
+        reduced = CallGraph()
+        mapping = {}
+        for node in sorted(page):
+            mapping[node] = _copy_node(graph, node, reduced)
+
+        room = max(max_nodes - len(page), 0)
+        for callee in externals[index][:room]:
+            mapping[callee] = _copy_node(graph, callee, reduced)
+            reduced.set_flag(mapping[callee], EXTERNAL)
+
+        excess = len(externals[index]) - room
+        if excess > 0:
+            summary = reduced.add_node(None, '{} more callees'.format(excess))
+            reduced.set_flag(summary, SUMMARY | EXTERNAL)
+            for callee in externals[index][room:]:
+                mapping[callee] = summary
+        graphs.append((reduced, mapping))
+
+    for caller, callee, addresses in graph.edges():
+        reduced, mapping = graphs[page_of[caller]]
+        for address in addresses:
+            reduced.add_edge(mapping[caller], mapping[callee], address)
+
+    return [reduced.freeze() for reduced, _ in graphs]
@@ -0,0 +1,205 @@
+'''Graphviz rendering through pipes.
+
+The DOT source is fed to the first process on stdin and the image is read
+from the last process's stdout, so nothing is written to disk. The graph is
+laid out once: small graphs by dot, after which gvpack packs the components
+and neato -n2 renders the positions it is given without laying the graph out
+again. Larger graphs go straight to neato or sfdp, see choose_engine().
+
+render_pinned() lays out with neato around nodes pinned where an earlier
+layout put them, so a graph that grows keeps its shape.
+'''
+import functools
+import os
+import shlex
+import subprocess
+import threading
+
+
+# Where graphviz is often installed but missing from the PATH Binary Ninja
+# was started with, e.g. from the macOS Dock.
+GRAPHVIZ_DIRS = ['/usr/local/bin/']
+# Seconds allowed for a whole pipeline run.
+RENDER_TIMEOUT = 300
+# Largest graphs given to each layout engine, as (nodes, edges).
+DOT_LIMIT = (300, 1000)
+NEATO_LIMIT = (1000, 3000)
+
+
+class RenderError(Exception):
+    '''Graphviz failed or timed out. The message holds its stderr.'''
+
+
+@functools.lru_cache(maxsize=None)
+def graphviz_path():
+    '''Appends GRAPHVIZ_DIRS to PATH, once, before graphviz is first run.'''
+    paths = os.environ.get('PATH', '').split(os.pathsep)
+    for directory in GRAPHVIZ_DIRS:
+        if directory not in paths:
+            os.environ['PATH'] = os.pathsep.join(paths + [directory])
+            paths.append(directory)
+    return os.environ['PATH']
+
+
+def choose_engine(nodes, edges):
+    '''Picks the layout engine for a graph of this size. dot's hierarchical
+    layout reads best but grows much faster than linearly, neato handles
+    medium graphs and sfdp's multilevel force layout scales to large ones.
+    '''
+    if nodes <= DOT_LIMIT[0] and edges <= DOT_LIMIT[1]:
+        return 'dot'
+    if nodes <= NEATO_LIMIT[0] and edges <= NEATO_LIMIT[1]:
+        return 'neato'
+    return 'sfdp'
+
+
+def layout_pipeline(file_type, engine='dot'):
+    '''Command lines laying out and rendering a graph with engine.'''
+    if engine == 'dot':
+        # Improves the aspect ratio of dot layouts.
+        return [
+            ['unflatten', '-f', '-l4', '-c6'],
+            ['dot'],
+            ['gvpack', '-array_t6'],
+            ['neato', '-s', '-n2', '-T' + file_type],
+        ]
+
+    return [[engine, '-Goverlap=prism', '-Gsplines=false', '-T' + file_type]]
+
+
+def run_pipeline(commands, source, timeout=RENDER_TIMEOUT):
+    '''Runs commands as a shell style pipeline.
+
+    Arguments:
+        commands:   List of argument lists.
+        source:     Bytes written to the first command's stdin.
+        timeout:    Seconds before every process is killed.
+
+    Returns:
+        Output of the last command, and the stderr of every command as one
+        string (warnings graphviz printed on success).
+
+    Raises:
+        RenderError if a command can't be started, fails or times out.
+    '''
+    graphviz_path()
+    procs = []
+    readers = []
+
+    try:
+        for command in commands:
+            stdin = procs[-1].stdout if procs else subprocess.PIPE
+            proc = subprocess.Popen(command,
+                                    stdin=stdin,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE,
+                                    )
+            if procs:
+                # Only the next process reads this pipe now.
+                procs[-1].stdout.close()
+            procs.append(proc)
+    except OSError as e:
+        for proc in procs:
+            proc.kill()
+            proc.wait()
+        raise RenderError('Unable to run {}: {}'.format(command[0], e))
+
+    def drain(proc, index):
+        errors[index] = proc.stderr.read()
+
+    def feed(stdin):
+        try:
+            stdin.write(source)
+        except (IOError, OSError):
+            pass
+        finally:
+            stdin.close()
+
+    # Every pipe is drained on its own thread so none of them can fill up.
+    errors = [b''] * len(procs)
+    for index, proc in enumerate(procs[:-1]):
+        reader = threading.Thread(target=drain, args=(proc, index))
+        reader.daemon = True
+        reader.start()
+        readers.append(reader)
+
+    if len(procs) > 1:
+        writer = threading.Thread(target=feed, args=(procs[0].stdin,))
+        writer.daemon = True
+        writer.start()
+        stdin_data = None
+    else:
+        writer = None
+        stdin_data = source
+
+    last = procs[-1]
+    try:
+        output, errors[-1] = last.communicate(stdin_data, timeout=timeout)
+        for proc in procs[:-1]:
+            proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        for proc in procs:
+            proc.kill()
+        for proc in procs:
+            proc.wait()
+        raise RenderError('Graphviz timed out after {} seconds'.format(timeout))
+    finally:
+        for reader in readers:
+            reader.join()
+        if writer:
+            writer.join()
+
+    stderr = '\n'.join(e.decode('utf-8', 'replace').strip() for e in errors if e.strip())
+
+    # A failing process makes the ones before it die of SIGPIPE, report the
+    # last one.
+    for command, proc in reversed(list(zip(commands, procs))):
+        if proc.returncode != 0:
+            raise RenderError('{} exited with {}\n{}'.format(
+                command[0], proc.returncode, stderr))
+
+    return output, stderr
+
+
+def render_source(source, file_type, engine='dot', timeout=RENDER_TIMEOUT):
+    '''Lays out DOT source with engine and returns the image bytes and
+    graphviz warnings.
+    '''
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+
+    return run_pipeline(layout_pipeline(file_type, engine), source, timeout=timeout)
+
+
+def plain_positions(plain):
+    '''Returns {node name: (x, y)} in points from graphviz -Tplain output.'''
+    positions = {}
+    for line in plain.decode('utf-8', 'replace').splitlines():
+        if not line.startswith('node '):
+            continue
+        try:
+            fields = shlex.split(line)
+            positions[fields[1]] = (float(fields[2]) * 72, float(fields[3]) * 72)
+        except (ValueError, IndexError):
+            continue
+    return positions
+
+
+def render_pinned(source, file_type, timeout=RENDER_TIMEOUT):
+    '''Lays out DOT source with neato, leaving nodes with a pinned position
+    (pos="x,y!" in points) in place, and renders it.
+
+    Returns:
+        Image bytes, {node name: (x, y)} positions in points of every node,
+        and graphviz warnings.
+    '''
+    if not isinstance(source, bytes):
+        source = source.encode('utf-8')
+
+    laid_out, warnings = run_pipeline([['neato', '-s', '-Goverlap=prism', '-Gsplines=false',
+        '-Tdot']], source, timeout=timeout)
+    # Both read the positions just computed, neither lays the graph out again.
+    image, _ = run_pipeline([['neato', '-n2', '-T' + file_type]], laid_out, timeout=timeout)
+    plain, _ = run_pipeline([['neato', '-n2', '-Tplain']], laid_out, timeout=timeout)
+
+    return image, plain_positions(plain), warnings
@@ -0,0 +1,105 @@
+'''Content addressed cache of rendered flowgraph images.
+
+Images are stored as <sha256>.<format>, where the digest covers the DOT
+source, the styles, the output format and the layout engine. Identical
+graphs map to the same file whatever binary or function they came from, so
+concurrent runs never overwrite each other's output. Files are written to a
+temporary name and renamed into place. The directory is kept under a size
+bound by evicting the least recently used files, hits refresh a file's
+modification time.
+'''
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+RENDER_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.binoculars', 'render')
+# Bytes kept in the cache directory.
+RENDER_CACHE_SIZE = 256 << 20
+
+
+def render_key(source, styles, file_type, engine):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([styles, file_type, engine], sort_keys=True).encode('utf-8'))
+    digest.update(source.encode('utf-8') if not isinstance(source, bytes) else source)
+    return digest.hexdigest()
+
+
+class RenderCache(object):
+
+    def __init__(self, directory=None, size=RENDER_CACHE_SIZE):
+        self.directory = directory or RENDER_CACHE_PATH
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path(self, key, file_type):
+        return os.path.join(self.directory, '{}.{}'.format(key, file_type))
+
+    def get(self, key, file_type):
+        '''Returns the path of the cached image, or None.'''
+        path = self.path(key, file_type)
+
+        try:
+            # Marks the file as recently used.
+            os.utime(path, None)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return path
+
+    def put(self, key, file_type, data):
+        '''Stores data and returns its path.'''
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+
+        path = self.path(key, file_type)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        self.evict(keep=os.path.basename(path))
+        return path
+
+    def evict(self, keep=None):
+        '''Removes least recently used files, other than keep, until the
+        directory fits in the size bound. Files removed by another process
+        meanwhile are skipped.
+        '''
+        with self._lock:
+            entries = []
+            total = 0
+
+            for name in os.listdir(self.directory):
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name, stat.st_size))
+                total += stat.st_size
+
+            entries.sort()
+            for _, name, size in entries:
+                if total <= self.size:
+                    break
+                if name == keep:
+                    continue
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                total -= size
@@ -0,0 +1,64 @@
+'''HTML reports for rendered flowgraphs.
+
+SVG images are inlined as markup, raster images as base64 data URIs. Large
+graphs are split into pages (see reduction.paginate) and written to an HTML
+file one page at a time, so only a single page image is held in memory.
+'''
+
+
+HTML_HEADER = """
+<html>
+<title>%s</title>
+<body>
+<div align='center'>
+    <h1>%s</h1>
+</div>
+"""
+
+HTML_FOOTER = """
+</body>
+</html>
+"""
+
+
+def image_html(image, file_type):
+    '''Returns the markup displaying image.'''
+    if file_type == 'svg':
+        markup = image.decode('utf-8', 'replace')
+        # Drop the XML prolog and doctype, they aren't valid inside HTML.
+        return markup[max(markup.find('<svg'), 0):]
+
+    import base64
+    return "<img src='data:image/%s;base64,%s' alt='flowgraph'>" % (
+        file_type, base64.b64encode(image).decode('ascii'))
+
+
+def single_page(title, image, file_type):
+    '''HTML of a report showing one image.'''
+    return ''.join([
+        HTML_HEADER % (title, title),
+        "<div align='center'>\n",
+        image_html(image, file_type),
+        "\n</div>\n",
+        HTML_FOOTER,
+    ])
+
+
+class PagedReport(object):
+    '''Writes a multi page report to f, a text file, page by page.'''
+
+    def __init__(self, f, title, page_titles):
+        self.f = f
+        self.f.write(HTML_HEADER % (title, title))
+        self.f.write("<div align='center'>\n")
+        for index, page_title in enumerate(page_titles):
+            self.f.write("<a href='#page%d'>%s</a><br>\n" % (index, page_title))
+        self.f.write("</div>\n")
+
+    def add_page(self, index, title, image, file_type):
+        self.f.write("<hr>\n<div align='center' id='page%d'>\n<h2>%s</h2>\n" % (index, title))
+        self.f.write(image_html(image, file_type))
+        self.f.write("\n</div>\n")
+
+    def close(self):
+        self.f.write(HTML_FOOTER)
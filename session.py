@@ -0,0 +1,28 @@
+'''State shared between BINoculars runs on the same BinaryView.
+
+Objects are stored in bv.session_data, which lives as long as the view, so
+caches built by one run are reused by the next. Views without session_data
+(older Binary Ninja builds) fall back to a module level table keyed by view.
+'''
+import threading
+
+
+_lock = threading.Lock()
+_fallback = {}
+
+
+def get_session_object(bv, key, factory):
+    '''Returns the object stored under key for bv, creating it with
+    factory(bv) on first use.
+    '''
+    with _lock:
+        data = getattr(bv, 'session_data', None)
+        if data is None:
+            data = _fallback.setdefault(id(bv), {})
+
+        obj = data.get(key)
+        if obj is None:
+            obj = factory(bv)
+            data[key] = obj
+
+        return obj
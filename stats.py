@@ -0,0 +1,161 @@
+'''Phase timers and counters for BINoculars tasks.
+
+A task creates one RunStats, wraps each phase of its work in phase() and
+bumps counters with count(). The task's progress string shows the current
+phase, its elapsed time, the counters and, for work with a known size
+reported through step(), an estimate of the time left. report() logs a JSON
+summary when the task ends. Nested phases are included in their parent's time.
+
+profiled() optionally runs a task under cProfile, for deep dives.
+'''
+from binaryninja import *
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+# Minimum seconds between progress string updates from count().
+PROGRESS_INTERVAL = 0.5
+# Set to a file name to profile every task, see profiled().
+PROFILE_ENV = 'BINOCULARS_PROFILE'
+
+
+class RunStats(object):
+
+    def __init__(self, task=None, title=''):
+        self.task = task
+        self.title = title
+        self.seconds = OrderedDict()
+        self.counters = OrderedDict()
+        self.steps = OrderedDict()
+        self.started = time.perf_counter()
+        self._phases = []
+        self._updated = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        self._phases.append((name, started))
+        self.update(force=True)
+
+        try:
+            yield
+        finally:
+            self._phases.pop()
+            with self._lock:
+                self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - started
+            self.update(force=True)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        self.update()
+
+    def set(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+        self.update()
+
+    def step(self, name, done, total):
+        '''Records that done of total items are finished.'''
+        now = time.perf_counter()
+        with self._lock:
+            if name in self.steps:
+                _, _, started, first = self.steps[name]
+            else:
+                started, first = now, done
+            self.steps[name] = (done, total, started, first)
+        self.update()
+
+    def eta(self, name):
+        '''Seconds left for step name at the rate seen so far, or None.'''
+        done, total, started, first = self.steps[name]
+        if done <= first:
+            return None
+        return (time.perf_counter() - started) / (done - first) * (total - done)
+
+    def progress(self):
+        '''Progress string: current phase and counters.'''
+        now = time.perf_counter()
+        parts = []
+
+        if self._phases:
+            name, started = self._phases[-1]
+            parts.append('{} {:.1f}s'.format(name, now - started))
+        else:
+            parts.append('{:.1f}s'.format(now - self.started))
+
+        with self._lock:
+            parts.extend('{} {}'.format(value, name) for name, value in self.counters.items())
+            for name, (done, total, _, _) in self.steps.items():
+                if done >= total:
+                    continue
+                eta = self.eta(name)
+                parts.append('{}/{} {}{}'.format(done, total, name,
+                    ', {:.0f}s left'.format(eta) if eta is not None else ''))
+
+        return '{}: {}'.format(self.title, ', '.join(parts))
+
+    def update(self, force=False):
+        if self.task is None:
+            return
+
+        now = time.perf_counter()
+        if force or now - self._updated >= PROGRESS_INTERVAL:
+            self._updated = now
+            self.task.progress = self.progress()
+
+    def summary(self):
+        with self._lock:
+            return {
+                'task': self.title,
+                'seconds': time.perf_counter() - self.started,
+                'phases': dict(self.seconds),
+                'counters': dict(self.counters),
+                'steps': dict((name, [done, total])
+                    for name, (done, total, _, _) in self.steps.items()),
+            }
+
+    def report(self):
+        '''Logs the summary and returns it.'''
+        summary = self.summary()
+        log_info('{} stats: {}'.format(self.title, json.dumps(summary, sort_keys=True)))
+        return summary
+
+
+@contextmanager
+def profiled(profile=None):
+    '''Runs the enclosed block under cProfile.
+
+    Arguments:
+        profile:    File name the profile is written to, for pstats or
+                    snakeviz, or True to print the top functions by
+                    cumulative time. Defaults to the BINOCULARS_PROFILE
+                    environment variable. None or False doesn't profile.
+    '''
+    if profile is None:
+        profile = os.environ.get(PROFILE_ENV)
+
+    if not profile:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if profile is True:
+            pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(30)
+        else:
+            profiler.dump_stats(profile)
+            log_info('Profile written to {}'.format(profile))
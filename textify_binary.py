@@ -0,0 +1,138 @@
+'''Text listing of every function of a binary in one file.
+
+Functions are textified in chunks on a thread pool and written in address
+order, with at most a few chunks held in memory. An offset index is written
+next to the listing (see textify_index.py), and Textify Function serves
+listings from it while the function is unchanged.
+'''
+from binaryninja import *
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import tempfile
+
+from .graph_cache import function_fingerprint
+from .stats import RunStats, profiled
+from .textify_function import listing_lines
+from .textify_index import get_textify_indexes, index_path, write_index
+
+
+# Worker threads and functions per work item.
+TEXTIFY_WORKERS = min(8, os.cpu_count() or 1)
+TEXTIFY_CHUNK_SIZE = 64
+
+
+class BinocularsTextifyBinary(BackgroundTaskThread):
+
+    def __init__(self, bv, *args, **kwargs):
+        BackgroundTaskThread.__init__(self, '', True)
+        self.progress = "Binoculars Textifying Binary"
+        self.bv = bv
+        '''Listing file, prompted for when not given.'''
+        self.filename = kwargs.get('filename')
+        self.workers = kwargs.get('workers') or TEXTIFY_WORKERS
+        self.stats = RunStats(self, 'Binoculars Textify Binary')
+        self.profile = kwargs.get('profile')
+
+
+    def __textify_chunk(self, functions):
+        '''Worker: returns (start, fingerprint, encoded listing) per function,
+        or None if the task is cancelled.
+        '''
+        results = []
+        for function in functions:
+            if self.cancelled:
+                return None
+            text = ''.join(line for lines in listing_lines(function) for line in lines)
+            results.append((function.start, function_fingerprint(function),
+                text.encode('utf-8')))
+        return results
+
+
+    def textify_binary(self, filename):
+        '''Writes the listing of every function to filename and its index to
+        filename.idx. Both are replaced atomically, so readers of an older
+        listing are unaffected.
+
+        Returns:
+            Number of functions written, or None if cancelled.
+        '''
+        functions = sorted(self.bv.functions, key=lambda function: function.start)
+        chunks = [functions[i:i + TEXTIFY_CHUNK_SIZE]
+            for i in range(0, len(functions), TEXTIFY_CHUNK_SIZE)]
+
+        starts = array('Q')
+        fingerprints = array('Q')
+        offsets = array('Q')
+        lengths = array('Q')
+        offset = 0
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+        def write(f, results):
+            nonlocal offset
+            for start, fingerprint, data in results:
+                f.write(data)
+                starts.append(start)
+                fingerprints.append(fingerprint)
+                offsets.append(offset)
+                lengths.append(len(data))
+                offset += len(data)
+            self.stats.step('functions', len(starts), len(functions))
+
+        try:
+            with os.fdopen(fd, 'wb') as f, \
+                    ThreadPoolExecutor(max_workers=self.workers) as pool, \
+                    self.stats.phase('textify'):
+                pending = deque()
+                for chunk in chunks:
+                    if self.cancelled:
+                        break
+                    pending.append(pool.submit(self.__textify_chunk, chunk))
+                    # Bounds the listings held in memory.
+                    while len(pending) > 2 * self.workers:
+                        results = pending.popleft().result()
+                        if results is not None:
+                            write(f, results)
+
+                while pending:
+                    results = pending.popleft().result()
+                    if results is not None and not self.cancelled:
+                        write(f, results)
+
+            if self.cancelled:
+                os.remove(tmp_path)
+                return None
+
+            os.replace(tmp_path, filename)
+        except (IOError, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        write_index(filename, starts, fingerprints, offsets, lengths)
+        self.stats.count('bytes', offset)
+        return len(starts)
+
+
+    def run(self):
+        try:
+            with profiled(self.profile):
+                filename = self.filename
+                if filename is None:
+                    filename = get_save_filename_input("Textify binary to", "txt")
+                    if not filename:
+                        return
+                    if isinstance(filename, bytes):
+                        filename = filename.decode('utf-8')
+
+                if self.textify_binary(filename) is None:
+                    return
+
+                get_textify_indexes(self.bv).add(filename)
+                log_info('Binoculars Text Disasm written to {}, index {}'.format(
+                    filename, index_path(filename)))
+        finally:
+            self.stats.report()
@@ -1,4 +1,31 @@
 from binaryninja import *
+import html
+import io
+
+from .stats import RunStats, profiled
+from .textify_index import get_textify_indexes
+
+
+def listing_lines(function, escape=None):
+    '''Yields the disassembly listing of function one basic block at a time,
+    as a list of lines.
+
+    Arguments:
+        escape: Optional function applied to every line, e.g. html.escape.
+    '''
+    # Resolved once, not per instruction.
+    name = function.name
+    start = function.start
+
+    for basic_block in sorted(function.basic_blocks, key=lambda bb: bb.start):
+        lines = []
+        for inst in basic_block.get_disassembly_text():
+            if str(inst.tokens[0]) == name: continue
+
+            line = "%#x <%s+%d>:    %s\n" % \
+                (inst.address, name, inst.address - start, str(inst))
+            lines.append(escape(line) if escape else line)
+        yield lines
 
 
 class BinocularsTextifyFunction(BackgroundTaskThread):
@@ -8,51 +35,101 @@ class BinocularsTextifyFunction(BackgroundTaskThread):
         self.progress = "Binoculars Textifying Function"
         self.bv = bv
         self.function = function
+        '''Phase timings and counters, see stats.py.'''
+        self.stats = RunStats(self, 'Binoculars Textify')
+        self.profile = kwargs.get('profile')
+        '''Also print the listing to the console.'''
+        self.echo = kwargs.get('echo', False)
+        '''Write the listing to this file instead of showing a report.'''
+        self.filename = kwargs.get('filename')
 
 
-    def textify_function_plain(self):
-        output = ''
-        basic_blocks = sorted(self.function.basic_blocks, key=lambda bb: bb.start)
+    def write_listing(self, f, escape=None):
+        '''Writes the disassembly listing of the function to f, one basic
+        block in memory at a time.
+
+        Arguments:
+            f:      Text file or buffer.
+            escape: Optional function applied to every line, e.g. html.escape.
+
+        Returns:
+            Number of characters written.
+        '''
+        written = 0
+        blocks = len(self.function.basic_blocks)
+
+        with self.stats.phase('textify'):
+            for done, lines in enumerate(listing_lines(self.function, escape)):
+                if self.cancelled:
+                    break
+                f.writelines(lines)
+                written += sum(len(line) for line in lines)
 
-        for basic_block in basic_blocks:
-            for inst in basic_block.get_disassembly_text():
-                if str(inst.tokens[0]) == self.function.name: continue
+                self.stats.count('lines', len(lines))
+                self.stats.step('blocks', done + 1, blocks)
 
-                addr = hex(inst.address).replace("L", "")
-                offset = inst.address - self.function.start
-                output += "%s <%s+%d>:    %s\n" %\
-                (addr, self.function.name, offset, str(inst))
+        self.stats.count('bytes', written)
+        return written
 
-        print(output)                
-        show_plain_text_report("Binoculars Text Disasm", output)
+
+    def textify_function_text(self):
+        '''Returns the disassembly listing of the function, from the index
+        of a whole binary listing when it has the function: one written by
+        Textify Binary, or opened with Load Textify Index (see
+        textify_index.py).
+        '''
+        indexed = get_textify_indexes(self.bv).listing(self.function)
+        if indexed is not None:
+            self.stats.count('indexed')
+            return indexed
+
+        output = io.StringIO()
+        self.write_listing(output)
+        return output.getvalue()
+
+
+    def textify_function_file(self, filename):
+        '''Streams the disassembly listing of the function to filename.'''
+        with open(filename, 'w', encoding='utf-8') as f:
+            self.write_listing(f)
+        log_info('Binoculars Text Disasm written to {}'.format(filename))
+
+
+    def textify_function_plain(self):
+        if self.filename:
+            self.textify_function_file(self.filename)
+            return
+
+        output = self.textify_function_text()
+        if self.cancelled:
+            return
+
+        with self.stats.phase('report'):
+            if self.echo:
+                print(output)
+            show_plain_text_report("Binoculars Text Disasm", output)
 
 
     # TODO: syntax highlight
     def textify_function_html(self):
-        output = ''
-        basic_blocks = sorted(self.function.basic_blocks, key=lambda bb: bb.start)
-
-        for basic_block in basic_blocks:
-            for inst in basic_block.get_disassembly_text():
-                if str(inst.tokens[0]) == self.function.name: continue
-
-                addr = hex(inst.address).replace("L", "")
-                offset = inst.address - self.function.start
-                output += "%s <%s+%d>:    %s\n" %\
-                (addr, self.function.name, offset, str(inst))
-
-        html = """
-        <html>
-        <head></head>
-        <body>
-        %s
-        </body>
-        </html>
-        """ %(output)
-        print(html)
-        show_html_report("Binoculars Text Disasm", output)
+        output = io.StringIO()
+        output.write("<html>\n<head></head>\n<body>\n<pre>\n")
+        self.write_listing(output, escape=html.escape)
+        output.write("</pre>\n</body>\n</html>\n")
+        if self.cancelled:
+            return
+
+        output = output.getvalue()
+        with self.stats.phase('report'):
+            if self.echo:
+                print(output)
+            show_html_report("Binoculars Text Disasm", output)
 
 
     def run(self):
-        #self.textify_function_html()
-        self.textify_function_plain()
+        try:
+            with profiled(self.profile):
+                #self.textify_function_html()
+                self.textify_function_plain()
+        finally:
+            self.stats.report()
@@ -0,0 +1,331 @@
+'''Offset index of a whole binary text listing.
+
+BinocularsTextifyBinary writes the listing of every function to one file
+and this index next to it, as <listing>.idx. The index maps each function
+start to the byte offset and length of its listing, so one function is read
+back from the memory-mapped listing without disassembling it again. The
+fingerprint of each function (see graph_cache.function_fingerprint) is
+stored too: a function changed by analysis since is not served from the
+index.
+
+The listings added are remembered in the view's metadata, so a later
+session that saved them in its database serves them again. Any other
+listing, e.g. one written by the batch driver, is opened with the Load
+Textify Index command.
+
+Listings also show names and types the fingerprint doesn't cover. A
+BinaryDataNotification marks the functions of every loaded index stale when
+they're updated, when a symbol or data variable they reference changes, and
+all of them when a type is defined or undefined.
+
+Layout, all integers little endian:
+    8 bytes     INDEX_MAGIC
+    4 bytes     header length
+    n bytes     JSON header, padded with spaces to a multiple of 8
+    u64 arrays  starts, fingerprints, offsets, lengths
+Starts are sorted.
+'''
+from binaryninja import *
+from bisect import bisect_left
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from .graph_cache import _from_bytes, _to_bytes, function_fingerprint
+from .session import get_session_object
+
+
+INDEX_VERSION = 1
+INDEX_MAGIC = b'BINOTX01'
+# View metadata key holding the listings added, most recent first.
+LISTINGS_METADATA = 'binoculars.textify_listings'
+
+
+def index_path(filename):
+    return filename + '.idx'
+
+
+def get_textify_indexes(bv):
+    '''Returns the TextifyIndexes of listings written or loaded for bv.'''
+    return get_session_object(bv, 'binoculars.textify_indexes', TextifyIndexes)
+
+
+def write_index(filename, starts, fingerprints, offsets, lengths):
+    '''Writes the index of the listing filename, atomically.'''
+    header = json.dumps({
+        'version': INDEX_VERSION,
+        'listing': os.path.basename(filename),
+        'functions': len(starts),
+    }).encode('utf-8')
+
+    # Pad so the arrays start on an 8 byte boundary.
+    header += b' ' * (-(12 + len(header)) % 8)
+
+    path = index_path(filename)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(INDEX_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for values in (starts, fingerprints, offsets, lengths):
+                f.write(_to_bytes(values))
+
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TextifyIndex(object):
+    '''Read access to a listing through its index.
+
+    Raises:
+        ValueError if the index is missing, damaged or of another version.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+
+        try:
+            with open(index_path(filename), 'rb') as f:
+                data = f.read()
+        except (IOError, OSError) as e:
+            raise ValueError('Unable to read index: {}'.format(e))
+
+        if data[:8] != INDEX_MAGIC:
+            raise ValueError('Not a textify index')
+
+        try:
+            header_length = struct.unpack('<I', data[8:12])[0]
+            header = json.loads(data[12:12 + header_length].decode('utf-8'))
+            count = header['functions']
+            if header['version'] != INDEX_VERSION:
+                raise ValueError('Index version {}'.format(header['version']))
+        except (KeyError, struct.error) as e:
+            raise ValueError('Damaged index: {}'.format(e))
+
+        offset = 12 + header_length
+        sections = []
+        for _ in range(4):
+            sections.append(_from_bytes(data[offset:offset + 8 * count]))
+            offset += 8 * count
+        self.starts, self.fingerprints, self.offsets, self.lengths = sections
+
+        '''Starts of functions whose listing may be out of date.'''
+        self.stale = set()
+
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap can't map an empty file.
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __contains__(self, start):
+        return self._find(start) is not None
+
+    def _find(self, start):
+        index = bisect_left(self.starts, start)
+        if index < len(self.starts) and self.starts[index] == start:
+            return index
+        return None
+
+    def listing(self, start, fingerprint=None):
+        '''Returns the listing of the function at start, or None if it isn't
+        indexed or its fingerprint differs from the one given.
+        '''
+        index = self._find(start)
+        if index is None:
+            return None
+        if fingerprint is not None and self.fingerprints[index] != fingerprint:
+            return None
+
+        offset = self.offsets[index]
+        return self._map[offset:offset + self.lengths[index]].decode('utf-8')
+
+    def close(self):
+        if self._map:
+            self._map.close()
+        self._file.close()
+
+
+class TextifyIndexNotification(BinaryDataNotification):
+    '''Records what may make indexed listings stale. Only records addresses,
+    callers are resolved by TextifyIndexes.listing.
+    '''
+
+    def __init__(self, indexes):
+        BinaryDataNotification.__init__(self)
+        self.indexes = indexes
+
+    def function_added(self, view, func):
+        self.indexes.invalidate(func.start)
+
+    def function_removed(self, view, func):
+        self.indexes.invalidate(func.start)
+
+    def function_updated(self, view, func):
+        self.indexes.invalidate(func.start)
+
+    def symbol_added(self, view, sym):
+        self.indexes.invalidate_references(sym.address)
+
+    def symbol_updated(self, view, sym):
+        self.indexes.invalidate_references(sym.address)
+
+    def symbol_removed(self, view, sym):
+        self.indexes.invalidate_references(sym.address)
+
+    def data_var_added(self, view, var):
+        self.indexes.invalidate_references(var.address)
+
+    def data_var_updated(self, view, var):
+        self.indexes.invalidate_references(var.address)
+
+    def data_var_removed(self, view, var):
+        self.indexes.invalidate_references(var.address)
+
+    def type_defined(self, view, name, type):
+        self.indexes.invalidate_all()
+
+    def type_undefined(self, view, name, type):
+        self.indexes.invalidate_all()
+
+
+class TextifyIndexes(object):
+    '''Listings of one BinaryView, most recent first.'''
+
+    def __init__(self, bv):
+        self.bv = bv
+        self._indexes = []
+        self._referenced = set()
+        self._lock = threading.Lock()
+        self._restored = False
+        self.notification = None
+
+    def invalidate(self, start):
+        with self._lock:
+            for index in self._indexes:
+                index.stale.add(start)
+
+    def invalidate_references(self, address):
+        '''Marks the function at address and its referrers stale, e.g. after
+        a rename.
+        '''
+        with self._lock:
+            if self._indexes:
+                self._referenced.add(address)
+
+    def invalidate_all(self):
+        with self._lock:
+            indexes, self._indexes = self._indexes, []
+            self._referenced = set()
+        for index in indexes:
+            index.close()
+
+    def __resolve(self):
+        '''Marks the functions referencing recorded addresses stale.'''
+        with self._lock:
+            referenced, self._referenced = self._referenced, set()
+
+        starts = set(referenced)
+        for address in referenced:
+            for ref in self.bv.get_code_refs(address):
+                if ref.function is not None:
+                    starts.add(ref.function.start)
+
+        if starts:
+            with self._lock:
+                for index in self._indexes:
+                    index.stale.update(starts)
+
+    def __saved(self):
+        '''Listings stored in the view's metadata.'''
+        try:
+            filenames = self.bv.query_metadata(LISTINGS_METADATA)
+        except (AttributeError, KeyError):
+            return []
+        return [filename for filename in filenames if isinstance(filename, str)]
+
+    def __restore(self):
+        '''Opens the listings stored in the view's metadata, once.'''
+        with self._lock:
+            if self._restored:
+                return
+            self._restored = True
+
+        for filename in reversed(self.__saved()):
+            try:
+                self.add(filename, save=False)
+            except ValueError:
+                # Moved or deleted since.
+                pass
+
+    def add(self, filename, save=True):
+        '''Serves listings from filename and its index, in preference to the
+        ones added before. save also remembers it in the view's metadata.
+
+        Raises:
+            ValueError if the listing or its index can't be read.
+        '''
+        filename = os.path.abspath(filename)
+        try:
+            index = TextifyIndex(filename)
+        except (IOError, OSError) as e:
+            raise ValueError('Unable to read listing: {}'.format(e))
+
+        if save:
+            # Listings saved earlier go behind this one.
+            self.__restore()
+        if self.notification is None:
+            self.notification = TextifyIndexNotification(self)
+            self.bv.register_notification(self.notification)
+
+        with self._lock:
+            for old in [old for old in self._indexes if old.filename == filename]:
+                self._indexes.remove(old)
+                old.close()
+            self._indexes.insert(0, index)
+
+        if save and hasattr(self.bv, 'store_metadata'):
+            filenames = [filename] + [old for old in self.__saved() if old != filename]
+            self.bv.store_metadata(LISTINGS_METADATA, filenames)
+        return index
+
+    def listing(self, function):
+        '''Returns the indexed listing of function, or None if no listing has
+        it as currently analysed.
+        '''
+        self.__restore()
+        self.__resolve()
+        with self._lock:
+            indexes = list(self._indexes)
+
+        if not indexes:
+            return None
+
+        fingerprint = function_fingerprint(function)
+        for index in indexes:
+            if function.start in index.stale:
+                continue
+            try:
+                text = index.listing(function.start, fingerprint)
+            except (ValueError, OSError):
+                # Listing file replaced or truncated since.
+                continue
+            if text is not None:
+                return text
+
+        return None
+
+    def close(self):
+        if self.notification is not None:
+            self.bv.unregister_notification(self.notification)
+            self.notification = None